@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the construction of many small model instances
+
+Compares the construction time with the memoryview schema searched
+for every instance (as before the per-class cache) to the construction
+time with the cached schema.
+
+Run with::
+
+    python benchmarks/bench_construction.py
+"""
+import timeit
+
+# importing the example installs pyximport to build the extensions
+from cythonarrays.tests.example_python import Example
+from cythonarrays.array_shapes import _memview_schemas
+
+
+def allocate():
+    """create a new instance, which runs only ArrayShapes.__cinit__"""
+    Example.__new__(Example)
+
+
+def allocate_uncached():
+    """create a new instance without the cached schema"""
+    _memview_schemas.clear()
+    Example.__new__(Example)
+
+
+def construct():
+    """create and initialize a small model instance"""
+    Example(groups=2, origins=3, threading=False)
+
+
+def construct_uncached():
+    """create and initialize a small model instance without the cached schema"""
+    _memview_schemas.clear()
+    Example(groups=2, origins=3, threading=False)
+
+
+def report(title: str, func, func_uncached, number: int):
+    """time `func` and `func_uncached` and print the results"""
+    t_uncached = timeit.timeit(func_uncached, number=number)
+    t_cached = timeit.timeit(func, number=number)
+    print(f'{title} of {number} instances')
+    print(f'  schema searched per instance: {t_uncached:8.3f} s '
+          f'({t_uncached / number * 1e6:8.1f} us per instance)')
+    print(f'  schema cached per class:      {t_cached:8.3f} s '
+          f'({t_cached / number * 1e6:8.1f} us per instance)')
+    print(f'  speedup: {t_uncached / t_cached:.1f}x')
+
+
+def main(number: int = 10000):
+    """time the construction of `number` instances"""
+    # create one instance to build the extension modules
+    construct()
+    report('__cinit__', allocate, allocate_uncached, number)
+    report('construction', construct, construct_uncached, number)
+
+
+if __name__ == '__main__':
+    main()
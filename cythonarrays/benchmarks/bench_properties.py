@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the per-instance overhead of the array properties
+
+Compares the creation of the properties for each instance
+(as before the properties were created once per class)
+to the properties created once per class,
+with thousands of live instances.
+
+Run with::
+
+    python benchmarks/bench_properties.py
+"""
+import timeit
+
+# importing the example installs pyximport to build the extensions
+from cythonarrays.tests.example_python import Example
+from cythonarrays.array_properties import _ArrayProperties
+
+
+def create_props_per_instance(instance):
+    """create the properties as _ArrayProperties.__init__ did before"""
+    for descr in instance.dtypes.values():
+        prop = _ArrayProperties._create_prop(descr)
+        setattr(instance.__class__, descr.name, prop)
+
+
+def main(number: int = 5000):
+    """time the creation of the properties for `number` live instances"""
+    Example(groups=2, origins=3, threading=False)
+    instances = [Example.__new__(Example) for i in range(number)]
+
+    def per_instance():
+        for instance in instances:
+            create_props_per_instance(instance)
+
+    def per_class():
+        for instance in instances:
+            _ArrayProperties.__init__(instance)
+
+    t_instance = min(timeit.repeat(per_instance, number=1, repeat=5))
+    t_class = min(timeit.repeat(per_class, number=1, repeat=5))
+    print(f'properties for {number} instances')
+    print(f'  created per instance: {t_instance:8.4f} s '
+          f'({t_instance / number * 1e6:6.2f} us per instance)')
+    print(f'  created per class:    {t_class:8.4f} s '
+          f'({t_class / number * 1e6:6.2f} us per instance)')
+    print(f'  speedup: {t_instance / t_class:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
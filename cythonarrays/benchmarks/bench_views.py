@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the read access to the array properties
+
+Compares the creation of a new numpy view on the memoryview
+for each access (as before the views were cached)
+to the cached views.
+
+Run with::
+
+    python benchmarks/bench_views.py
+"""
+import timeit
+
+import numpy as np
+
+# importing the example installs pyximport to build the extensions
+from cythonarrays.tests.example_python import Example
+
+
+def main(number: int = 1000000):
+    """time `number` reads of a property"""
+    example = Example(groups=2, origins=3, threading=False)
+
+    def uncached():
+        arr = example._trips_ij
+        descr = example.dtypes['trips_ij']
+        return np.array(arr, copy=False).view(dtype=descr.dtype_numpy)
+
+    def cached():
+        return example.trips_ij
+
+    def dict_lookup():
+        return example.dtypes['trips_ij']
+
+    print(f'{number} reads of example.trips_ij')
+    results = {}
+    for title, func in [('new view per access', uncached),
+                        ('cached view', cached),
+                        ('dict lookup for reference', dict_lookup),
+                        ]:
+        t = min(timeit.repeat(func, number=number, repeat=3))
+        results[title] = t
+        print(f'  {title:26s}: {t:8.3f} s ({number / t / 1e6:6.2f} M reads/s)')
+    speedup = results['new view per access'] / results['cached view']
+    print(f'  speedup: {speedup:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
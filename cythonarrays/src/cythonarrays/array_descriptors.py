@@ -1,14 +1,129 @@
 # -*- coding: utf-8 -*-
 
-from typing import Tuple, Union
+from typing import Dict, Tuple, Union
 import numpy as np
 from numpy.testing import assert_array_equal
 
+from cythonarrays.configure_logger import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# what happens, if validate_array has to copy an array
+COPY_POLICIES = ('allow', 'log', 'raise')
+# the number of elements converted at once to compute a rounding error
+ROUNDING_CHUNK_SIZE = 2 ** 16
+
+
+class CopyError(ValueError):
+    """
+    An array would have to be copied to match the dtype of the memoryview,
+    but the copy policy is 'raise'
+    """
+
+
+def set_copy_policy(policy: str):
+    """
+    set the global copy policy for all arrays,
+    which can be overridden by the attribute `copy_policy` of a model
+
+    Parameters
+    ----------
+    policy:
+        'allow': copy silently,
+        'log': log a warning for each copy,
+        'raise': raise a CopyError instead of copying
+    """
+    if policy not in COPY_POLICIES:
+        raise ValueError(f'copy policy {policy} not in {COPY_POLICIES}')
+    ArrayDescriptor.copy_policy = policy
+
+
+def is_narrowing(source: np.dtype, target: np.dtype) -> bool:
+    """
+    True, if converting numbers from source to target dtype may round them
+
+    Parameters
+    ----------
+    source:
+        the dtype of the original data
+    target:
+        the dtype of the converted data
+    """
+    source, target = np.dtype(source), np.dtype(target)
+    if source.kind not in 'fc' or target.kind not in 'iufc':
+        return False
+    return not np.can_cast(source, target, casting='safe')
+
+
+def rounding_error(original: np.ndarray, converted: np.ndarray) -> float:
+    """
+    The maximum absolute difference between the finite elements
+    of the original and the converted data
+
+    Parameters
+    ----------
+    original:
+        the original data
+    converted:
+        the data converted to a lower precision
+
+    Returns
+    -------
+    :
+        the maximum rounding error
+    """
+    if not original.size:
+        return 0.
+    diff = np.abs(converted - original)
+    finite = np.isfinite(diff)
+    if not finite.any():
+        return 0.
+    return float(diff[finite].max())
+
+
+def storage_rounding_error(arr: np.ndarray,
+                           storage: np.dtype,
+                           chunk_size: int=ROUNDING_CHUNK_SIZE) -> float:
+    """
+    The maximum rounding error of storing an array with a lower precision,
+    converted in blocks along the first axis to limit the temporary memory
+
+    Parameters
+    ----------
+    arr:
+        the original data
+    storage:
+        the dtype the data is stored with
+    chunk_size:
+        the number of elements converted at once
+
+    Returns
+    -------
+    :
+        the maximum rounding error
+    """
+    if not arr.size:
+        return 0.
+    if not arr.ndim:
+        return rounding_error(arr, arr.astype(storage))
+    rows = max(1, chunk_size // max(1, arr[0].size))
+    error = 0.
+    for start in range(0, len(arr), rows):
+        block = arr[start:start + rows]
+        error = max(error, rounding_error(block, block.astype(storage)))
+    return error
+
 
 class ArrayDescriptor(object):
     """
     describes an array used as an instance attribute of a cython class
     """
+    # the global copy policy, see set_copy_policy
+    copy_policy = 'allow'
+    # counts the changes of the shapes of all descriptors,
+    # so that the dimensions derived from them can be cached
+    shape_changes = 0
+
     def __init__(self,
                  name: str,
                  dtype: str,
@@ -38,6 +153,15 @@ class ArrayDescriptor(object):
         self.shape = shape
         self._dtype_numpy = dtype_numpy
         self.default = default
+        # the copies made by validate_array
+        self.n_copies = 0
+        self.copied_bytes = 0
+        # how the memory of the array has been allocated
+        self.storage = 'memory'
+        # the file backing a memory-mapped array
+        self.filename = None
+        # the maximum rounding error converting data to a lower precision
+        self.max_rounding_error = 0.
 
     def __repr__(self):
         txt = 'array {0.name} of dtype {0.dtype}, ndim {0.ndim}'
@@ -79,26 +203,45 @@ class ArrayDescriptor(object):
     def validate_array(
         self,
         arr: np.ndarray,
-        instance=None) -> np.ndarray:
+        instance=None,
+        dimensions: Dict[str, int]=None) -> np.ndarray:
         """
         checks if the ndim (and the shape, if specified) match
         and casts the array to the dtype specified
 
+        If the array has to be copied, the copy is counted
+        in n_copies and copied_bytes and the copy policy of the instance
+        (or the global copy policy) is applied
+
         Parameters
         ----------
         arr:
             the array to test
         instance: ArrayShapes
             the CDefClass-instance holding the information on the allowed shapes
+        dimensions:
+            the dimensions already resolved from the instance
 
         Returns
         -------
         :
             the validated array casted to the target dimension and dtype
         """
+        policy = getattr(instance, 'copy_policy', None) or self.copy_policy
+        # bytes would be read as uint8 through the buffer protocol
+        if isinstance(arr, (bytes, bytearray)):
+            msg = (f'{self.name}: dtype target: {self.dtype}, '
+                   f'actual: {type(arr).__name__}')
+            raise TypeError(msg)
         # cast arr to numpy array
         if not isinstance(arr, np.ndarray):
+            try:
+                # objects supporting the buffer protocol are not copied
+                arr = np.asarray(memoryview(arr))
+            except TypeError:
+                self._check_copy(policy, f'{type(arr).__name__} to ndarray')
                 arr = np.array(arr)
+                self._count_copy(arr.nbytes)
         msg = f'{self.name}: ndim target: {self.ndim}, actual: {arr.ndim}'
         # if ndim does not match
         try:
@@ -110,22 +253,79 @@ class ArrayDescriptor(object):
             except ValueError:
                 raise err
         if self.shape is not None:
-            shape = self.get_shape(instance)
-            msg = f'{self.name}: shape target: {shape}, actual: {arr.shape}'
-            assert_array_equal(arr.shape, shape, msg)
+            shape = self.get_shape(instance, dimensions)
+            if arr.shape != tuple(shape):
+                msg = f'{self.name}: shape target: {shape}, actual: {arr.shape}'
+                assert_array_equal(arr.shape, shape, msg)
 
         # convert bool array to i1 with view instead of astype
         if issubclass(arr.dtype.type, np.bool_):
             new_type = np.dtype(self.dtype).type
             if issubclass(new_type, np.int8):
-                return arr.view(dtype='i1')
+                arr = arr.view(dtype='i1')
             elif issubclass(new_type, np.uint8):
-                return arr.view(dtype='u1')
+                arr = arr.view(dtype='u1')
+
+        dtype = np.dtype(self.dtype)
+        if arr.dtype != dtype:
+            self._check_copy(policy, f'{arr.dtype.str} to {dtype.str}',
+                             arr.size * dtype.itemsize)
+            converted = arr.astype(dtype)
+            self._count_copy(converted.nbytes)
+            if is_narrowing(arr.dtype, dtype):
+                self.record_rounding(arr, converted)
+            arr = converted
+        # the memoryviews need a writable buffer
+        if not arr.flags.writeable:
+            self._check_copy(policy, 'read-only buffer', arr.nbytes)
+            arr = arr.copy()
+            self._count_copy(arr.nbytes)
+        return arr
+
+    def record_rounding(self, original: np.ndarray, converted: np.ndarray):
+        """
+        keep the maximum rounding error of a conversion to a lower precision
+
+        Parameters
+        ----------
+        original:
+            the original data
+        converted:
+            the converted data
+        """
+        error = rounding_error(original, converted)
+        if error > self.max_rounding_error:
+            self.max_rounding_error = error
+
+    def _check_copy(self, policy: str, reason: str, nbytes: int=None):
+        """
+        apply the copy policy before an array is copied
+
+        Parameters
+        ----------
+        policy:
+            the copy policy
+        reason:
+            the conversion that requires the copy
+        nbytes:
+            the number of bytes to copy, if known
+        """
+        if policy == 'allow':
+            return
+        size = 'an unknown number of' if nbytes is None else nbytes
+        msg = f'{self.name}: copy {size} bytes to convert {reason}'
+        if policy == 'raise':
+            raise CopyError(msg)
+        logger.warning(msg)
 
-        return arr.astype(self.dtype, copy=False)
+    def _count_copy(self, nbytes: int):
+        """count a copy of nbytes"""
+        self.n_copies += 1
+        self.copied_bytes += nbytes
 
     def get_shape(self,
-                  instance=None) -> Tuple[int]:
+                  instance=None,
+                  dimensions: Dict[str, int]=None) -> Tuple[int]:
         """
         get the shape of the array defined by the ArrayDescriptor
         using the information from the ArrayShape-instance
@@ -134,6 +334,8 @@ class ArrayDescriptor(object):
         ----------
         instance: ArrayShapes
             the CDefClass-instance holding the information on the allowed shapes
+        dimensions:
+            the dimensions already resolved from the instance
 
         Returns
         -------
@@ -142,13 +344,24 @@ class ArrayDescriptor(object):
         """
         shape = []
         for d in range(self.ndim):
-            if isinstance(self.shape[d], str):
-                v = getattr(instance, self.shape[d])
+            dim = self.shape[d]
+            if isinstance(dim, str):
+                if dimensions is not None and dim in dimensions:
+                    v = dimensions[dim]
+                else:
+                    v = getattr(instance, dim)
             else:
-                v = self.shape[d]
+                v = dim
             shape.append(v)
         return shape
 
+    @property
+    def dimension_names(self) -> Tuple[str]:
+        """the names of the dimensions the shape of the array depends on"""
+        if self.shape is None:
+            return ()
+        return tuple(dim for dim in self.shape if isinstance(dim, str))
+
     @property
     def dtype_numpy(self) -> str:
         """return the numpy dtype"""
@@ -193,3 +406,170 @@ class ArrayDescriptor(object):
                 except ValueError:
                     value.append(st)
         self._shape = value
+        ArrayDescriptor.shape_changes += 1
+
+
+class SparseArrayDescriptor(ArrayDescriptor):
+    """
+    describes a sparse 2D-matrix in CSR-format used as an instance attribute
+    of a cython class, which is stored in the three 1D-memoryviews
+    `_name_indptr`, `_name_indices` and `_name_data`
+    """
+    # the components of the CSR-format
+    components = ('indptr', 'indices', 'data')
+
+    def __init__(self,
+                 name: str,
+                 dtype: str,
+                 shape: Tuple[Union[int, str]]=None,
+                 default=0):
+        """
+        Parameters
+        ----------
+        name :
+            the name of the matrix
+        dtype : str
+            the numpy-dtype of the data
+        shape :
+            the shape of the matrix
+        default : number
+            the value of the elements not stored in the matrix
+        """
+        super().__init__(name, dtype, 2, shape=shape, default=default)
+
+    def __repr__(self):
+        return 'sparse ' + super().__repr__()
+
+    @property
+    def component_names(self) -> Tuple[str]:
+        """the names of the arrays holding indptr, indices and data"""
+        return tuple(f'{self.name}_{c}' for c in self.components)
+
+    @property
+    def component_dims(self) -> Dict[str, Tuple[str]]:
+        """the dimension names of the components, e.g. in a netcdf-file"""
+        indptr, indices, data = self.component_names
+        return {indptr: (f'{self.name}_n_indptr', ),
+                indices: (f'{self.name}_nnz', ),
+                data: (f'{self.name}_nnz', )}
+
+    def _is_default(self, arr: np.ndarray) -> np.ndarray:
+        """a boolean mask of the elements equal to the default value"""
+        if self.default is None:
+            return arr == 0
+        if isinstance(self.default, float) and np.isnan(self.default):
+            return np.isnan(arr)
+        return arr == self.default
+
+    def to_csr(self,
+               value,
+               instance=None,
+               dimensions: Dict[str, int]=None,
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        convert a value to the components of the CSR-format
+
+        Parameters
+        ----------
+        value:
+            a scipy.sparse matrix or array,
+            a tuple (data, indices, indptr) like scipy.sparse.csr_array accepts,
+            a dense array, where the elements equal to the default are dropped,
+            or None for an empty matrix
+        instance: ArrayShapes
+            the CDefClass-instance holding the information on the allowed shapes
+        dimensions:
+            the dimensions already resolved from the instance
+
+        Returns
+        -------
+        indptr, indices, data:
+            the components
+        """
+        shape = tuple(self.get_shape(instance, dimensions))
+        n_rows = shape[0]
+        if value is None:
+            return (np.zeros(n_rows + 1, dtype='i4'),
+                    np.empty(0, dtype='i4'),
+                    np.empty(0, dtype=self.dtype))
+        if hasattr(value, 'tocsr'):
+            matrix = value.tocsr()
+            if matrix.shape != shape:
+                raise ValueError(f'{self.name}: shape target: {shape}, '
+                                 f'actual: {matrix.shape}')
+            matrix.sum_duplicates()
+            return matrix.indptr, matrix.indices, matrix.data
+        if isinstance(value, tuple):
+            data, indices, indptr = (np.asarray(v) for v in value)
+            if len(indptr) != n_rows + 1:
+                raise ValueError(f'{self.name}: indptr has {len(indptr)} '
+                                 f'elements, expected {n_rows + 1}')
+            if not len(data) == len(indices) == indptr[-1]:
+                raise ValueError(f'{self.name}: data and indices '
+                                 f'do not match indptr[-1]={indptr[-1]}')
+            if len(indices) and indices.max() >= shape[1]:
+                raise ValueError(f'{self.name}: indices out of bounds '
+                                 f'for {shape[1]} columns')
+            return indptr, indices, data
+        arr = np.asarray(value)
+        if arr.shape != shape:
+            raise ValueError(f'{self.name}: shape target: {shape}, '
+                             f'actual: {arr.shape}')
+        mask = ~self._is_default(arr)
+        indptr = np.zeros(n_rows + 1, dtype='i8')
+        np.cumsum(mask.sum(axis=1), out=indptr[1:])
+        return indptr, np.nonzero(mask)[1], arr[mask]
+
+    def to_dense(self,
+                 indptr: np.ndarray,
+                 indices: np.ndarray,
+                 data: np.ndarray,
+                 shape: Tuple[int]) -> np.ndarray:
+        """
+        convert the components of the CSR-format to a dense array
+        filled with the default value
+
+        Returns
+        -------
+        :
+            the dense array with the dtype_numpy
+        """
+        default = 0 if self.default is None else self.default
+        arr = np.full(shape, default, dtype=self.dtype_numpy)
+        rows = np.repeat(np.arange(shape[0]), np.diff(indptr))
+        arr[rows, indices] = data
+        return arr
+
+    def resize(self,
+               indptr: np.ndarray,
+               indices: np.ndarray,
+               data: np.ndarray,
+               shape: Tuple[int],
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        resize the CSR-matrix to shape,
+        the elements outside the new shape are dropped
+
+        Returns
+        -------
+        indptr, indices, data:
+            the resized components
+        """
+        n_rows, n_cols = shape
+        old_rows = len(indptr) - 1
+        if n_rows <= old_rows:
+            indptr = indptr[:n_rows + 1].copy()
+            nnz = indptr[-1]
+            indices, data = indices[:nnz].copy(), data[:nnz].copy()
+        else:
+            indptr = np.concatenate(
+                [indptr, np.full(n_rows - old_rows, indptr[-1],
+                                 dtype=indptr.dtype)])
+        keep = indices < n_cols
+        if not keep.all():
+            rows = np.repeat(np.arange(n_rows), np.diff(indptr))
+            counts = np.bincount(rows[keep], minlength=n_rows)
+            indptr = np.zeros(n_rows + 1, dtype=indptr.dtype)
+            np.cumsum(counts, out=indptr[1:])
+            indices, data = indices[keep], data[keep]
+        return indptr, indices, data
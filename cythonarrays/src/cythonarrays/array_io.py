@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, product
+from typing import Dict, Iterator, Tuple
+import numpy as np
+import xarray as xr
+
+# the target size of a chunk in bytes
+CHUNK_BYTES = 2 ** 20
+# arrays smaller than this are stored contiguous and uncompressed,
+# so that they can be memory-mapped
+MIN_COMPRESSION_BYTES = 2 ** 16
+# the default gzip compression level
+COMPRESSION_LEVEL = 4
+# the file describing the arrays of a checkpoint
+CHECKPOINT_MANIFEST = 'manifest.json'
+# the encodings of object arrays with strings in netcdf-files:
+# integer codes with a table of the labels, fixed-width bytes
+# or variable-length strings
+OBJECT_ENCODINGS = ('categorical', 'fixed', None)
+# the attribute of a variable holding an encoded object array
+OBJECT_ENCODING_ATTR = 'cythonarrays_encoding'
+# the formats to write Arrow record batches:
+# the IPC stream format (e.g. for pipes) and the IPC file format (Feather V2)
+ARROW_FORMATS = ('stream', 'feather')
+
+
+def default_chunks(shape: Tuple[int],
+                   itemsize: int,
+                   chunk_bytes: int=CHUNK_BYTES,
+                   fixed: Dict[int, int]=None) -> Tuple[int]:
+    """
+    Chunk an array in blocks of the leading axis with the full trailing axes,
+    which fits to the loops over the origins of an origin-destination matrix
+    in C-order.
+
+    The trailing axes are kept complete as long as the chunk does not exceed
+    chunk_bytes, the axis where the limit is reached is split
+
+    Parameters
+    ----------
+    shape:
+        the shape of the array
+    itemsize:
+        the bytes per element
+    chunk_bytes:
+        the target size of a chunk in bytes
+    fixed:
+        dict with the axis as key and the chunk size along this axis
+
+    Returns
+    -------
+    :
+        the chunk shape
+    """
+    fixed = fixed or {}
+    chunks = [1] * len(shape)
+    nbytes = itemsize
+    for axis in reversed(range(len(shape))):
+        length = max(shape[axis], 1)
+        if axis in fixed:
+            chunks[axis] = min(fixed[axis], length)
+        else:
+            chunks[axis] = int(min(length, max(1, chunk_bytes // nbytes)))
+        nbytes *= chunks[axis]
+    return tuple(chunks)
+
+
+def iter_chunks(shape: Tuple[int],
+                chunks: Tuple[int]) -> Iterator[Tuple[int]]:
+    """
+    Iterate over the offsets of the chunks of an array
+
+    Parameters
+    ----------
+    shape:
+        the shape of the array
+    chunks:
+        the chunk shape
+
+    Returns
+    -------
+    :
+        the offsets of the chunks
+    """
+    ranges = [range(0, n, c) for n, c in zip(shape, chunks)]
+    return product(*ranges)
+
+
+def encode_chunk(arr: np.ndarray,
+                 offset: Tuple[int],
+                 chunks: Tuple[int],
+                 dtype: np.dtype,
+                 fillvalue=None,
+                 compression_level: int=COMPRESSION_LEVEL,
+                 shuffle: bool=True) -> bytes:
+    """
+    Encode a chunk of an array like the HDF5 filters shuffle and deflate do
+
+    Chunks at the edges of the array are padded to the full chunk shape
+
+    Parameters
+    ----------
+    arr:
+        the array
+    offset:
+        the offset of the chunk
+    chunks:
+        the chunk shape
+    dtype:
+        the dtype to store the chunk with
+    fillvalue:
+        the value to pad edge chunks with
+    compression_level:
+        the gzip compression level
+    shuffle:
+        if True, the bytes are shuffled before compression
+
+    Returns
+    -------
+    :
+        the compressed chunk
+    """
+    index = tuple(slice(o, o + c) for o, c in zip(offset, chunks))
+    block = arr[index]
+    if block.shape != tuple(chunks):
+        padded = np.full(chunks, 0 if fillvalue is None else fillvalue,
+                         dtype=dtype)
+        padded[tuple(slice(0, n) for n in block.shape)] = block
+        block = padded
+    else:
+        block = np.ascontiguousarray(block, dtype=dtype)
+    if shuffle and dtype.itemsize > 1:
+        data = block.view('u1').reshape(-1, dtype.itemsize).T.tobytes()
+    else:
+        data = block.tobytes()
+    return zlib.compress(data, compression_level)
+
+
+def write_chunks_parallel(dataset,
+                          arr: np.ndarray,
+                          fillvalue=None,
+                          compression_level: int=COMPRESSION_LEVEL,
+                          shuffle: bool=True,
+                          executor: ThreadPoolExecutor=None,
+                          batch_size: int=16):
+    """
+    Compress the chunks of an array in parallel threads and
+    write them directly into a chunked h5py-Dataset with the filters
+    shuffle (optional) and gzip
+
+    zlib releases the GIL while compressing, so the chunks are compressed
+    concurrently, HDF5 writes them one after another
+
+    Parameters
+    ----------
+    dataset: h5py.Dataset
+        the dataset to write to
+    arr:
+        the array to write
+    fillvalue:
+        the value to pad edge chunks with
+    compression_level:
+        the gzip compression level
+    shuffle:
+        if True, the bytes are shuffled before compression
+    executor:
+        the thread pool to compress the chunks,
+        if None, the chunks are compressed in the calling thread
+    batch_size:
+        the number of chunks compressed ahead of the writing
+    """
+    chunks = dataset.chunks
+    dtype = dataset.dtype
+    offsets = iter_chunks(arr.shape, chunks)
+
+    def encode(offset):
+        return encode_chunk(arr, offset, chunks, dtype, fillvalue,
+                            compression_level, shuffle)
+
+    mapper = map if executor is None else executor.map
+    while True:
+        batch = list(islice(offsets, batch_size))
+        if not batch:
+            break
+        for offset, data in zip(batch, mapper(encode, batch)):
+            dataset.id.write_direct_chunk(offset, data)
+
+
+def save_npy(filename: str, arr: np.ndarray):
+    """
+    Save an array as .npy-file.
+    The data in a .npy-file starts at a multiple of 64 bytes,
+    so the array can be memory-mapped with the same alignment.
+
+    The array is written to a temporary file, which replaces the file,
+    so an array memory-mapped from the old file keeps its data
+
+    Parameters
+    ----------
+    filename:
+        the .npy-file
+    arr:
+        the array
+    """
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.save(f, arr, allow_pickle=False)
+    os.replace(tmp_filename, filename)
+
+
+def write_manifest(folder: str, manifest: Dict):
+    """
+    Write the manifest of a checkpoint
+
+    Parameters
+    ----------
+    folder:
+        the folder of the checkpoint
+    manifest:
+        the json-serializable manifest
+    """
+    filename = os.path.join(folder, CHECKPOINT_MANIFEST)
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_filename, filename)
+
+
+def read_manifest(folder: str) -> Dict:
+    """
+    Read the manifest of a checkpoint
+
+    Parameters
+    ----------
+    folder:
+        the folder of the checkpoint
+
+    Returns
+    -------
+    :
+        the manifest
+    """
+    with open(os.path.join(folder, CHECKPOINT_MANIFEST)) as f:
+        return json.load(f)
+
+
+def to_json(value):
+    """convert numpy scalars and tuples to json-serializable values"""
+    if isinstance(value, (tuple, list)):
+        return [to_json(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def encode_strings(values: np.ndarray) -> np.ndarray:
+    """
+    Encode an object array of strings as utf-8 fixed-width byte strings
+
+    Parameters
+    ----------
+    values:
+        the object array with strings, missing values (None or NaN)
+        are stored as b''
+
+    Returns
+    -------
+    :
+        the array of byte strings
+
+    Raises
+    ------
+    AttributeError:
+        if the array holds other objects than strings
+    """
+    codes, labels = factorize_strings(values)
+    # the code -1 of missing values selects the appended b''
+    return np.append(labels, b'')[codes].reshape(values.shape)
+
+
+def factorize_strings(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Factorize an object array of strings
+
+    Parameters
+    ----------
+    values:
+        the object array with strings and missing values (None or NaN)
+
+    Returns
+    -------
+    codes:
+        the flat integer codes of the values, -1 for missing values
+    labels:
+        the distinct strings as utf-8 fixed-width byte strings
+
+    Raises
+    ------
+    AttributeError:
+        if the array holds other objects than strings
+    """
+    flat = np.asarray(values, dtype='O').ravel()
+    # None and NaN are missing, NaN is the only value unequal to itself
+    missing = np.equal(flat, None) | (flat != flat)
+    valid = flat[~missing]
+    for value in valid:
+        if not isinstance(value, str):
+            raise AttributeError(f'{type(value).__name__} values are no strings')
+    labels, first, inverse = np.unique(valid.astype('U'),
+                                       return_index=True,
+                                       return_inverse=True)
+    # number the labels in the order of their first appearance
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    labels = labels[order]
+    codes = np.full(len(flat), -1, dtype=np.intp)
+    codes[~missing] = rank[inverse.ravel()]
+    # only the distinct labels are encoded
+    labels = np.char.encode(labels, 'utf-8')
+    return codes, np.asarray(labels, dtype='S')
+
+
+def decode_strings(values: np.ndarray) -> np.ndarray:
+    """
+    Decode an array of utf-8 fixed-width byte strings
+
+    Parameters
+    ----------
+    values:
+        the array of byte strings
+
+    Returns
+    -------
+    :
+        an object array of strings
+    """
+    return np.char.decode(np.asarray(values, dtype='S'), 'utf-8').astype('O')
+
+
+def encode_objects(ds: xr.Dataset, method: str='categorical') -> xr.Dataset:
+    """
+    Encode the object arrays of strings in a Dataset,
+    which otherwise would be written as variable-length strings
+
+    Parameters
+    ----------
+    ds:
+        the Dataset
+    method:
+        'categorical' stores integer codes in the variable and
+        the distinct labels as fixed-width bytes in the variable `name_labels`,
+        'fixed' stores fixed-width bytes,
+        None leaves the object arrays unchanged
+
+    Returns
+    -------
+    :
+        the Dataset with the encoded arrays
+    """
+    if method not in OBJECT_ENCODINGS:
+        raise ValueError(f'object encoding {method} not in {OBJECT_ENCODINGS}')
+    if method is None:
+        return ds
+    variables = {}
+    coords = {}
+    for name, data_array in ds.variables.items():
+        if data_array.dtype != 'O':
+            continue
+        values = data_array.values
+        attrs = {**data_array.attrs, OBJECT_ENCODING_ATTR: method}
+        # the encoded coordinates stay coordinates
+        target = coords if name in ds.coords else variables
+        try:
+            if method == 'fixed':
+                target[name] = xr.Variable(data_array.dims,
+                                           encode_strings(values), attrs)
+                continue
+            codes, labels = factorize_strings(values)
+        except AttributeError:
+            # not only strings, keep the object array
+            continue
+        for dtype in ('i1', 'i2', 'i4', 'i8'):
+            if len(labels) <= np.iinfo(dtype).max:
+                break
+        target[name] = xr.Variable(
+            data_array.dims, codes.astype(dtype).reshape(values.shape), attrs)
+        variables[f'{name}_labels'] = xr.Variable(f'{name}_n_labels', labels)
+    return ds.assign_coords(coords).assign(variables)
+
+
+def decode_objects(ds: xr.Dataset) -> xr.Dataset:
+    """
+    Decode the object arrays encoded by encode_objects
+
+    Parameters
+    ----------
+    ds:
+        the Dataset read from a netcdf-file
+
+    Returns
+    -------
+    :
+        the Dataset with the object arrays
+    """
+    variables = {}
+    coords = {}
+    tables = []
+    for name, data_array in ds.variables.items():
+        method = data_array.attrs.get(OBJECT_ENCODING_ATTR)
+        if method is None:
+            continue
+        attrs = {key: value for key, value in data_array.attrs.items()
+                 if key != OBJECT_ENCODING_ATTR}
+        if method == 'fixed':
+            values = decode_strings(data_array.values)
+        else:
+            table = f'{name}_labels'
+            tables.append(table)
+            labels = decode_strings(ds[table].values)
+            # the code -1 of missing values selects the appended NaN
+            labels = np.append(labels, np.nan)
+            values = labels[data_array.values]
+        target = coords if name in ds.coords else variables
+        target[name] = xr.Variable(data_array.dims, values, attrs)
+    return ds.assign_coords(coords).assign(variables).drop_vars(tables)
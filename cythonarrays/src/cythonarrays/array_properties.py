@@ -1,9 +1,45 @@
 # -*- coding: utf-8 -*-
 
-from typing import Tuple, Union
+import functools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
 import numpy as np
 import xarray as xr
-from cythonarrays.array_descriptors import ArrayDescriptor
+from cythonarrays.array_descriptors import (ArrayDescriptor,
+                                            SparseArrayDescriptor,
+                                            is_narrowing,
+                                            storage_rounding_error)
+from cythonarrays.array_io import (ARROW_FORMATS,
+                                   CHUNK_BYTES,
+                                   COMPRESSION_LEVEL,
+                                   MIN_COMPRESSION_BYTES,
+                                   decode_objects,
+                                   default_chunks,
+                                   decode_strings,
+                                   encode_objects,
+                                   factorize_strings,
+                                   read_manifest,
+                                   save_npy,
+                                   to_json,
+                                   write_chunks_parallel,
+                                   write_manifest)
+from cythonarrays.array_storage import (Arena,
+                                        BACKINGS,
+                                        MemoryBudgetError,
+                                        SharedArena,
+                                        SharedHandle,
+                                        contiguous_variables,
+                                        create_memmap,
+                                        memmap_of,
+                                        storage_of)
 
 
 class _ArrayProperties:
@@ -13,36 +49,175 @@ class _ArrayProperties:
     :meta public:
     """
     _coordinates = {}
+    # the copy policy of the model ('allow', 'log' or 'raise')
+    # if None, the global copy policy of the ArrayDescriptor is used
+    copy_policy = None
+    # if True, init_arrays allocates all arrays in one Arena
+    use_arena = False
+    # the Arena of the arrays allocated by init_arrays
+    arena = None
+    # the folder for the files of memory-mapped arrays
+    # if None, a temporary folder is created, which is removed with the instance
+    memmap_folder = None
+    # the precision policy for storing the arrays in files,
+    # e.g. {'f8': 'f4'} stores double arrays as float, see set_precision
+    precision = None
+    # dict with the storage dtype of single arrays overriding the policy
+    precision_overrides = None
+    # the maximum bytes of the arrays owned by the model,
+    # if None, the memory is not limited
+    memory_budget = None
+    # the maximum number of snapshots saved in the background at the same time
+    max_saves_in_flight = 2
+    # the encoding of object arrays with strings in netcdf-files
+    # ('categorical', 'fixed' or None for variable-length strings),
+    # see array_io.encode_objects
+    object_encoding = 'categorical'
+    # True while _from_dimensions creates an instance,
+    # init_array and init_arrays then define the arrays without allocating them
+    _defer_allocation = False
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        register the names of the array properties created for the class
+        """
+        super().__init_subclass__(**kwargs)
+        cls._array_property_names = set()
 
     def __init__(self, *args, **kwargs):
         """
-        create properties for all arrays
+        create properties for all arrays,
+        if they do not exist yet for the class
+        """
+        # the numpy views on the memoryviews returned by the properties
+        self._array_views = {}
+        # the arrays allocated before an array was shrinked by resize_dimension
+        self._array_capacity = {}
+        # the arrays sharing the memory of the parent of a fork
+        self._shared_arrays = set()
+        # the bytes copied for the arrays of a fork written to
+        self._materialized = {}
+        # the sparse matrices stored in three arrays each
+        self.sparse_dtypes = {}
+        # the dimensions of the variables in self.ds and the shape changes
+        # of the Array Descriptors, when they were derived
+        self._ds_dims_cache = (None, {})
+        # the maximum bytes of the arrays owned by the model
+        self.peak_nbytes = 0
+        # the bytes of each array owned by the model and their sum
+        self._owned_bytes = {}
+        self._owned_total = 0
+        # the variables of a netcdf-file read on first access
+        self._lazy_arrays = {}
+        # the arrays changed since the last save
+        self._dirty_arrays = set()
+        # the version of each array, increased when it is marked dirty
+        self._array_versions = {}
+        # the versions of the arrays saved to each file or folder
+        self._saved_versions = {}
+        # saves in the background record the versions saved
+        self._versions_lock = threading.Lock()
+        # the background writer of save_async, created on first use
+        self._save_executor = None
+        self._save_slots = None
+        # the buffers of the snapshots, which can be reused
+        self._snapshot_buffers = []
+        # the saves submitted and not finished yet
+        self._pending_saves = set()
+        # the arrays defined, but not allocated by _from_dimensions
+        self._deferred_arrays = set()
+        self._install_properties(self.dtypes)
+
+    @classmethod
+    def _install_properties(cls, descriptors: Dict[str, ArrayDescriptor]):
+        """
+        Create the properties for the arrays once per class
+
+        Parameters
+        ----------
+        descriptors:
+            the Array Descriptions
         """
-        for descr in self.dtypes.values():
-            prop = self._create_prop(descr)
-            setattr(self.__class__, descr.name, prop)
+        installed = cls._array_property_names
+        if installed.issuperset(descriptors):
+            return
+        for name, descr in descriptors.items():
+            if name not in installed:
+                if isinstance(descr, SparseArrayDescriptor):
+                    prop = cls._create_sparse_prop(descr)
+                else:
+                    prop = cls._create_prop(descr)
+                setattr(cls, name, prop)
+                installed.add(name)
 
-    def _create_prop(self, descr: ArrayDescriptor):
+    @staticmethod
+    def _create_prop(descr: ArrayDescriptor) -> property:
         """
         Create the property name that reads and writes
         the internal attribute _name
 
+        The property is shared by all instances of the class,
+        so the Array Description of the instance is used.
+        The numpy view on the memoryview is cached per instance
+        until the array is set again
+
         Parameters
         ----------
         descr:
             the Array Description
         """
-        intern_name = '_%s' % descr.name
+        name = descr.name
+        intern_name = '_%s' % name
+
+        def fget(self):
+            try:
+                return self._array_views[name]
+            except KeyError:
+                if name in self._lazy_arrays:
+                    self.load(name)
+                elif name in self._deferred_arrays:
+                    # used before it has been set, e.g. in __init__
+                    self._allocate_deferred([name])
+                arr = getattr(self, intern_name)
+                dtype_numpy = self.dtypes[name].dtype_numpy
+                view = np.asarray(arr).view(dtype=dtype_numpy)
+                if name in self._shared_arrays:
+                    view.flags.writeable = False
+                self._array_views[name] = view
+                return view
+
+        def fset(self, value):
+            self.set_array(name, value)
+
+        def fdel(self):
+            ndim = self.dtypes[name].ndim
+            self.set_array(name, np.empty(tuple([0]*ndim)))
+
+        fdoc = str(descr)
+        prop = property(fget, fset, fdel, fdoc)
+        return prop
+
+    @staticmethod
+    def _create_sparse_prop(descr: SparseArrayDescriptor) -> property:
+        """
+        Create the property name that reads the sparse matrix
+        as scipy.sparse.csr_array and writes its components
+
+        Parameters
+        ----------
+        descr:
+            the Sparse Array Description
+        """
+        name = descr.name
 
         def fget(self):
-            arr = getattr(self, intern_name)
-            return np.array(arr, copy=False).view(dtype=descr.dtype_numpy)
+            return self.get_sparse_array(name)
 
         def fset(self, value):
-            self.set_array(descr.name, value)
+            self.set_sparse_array(name, value)
 
         def fdel(self):
-            self.set_array(descr.name, np.empty(tuple([0]*descr.ndim)))
+            self.set_sparse_array(name, None)
 
         fdoc = str(descr)
         prop = property(fget, fset, fdel, fdoc)
@@ -51,7 +226,8 @@ class _ArrayProperties:
     def init_array(self,
                    name: str,
                    shape: Tuple[Union[str, int]]=None,
-                   default: Union[int, float]=None):
+                   default: Union[int, float]=None,
+                   backing: str=None):
         """
         Inits the attribute name with an empty array with the specified shape
         and fill with the default value
@@ -68,26 +244,144 @@ class _ArrayProperties:
             the default value. If not given,
             the default value stored in self.dtypes is used.
             if None, an empty array is initialized
+        backing:
+            'memory' or 'memmap' to create the array as a memory-mapped
+            .npy-file in self.memmap_folder.
+            If None, a memory-mapped array stays memory-mapped
         """
         descr = self.dtypes[name]
         if shape is not None:
             descr.shape = shape
         if default is not None:
             descr.default = default
+        if self._defer_allocation:
+            self._deferred_arrays.add(name)
+            return
+        if self.memory_budget is not None and backing != 'memmap':
+            self._check_budget({name: self._nbytes_of(descr)})
+        arr = self._allocate_array(descr, backing=backing)
+        self.set_array(name, arr)
+
+    def _allocate_array(self,
+                        descr: ArrayDescriptor,
+                        dimensions: Dict[str, int]=None,
+                        backing: str=None) -> np.ndarray:
+        """
+        Allocate an array with the shape and the default value
+        defined in the Array Descriptor
+
+        Parameters
+        ----------
+        descr:
+            the Array Descriptor
+        dimensions:
+            the dimensions already resolved
+        backing:
+            the backing of the array, see _empty
+
+        Returns
+        -------
+        :
+            the new array
+        """
         if descr.shape is not None:
             self.check_ndims(descr)
-            target_shape = descr.get_shape(self)
-            arr = np.empty(target_shape, dtype=descr.dtype)
+            target_shape = descr.get_shape(self, dimensions)
+            arr = self._empty(descr, target_shape, backing)
             if descr.default is not None:
                 arr.fill(descr.default)
         else:
-            arr = np.empty([0] * descr.ndim, dtype=descr.dtype)
-        self.set_array(name, arr)
+            arr = self._empty(descr, [0] * descr.ndim, backing)
+        return arr
+
+    def _empty(self,
+               descr: ArrayDescriptor,
+               shape: Tuple[int],
+               backing: str=None) -> np.ndarray:
+        """
+        Create an empty array for the Array Descriptor
+
+        Parameters
+        ----------
+        descr:
+            the Array Descriptor
+        shape:
+            the shape of the new array
+        backing:
+            'memory' or 'memmap'. If None, the array is memory-mapped
+            if the current array is memory-mapped
+
+        Returns
+        -------
+        :
+            the new array
+        """
+        if backing is None:
+            backing = 'memmap' if descr.storage == 'memmap' else 'memory'
+        if backing not in BACKINGS:
+            raise ValueError(f'backing {backing} not in {BACKINGS}')
+        if backing == 'memmap' and descr.dtype != 'O':
+            return create_memmap(self._memmap_filename(descr), shape, descr.dtype)
+        return np.empty(shape, dtype=descr.dtype)
+
+    def _memmap_filename(self, descr: ArrayDescriptor) -> str:
+        """
+        the filename for a new memory-mapped array.
+        If the array is already memory-mapped to this file,
+        another file is used, because the current one may still be in use
+
+        Parameters
+        ----------
+        descr:
+            the Array Descriptor
+
+        Returns
+        -------
+        :
+            the filename
+        """
+        if self.memmap_folder is None:
+            folder = tempfile.mkdtemp(prefix='cythonarrays_')
+            weakref.finalize(self, shutil.rmtree, folder, ignore_errors=True)
+            self.memmap_folder = folder
+        filename = os.path.join(self.memmap_folder, f'{descr.name}.npy')
+        if (descr.filename is not None and
+                os.path.abspath(descr.filename) == os.path.abspath(filename)):
+            filename = os.path.join(self.memmap_folder, f'{descr.name}_1.npy')
+        return filename
+
+    def load_memmap(self, name: str, filename: str=None, mode: str='r+'):
+        """
+        Set the array to the data of a .npy-file mapped into memory
+
+        Parameters
+        ----------
+        name:
+            the name of the array
+        filename:
+            the .npy-file, by default `name.npy` in self.memmap_folder.
+            A ValueError is raised if neither is given
+        mode:
+            'r+' to write changes back to the file,
+            'c' for copy-on-write without changing the file.
+            Read-only modes are rejected, because the memoryviews
+            need writable arrays
+        """
+        if mode not in ('c', 'r+'):
+            raise ValueError(f"mode {mode} not in ('c', 'r+'), "
+                             "the memoryviews need writable arrays")
+        if filename is None:
+            if self.memmap_folder is None:
+                raise ValueError(f'{name}: no filename given and no '
+                                 'memmap_folder set to load the array from')
+            filename = os.path.join(self.memmap_folder, f'{name}.npy')
+        self.set_array(name, np.load(filename, mmap_mode=mode))
 
     def set_array(self,
                   name: str,
                   value: Union[int, float, list, np.ndarray],
-                  shape: Tuple[Union[int, str]]=None):
+                  shape: Tuple[Union[int, str]]=None,
+                  backing: str=None):
         """
         Sets the attribute name to the value and casts to the correct dtype
         if necessary
@@ -100,6 +394,10 @@ class _ArrayProperties:
             the value to assign to the memoryview
         shape:
             a tuple of ints or str to validate the shape of the array provided
+        backing:
+            'memmap' to copy the value into a memory-mapped .npy-file
+            in self.memmap_folder, 'memory' to copy a memory-mapped value
+            into memory. If None, the value is used as it is
 
         Examples
         --------
@@ -114,13 +412,377 @@ class _ArrayProperties:
           >>> shape = (4, )
           >>> model.set_array('age', arr, shape)
         """
-        intern_name = '_%s' % name
         descr = self.dtypes[name]
         if shape is not None:
             descr.shape = shape
             self.check_ndims(descr)
+        if self.memory_budget is not None and \
+                (backing or storage_of(value)) != 'memmap':
+            itemsize = np.dtype(descr.dtype).itemsize
+            self._check_budget({name: np.size(value) * itemsize})
         arr = descr.validate_array(value, self)
-        setattr(self, intern_name, arr)
+        if backing is not None and storage_of(arr) != backing:
+            target = self._empty(descr, arr.shape, backing)
+            target[...] = arr
+            arr = target
+        self._assign_arrays({name: arr})
+
+    def set_arrays(self,
+                   arrays: Dict[str, Union[int, float, list, np.ndarray]],
+                   shapes: Dict[str, Tuple[Union[int, str]]]=None):
+        """
+        Sets several arrays at once.
+        The dimensions are resolved only once and all arrays are validated
+        before any array is assigned.
+        If the validation of any array fails, no array is assigned
+        and the shapes of the Array Descriptors are not changed
+
+        Parameters
+        ----------
+        arrays:
+            dict with the name of the array as key
+            and the value to assign to the memoryview
+        shapes:
+            dict with the name of the array as key and
+            a tuple of ints or str to validate the shape of the array provided
+        """
+        descriptors = {name: self.dtypes[name] for name in arrays}
+        with self._restore_on_error(descriptors.values()):
+            for name, shape in (shapes or {}).items():
+                descr = descriptors[name]
+                descr.shape = shape
+                self.check_ndims(descr)
+            dimensions = self._resolve_dimensions(descriptors.values())
+            if self.memory_budget is not None:
+                self._check_budget({
+                    name: np.size(arrays[name]) * np.dtype(descr.dtype).itemsize
+                    for name, descr in descriptors.items()})
+            validated = {name: descr.validate_array(arrays[name],
+                                                    self,
+                                                    dimensions)
+                         for name, descr in descriptors.items()}
+        self._assign_arrays(validated)
+
+    def _assign_arrays(self,
+                       arrays: Dict[str, np.ndarray],
+                       storage: str=None,
+                       shared: bool=False):
+        """
+        Assign validated arrays to the memoryviews
+
+        Parameters
+        ----------
+        arrays:
+            dict with the name of the array as key and the validated array
+        storage:
+            how the memory of the arrays has been allocated,
+            if None, the storage is determined from the arrays
+        shared:
+            if True, the arrays share the memory of the parent of a fork
+        """
+        for name, arr in arrays.items():
+            setattr(self, '_%s' % name, arr)
+            self._array_capacity.pop(name, None)
+            self._lazy_arrays.pop(name, None)
+            self._deferred_arrays.discard(name)
+            descr = self.dtypes[name]
+            memmap = memmap_of(arr)
+            descr.filename = getattr(memmap, 'filename', None)
+            if storage is not None:
+                descr.storage = storage
+            else:
+                descr.storage = 'memory' if memmap is None else 'memmap'
+            if shared:
+                self._shared_arrays.add(name)
+            elif name in self._shared_arrays:
+                self._shared_arrays.discard(name)
+                self._materialized[name] = arr.nbytes
+            # update the sum by the difference to the array replaced
+            nbytes = arr.nbytes if self._storage_class(name) == 'owned' else 0
+            self._owned_total += nbytes - self._owned_bytes.get(name, 0)
+            self._owned_bytes[name] = nbytes
+        self.invalidate_views(*arrays)
+        self.mark_dirty(*arrays)
+        self._update_ds(arrays)
+        self.peak_nbytes = max(self.peak_nbytes, self._owned_total)
+
+    def _resolve_dimensions(self,
+                            descriptors: Iterable[ArrayDescriptor],
+                            ) -> Dict[str, int]:
+        """
+        Get the values of all dimensions the arrays depend on
+
+        Parameters
+        ----------
+        descriptors:
+            the Array Descriptors
+
+        Returns
+        -------
+        :
+            dict with the dimension name as key and its length as value
+        """
+        dimensions = {}
+        for descr in descriptors:
+            for dim in descr.dimension_names:
+                if dim not in dimensions:
+                    dimensions[dim] = getattr(self, dim)
+        return dimensions
+
+    @contextmanager
+    def _restore_on_error(self, descriptors: Iterable[ArrayDescriptor]):
+        """
+        Restore the shape and the default of the Array Descriptors,
+        if an exception is raised
+        """
+        backup = [(descr, descr.shape, descr.default) for descr in descriptors]
+        try:
+            yield
+        except BaseException:
+            for descr, shape, default in backup:
+                descr.shape = shape
+                descr.default = default
+            raise
+
+    def invalidate_views(self, *names: str):
+        """
+        Remove the cached numpy views returned by the properties.
+        set_array does this automatically,
+        so this is only required, if a memoryview is assigned directly
+
+        Parameters
+        ----------
+        names:
+            the names of the arrays, if not given, all views are removed
+        """
+        if not names:
+            self._array_views.clear()
+        for name in names:
+            self._array_views.pop(name, None)
+
+    def copied_bytes(self) -> Dict[str, int]:
+        """
+        the number of bytes copied to convert the data
+        assigned to the arrays to the dtype of the memoryviews
+
+        Returns
+        -------
+        :
+            dict with the array name as key and the bytes copied as value
+            for all arrays that have been copied
+        """
+        return {name: descr.copied_bytes
+                for name, descr in self.dtypes.items()
+                if descr.n_copies}
+
+    def set_precision(self,
+                      policy: Dict[str, str]=None,
+                      overrides: Dict[str, str]=None):
+        """
+        Set the precision policy for storing the arrays in files.
+        The arrays in memory keep the dtype of the memoryviews,
+        which is defined in the cython class
+
+        Parameters
+        ----------
+        policy:
+            dict with the dtype of the memoryviews as key
+            and the dtype to store the arrays with, e.g. {'f8': 'f4'}
+        overrides:
+            dict with the name of the array as key and the dtype
+            to store the array with, overriding the policy
+        """
+        self.precision = {np.dtype(k).str: np.dtype(v).str
+                          for k, v in (policy or {}).items()}
+        for name in overrides or {}:
+            if name not in self.dtypes:
+                raise KeyError(f'{name} not in {list(self.dtypes)}')
+        self.precision_overrides = {k: np.dtype(v).str
+                                    for k, v in (overrides or {}).items()}
+
+    def storage_dtype(self, name: str) -> np.dtype:
+        """
+        the dtype the array is stored with in files
+        according to the precision policy
+
+        Parameters
+        ----------
+        name:
+            the name of the array
+
+        Returns
+        -------
+        :
+            the storage dtype
+        """
+        dtype = np.dtype(self.dtypes[name].dtype)
+        overrides = self.precision_overrides or {}
+        if name in overrides:
+            return np.dtype(overrides[name])
+        policy = self.precision or {}
+        return np.dtype(policy.get(dtype.str, dtype))
+
+    def precision_report(self) -> Dict[str, Dict[str, Union[str, int, float]]]:
+        """
+        the bytes saved by the precision policy and
+        the maximum rounding error seen converting arrays to lower precision
+        in set_array or of storing the current arrays in files.
+        The rounding error of the storage dtype is computed
+        only here, block by block
+
+        Returns
+        -------
+        :
+            dict with the name of the array as key
+            and a dict with the dtype, storage_dtype, nbytes, saved_bytes
+            and max_rounding_error for the arrays stored with another dtype
+            or rounded
+        """
+        report = {}
+        for name, descr in self.dtypes.items():
+            if descr.dtype == 'O':
+                continue
+            storage = self.storage_dtype(name)
+            dtype = np.dtype(descr.dtype)
+            if storage == dtype and not descr.max_rounding_error:
+                continue
+            try:
+                arr = np.asarray(getattr(self, '_%s' % name))
+            except AttributeError:
+                # the array is not initialized
+                arr = np.empty(0, dtype)
+            error = descr.max_rounding_error
+            if is_narrowing(dtype, storage):
+                error = max(error, storage_rounding_error(arr, storage))
+            report[name] = {
+                'dtype': dtype.str,
+                'storage_dtype': storage.str,
+                'nbytes': arr.size * dtype.itemsize,
+                'saved_bytes': arr.size * (dtype.itemsize - storage.itemsize),
+                'max_rounding_error': error,
+            }
+        return report
+
+    def _netcdf_encoding(self) -> Dict[str, Dict[str, str]]:
+        """
+        the encoding of the arrays stored with another dtype
+        according to the precision policy.
+        The writer converts the arrays, see precision_report
+        for the rounding error
+
+        Returns
+        -------
+        :
+            dict with the name of the array as key and the encoding
+        """
+        encoding = {}
+        for name, descr in self.dtypes.items():
+            if descr.dtype == 'O' or name not in self.ds:
+                continue
+            storage = self.storage_dtype(name)
+            dtype = np.dtype(descr.dtype)
+            if storage == dtype:
+                continue
+            encoding[name] = {'dtype': storage}
+        return encoding
+
+    def _nbytes_of(self,
+                   descr: ArrayDescriptor,
+                   dimensions: Dict[str, int]=None) -> int:
+        """the bytes of the array allocated for the Array Descriptor"""
+        if descr.shape is None:
+            return 0
+        shape = descr.get_shape(self, dimensions)
+        return int(np.prod(shape, dtype='i8')) * np.dtype(descr.dtype).itemsize
+
+    def _storage_class(self, name: str) -> str:
+        """
+        classify the memory of an array as 'owned' by the model,
+        'shared' with other processes or forks or 'mmapped' from a file
+        """
+        if name in self._shared_arrays:
+            return 'shared'
+        storage = self.dtypes[name].storage
+        if storage == 'memmap':
+            return 'mmapped'
+        if storage == 'shared':
+            return 'shared'
+        return 'owned'
+
+    def _owned_nbytes(self, exclude: Iterable[str]=()) -> int:
+        """the bytes of the arrays owned by the model"""
+        owned = self._owned_bytes
+        return self._owned_total - sum(owned.get(name, 0) for name in exclude)
+
+    def _check_budget(self, nbytes: Dict[str, int]):
+        """
+        Check that the arrays owned by the model do not exceed the memory budget
+        after the arrays have been replaced by new ones
+
+        Parameters
+        ----------
+        nbytes:
+            dict with the name of the array as key and the bytes of the new array
+        """
+        budget = self.memory_budget
+        if budget is None:
+            return
+        owned = self._owned_nbytes(exclude=nbytes)
+        new = sum(nbytes.values())
+        if owned + new > budget:
+            raise MemoryBudgetError(
+                f'{list(nbytes)}: allocating {new} bytes with {owned} bytes '
+                f'in use would exceed the memory budget of {budget} bytes')
+
+    def memory_report(self) -> Dict[str, Dict]:
+        """
+        Report the memory used by the arrays
+
+        Returns
+        -------
+        :
+            dict with the keys
+
+            - arrays: dict with the name of the array as key and a dict
+              with nbytes, storage ('owned', 'shared' or 'mmapped')
+              and the dimensions of the array.
+              The nbytes of object arrays include the size of the objects
+            - dimensions: dict with the dimension names as key and a dict
+              with the bytes of owned, shared and mmapped arrays
+            - total: dict with the bytes of owned, shared and mmapped arrays
+            - peak: the maximum bytes of the arrays owned by the model
+              without the objects of object arrays
+            - budget: the memory budget of the model
+        """
+        sparse_dims = {}
+        for descr in self.sparse_dtypes.values():
+            for component in descr.component_names:
+                sparse_dims[component] = descr.dimension_names
+        arrays = {}
+        dimensions = {}
+        total = dict(owned=0, shared=0, mmapped=0)
+        for name, descr in self.dtypes.items():
+            try:
+                arr = getattr(self, '_%s' % name)
+            except AttributeError:
+                # the array is not initialized
+                continue
+            nbytes = arr.nbytes
+            if descr.dtype == 'O':
+                objects = {id(obj): obj for obj in np.asarray(arr).flat}
+                nbytes += sum(sys.getsizeof(obj) for obj in objects.values())
+            storage = self._storage_class(name)
+            dims = sparse_dims.get(name, descr.dimension_names)
+            arrays[name] = dict(nbytes=nbytes, storage=storage, dims=dims)
+            by_storage = dimensions.setdefault(
+                dims, dict(owned=0, shared=0, mmapped=0))
+            by_storage[storage] += nbytes
+            total[storage] += nbytes
+        return dict(arrays=arrays,
+                    dimensions=dimensions,
+                    total=total,
+                    peak=self.peak_nbytes,
+                    budget=self.memory_budget)
 
     def reset_array(self, name: str):
         """
@@ -134,7 +796,11 @@ class _ArrayProperties:
         """
         descr = self.dtypes[name]
         default = descr.default
+        if name in self._shared_arrays:
+            self.materialize(name)
         getattr(self, name).fill(default)
+        # the cython code writes the array after resetting it
+        self.mark_dirty(name)
 
     def check_ndims(self, descr: ArrayDescriptor):
         """
@@ -150,10 +816,507 @@ class _ArrayProperties:
             raise ValueError(msg.format(ndim=descr.ndim,
                                         s=descr.shape, n=len(descr.shape)))
 
-    def init_arrays(self):
-        """Initialize all arrays defined in self.dtypes"""
+    def init_arrays(self,
+                    shapes: Dict[str, Tuple[Union[str, int]]]=None,
+                    defaults: Dict[str, Union[int, float]]=None,
+                    arena: bool=None,
+                    shared: bool=False):
+        """
+        Initialize all arrays defined in self.dtypes.
+        The dimensions are resolved only once and all arrays are allocated
+        before any array is assigned.
+
+        Parameters
+        ----------
+        shapes:
+            dict with the name of the array as key and the new shape
+        defaults:
+            dict with the name of the array as key and the new default value
+        arena:
+            if True, all arrays except object arrays are carved
+            out of one aligned contiguous block of memory, stored in self.arena.
+            If None, the class attribute use_arena is used
+        shared:
+            if True, the arena is allocated in shared memory,
+            see shared_handle() and attach()
+        """
+        if arena is None:
+            arena = self.use_arena or shared
+        descriptors = self.dtypes
+        with self._restore_on_error(descriptors.values()):
+            for name, shape in (shapes or {}).items():
+                descriptors[name].shape = shape
+            for name, default in (defaults or {}).items():
+                descriptors[name].default = default
+            # the sparse matrices are initialized empty
+            for descr in self.sparse_dtypes.values():
+                indptr, indices, data = descr.component_names
+                n_rows = descr.get_shape(self)[0]
+                descriptors[indptr].shape = n_rows + 1
+                descriptors[indptr].default = 0
+                descriptors[indices].shape = 0
+                descriptors[data].shape = 0
+            for descr in descriptors.values():
+                if descr.shape is not None:
+                    self.check_ndims(descr)
+            if self._defer_allocation:
+                # the empty sparse matrices are set by init_sparse_array
+                self._deferred_arrays.update(
+                    set(descriptors) - self._sparse_component_names())
+                return
+            dimensions = self._resolve_dimensions(descriptors.values())
+            if self.memory_budget is not None:
+                self._check_budget({
+                    name: self._nbytes_of(descr, dimensions)
+                    for name, descr in descriptors.items()})
+            if arena:
+                arena_descriptors = {name: descr
+                                     for name, descr in descriptors.items()
+                                     if descr.dtype != 'O'}
+                new_arena = self._allocate_arena(arena_descriptors, dimensions,
+                                                 shared)
+                arrays = {name: self._allocate_array(descr, dimensions)
+                          for name, descr in descriptors.items()
+                          if name not in arena_descriptors}
+            else:
+                new_arena = None
+                arrays = {name: self._allocate_array(descr, dimensions)
+                          for name, descr in descriptors.items()}
+        if new_arena is not None:
+            self._assign_arrays(new_arena.arrays,
+                                storage='shared' if shared else 'arena')
+        self._assign_arrays(arrays)
+        self.arena = new_arena
+
+    def _allocate_arena(self,
+                        descriptors: Dict[str, ArrayDescriptor],
+                        dimensions: Dict[str, int],
+                        shared: bool=False) -> Arena:
+        """
+        Allocate the arrays in one Arena and fill them with the default values
+
+        Parameters
+        ----------
+        descriptors:
+            the Array Descriptors of the arrays to allocate
+        dimensions:
+            the dimensions already resolved
+        shared:
+            if True, a SharedArena is allocated in shared memory
+
+        Returns
+        -------
+        :
+            the Arena holding the arrays
+        """
+        specs = {}
+        for name, descr in descriptors.items():
+            if descr.shape is not None:
+                shape = tuple(descr.get_shape(self, dimensions))
+            else:
+                shape = (0, ) * descr.ndim
+            specs[name] = (shape, descr.dtype)
+        arena = SharedArena(specs) if shared else Arena(specs)
+        for name, descr in descriptors.items():
+            if descr.shape is not None and descr.default is not None:
+                arena.arrays[name].fill(descr.default)
+        return arena
+
+    def share(self) -> SharedHandle:
+        """
+        Copy all arrays except object arrays into one block of shared memory,
+        which other processes can attach to
+
+        Returns
+        -------
+        :
+            the handle to pass to attach() in another process
+        """
+        descriptors = {name: descr for name, descr in self.dtypes.items()
+                       if descr.dtype != 'O'}
+        specs = {}
+        for name, descr in descriptors.items():
+            arr = self._get_array(descr)
+            shape = (0, ) * descr.ndim if arr is None else arr.shape
+            specs[name] = (shape, descr.dtype)
+        arena = SharedArena(specs)
+        for name, descr in descriptors.items():
+            arr = self._get_array(descr)
+            if arr is not None:
+                arena.arrays[name][...] = arr
+        self._assign_arrays(arena.arrays, storage='shared')
+        self.arena = arena
+        return self.shared_handle()
+
+    def _get_array(self, descr: ArrayDescriptor) -> np.ndarray:
+        """the array or None, if not initialized"""
+        try:
+            return getattr(self, descr.name)
+        except AttributeError:
+            return None
+
+    def shared_handle(self) -> SharedHandle:
+        """
+        a picklable handle to the arrays in shared memory,
+        allocated by init_arrays(shared=True) or share()
+
+        Returns
+        -------
+        :
+            the handle to pass to attach() in another process
+        """
+        if not isinstance(self.arena, SharedArena):
+            raise ValueError('the arrays are not in shared memory, '
+                             'use init_arrays(shared=True) or share() first')
+        handle = self.arena.handle
+        handle.dimensions = self._dimension_values()
+        for name, descr in self.dtypes.items():
+            if name not in handle.specs:
+                arr = self._get_array(descr)
+                if arr is not None:
+                    handle.objects[name] = arr
+        return handle
+
+    @classmethod
+    def attach(cls, handle: SharedHandle) -> '_ArrayProperties':
+        """
+        Create a new instance, whose arrays point to the shared memory
+        of another process without copying them
+
+        This works only, if the dimensions of the cythonarrays-class
+        are specified in the __init__() of the subclass
+        and the argument names match the names of the dimensions
+
+        Parameters
+        ----------
+        handle:
+            the handle returned by shared_handle() or share()
+
+        Returns
+        -------
+        :
+            the new instance
+        """
+        self = cls._from_dimensions(handle.dimensions)
+        arena = SharedArena(handle.specs, handle.alignment, name=handle.name)
+        arrays = {name: self.dtypes[name].validate_array(arr, self)
+                  for name, arr in arena.arrays.items()}
+        self._assign_arrays(arrays, storage='shared')
+        self.arena = arena
+        for name, arr in handle.objects.items():
+            self.set_array(name, arr)
+        self._allocate_deferred()
+        return self
+
+    def close_shared(self, unlink: bool=None) -> bool:
+        """
+        Copy the arrays in shared memory into private memory
+        and close the shared memory in this process
+
+        Parameters
+        ----------
+        unlink:
+            if True, the name of the shared memory is removed,
+            so that no other process can attach any more.
+            If None, the process which created the shared memory unlinks it
+
+        Returns
+        -------
+        :
+            False, if views on the shared arrays are still alive,
+            the memory is closed when they are garbage collected
+        """
+        arena = self.arena
+        if not isinstance(arena, SharedArena):
+            return True
+        arrays = {name: arr.copy() for name, arr in arena.arrays.items()}
+        self._assign_arrays(arrays)
+        self.arena = None
+        if unlink or (unlink is None and arena.owner):
+            arena.unlink()
+        return arena.close()
+
+    def _dimension_values(self) -> Dict[str, int]:
+        """the values of the dimensions defined in self._coordinates"""
+        return {dim: getattr(self, dim)
+                for dim in self._coordinates
+                if hasattr(self, dim)}
+
+    def fork(self, materialize: Iterable[str]=()) -> '_ArrayProperties':
+        """
+        Create a new instance, whose arrays share the memory of this instance.
+        An array is copied only when it is written to with set_array,
+        reset_array or a view requested with writable(),
+        the views returned by the properties are read-only until then.
+
+        The cython code writes directly into the memory,
+        so arrays written by the model (e.g. results) have to be materialized
+        before a calculation. This instance should not be changed
+        while the forks are in use.
+
+        This works only, if the dimensions of the cythonarrays-class
+        are specified in the __init__() of the subclass
+        and the argument names match the names of the dimensions
+
+        Parameters
+        ----------
+        materialize:
+            the names of the arrays to copy right away
+
+        Returns
+        -------
+        :
+            the new instance
+        """
+        child = self._from_dimensions(self._dimension_values())
+        arrays = {}
         for name in self.dtypes:
-            self.init_array(name)
+            try:
+                arrays[name] = getattr(self, '_%s' % name)
+            except AttributeError:
+                # the array is not initialized
+                continue
+        # the shared arrays are not owned by the child
+        child._assign_arrays(arrays, shared=True)
+        child._allocate_deferred()
+        child.materialize(*materialize)
+        return child
+
+    def materialize(self, *names: str):
+        """
+        Copy arrays sharing the memory of the parent of a fork,
+        so that they can be written to
+
+        Parameters
+        ----------
+        names:
+            the names of the arrays
+        """
+        arrays = {name: np.array(getattr(self, '_%s' % name))
+                  for name in names
+                  if name in self._shared_arrays}
+        if arrays:
+            self._assign_arrays(arrays)
+
+    def writable(self, name: str) -> np.ndarray:
+        """
+        A writable view on the array, which is copied before,
+        if it shares the memory of the parent of a fork
+
+        Parameters
+        ----------
+        name:
+            the name of the array
+
+        Returns
+        -------
+        :
+            the writable view
+        """
+        self.materialize(name)
+        self.mark_dirty(name)
+        return getattr(self, name)
+
+    def materialized_arrays(self) -> Dict[str, int]:
+        """
+        The arrays of a fork, which have been copied or set,
+        because they have been written to
+
+        Returns
+        -------
+        :
+            dict with the name of the array as key
+            and the bytes of the new array
+        """
+        return dict(self._materialized)
+
+    def mark_dirty(self, *names: str):
+        """
+        Mark arrays as changed, so that incremental saves rewrite them.
+        set_array, init_array, reset_array and writable() mark the arrays
+        automatically, so do models resetting their results before a kernel
+        writes them. Other arrays written in place (e.g. by the cython code)
+        have to be marked with this method
+
+        Parameters
+        ----------
+        names:
+            the names of the arrays or sparse matrices
+        """
+        for name in names:
+            if name in self.sparse_dtypes:
+                self.mark_dirty(*self.sparse_dtypes[name].component_names)
+                continue
+            if name not in self.dtypes:
+                raise KeyError(f'{name} is no array of {type(self).__name__}')
+            with self._versions_lock:
+                self._array_versions[name] = self._array_versions.get(name, 0) + 1
+                self._dirty_arrays.add(name)
+
+    @property
+    def dirty_arrays(self) -> Set[str]:
+        """the names of the arrays changed since the last save"""
+        return set(self._dirty_arrays)
+
+    def _changed_since_save(self, target: str, names: Iterable[str]) -> List[str]:
+        """
+        the arrays changed since they have been saved to target
+
+        Parameters
+        ----------
+        target:
+            the file or folder
+        names:
+            the names of the arrays
+
+        Returns
+        -------
+        :
+            the names of the changed arrays
+        """
+        saved = self._saved_versions.get(os.path.abspath(target), {})
+        return [name for name in names
+                if name not in saved
+                or saved[name] != self._array_versions.get(name, 0)]
+
+    def _record_save(self,
+                     target: str,
+                     names: Iterable[str],
+                     versions: Dict[str, int]=None):
+        """
+        record the versions of the arrays saved to target
+        and mark the saved arrays as clean
+
+        Parameters
+        ----------
+        target:
+            the file or folder
+        names:
+            the names of the arrays
+        versions:
+            the versions of the arrays saved,
+            if None, the current versions are saved
+        """
+        with self._versions_lock:
+            if versions is None:
+                versions = {name: self._array_versions.get(name, 0)
+                            for name in names}
+            self._saved_versions[os.path.abspath(target)] = versions
+            # arrays changed after a snapshot has been taken stay dirty
+            self._dirty_arrays = {
+                name for name in self._dirty_arrays
+                if versions.get(name) != self._array_versions.get(name, 0)}
+
+    @property
+    def shared_arrays(self) -> List[str]:
+        """the names of the arrays still sharing the memory of the parent"""
+        return sorted(self._shared_arrays)
+
+    @property
+    def dimension_registry(self) -> Dict[str, List[str]]:
+        """
+        the names of the arrays depending on each dimension
+
+        Returns
+        -------
+        :
+            dict with the dimension name as key
+            and a list of the names of the arrays depending on it
+        """
+        registry = {}
+        for name, descr in self.dtypes.items():
+            for dim in descr.dimension_names:
+                names = registry.setdefault(dim, [])
+                if name not in names:
+                    names.append(name)
+        return registry
+
+    def resize_dimension(self, dimension: str, n: int):
+        """
+        Set the dimension to n and resize all arrays depending on it.
+        The data is kept where the old and the new shape overlap,
+        new elements are filled with the default value.
+        When an array is shrinked, the memory is kept
+        and reused when the array grows again within that size
+
+        Parameters
+        ----------
+        dimension:
+            the name of the dimension
+        n:
+            the new length of the dimension
+        """
+        names = self.dimension_registry.get(dimension, [])
+        # the memory of the parent of a fork must not be reused
+        self.materialize(*self._shared_arrays.intersection(names))
+        descriptors = [self.dtypes[name] for name in names]
+        dimensions = self._resolve_dimensions(descriptors)
+        dimensions[dimension] = n
+        if self.memory_budget is not None:
+            self._check_budget({descr.name: self._nbytes_of(descr, dimensions)
+                                for descr in descriptors
+                                if descr.storage != 'memmap'})
+        arrays = {}
+        capacities = {}
+        for descr in descriptors:
+            shape = tuple(descr.get_shape(self, dimensions))
+            arrays[descr.name], capacities[descr.name] = \
+                self._resize_array(descr, shape)
+        sparse = {}
+        for name, descr in self.sparse_dtypes.items():
+            if dimension in descr.dimension_names:
+                shape = tuple(descr.get_shape(self, {dimension: n}))
+                sparse[name] = descr.resize(*self._sparse_components(descr),
+                                            shape)
+        setattr(self, dimension, n)
+        self._assign_arrays(arrays)
+        self._array_capacity.update(capacities)
+        for name, (indptr, indices, data) in sparse.items():
+            self.set_sparse_array(name, (data, indices, indptr))
+
+    def _resize_array(self,
+                      descr: ArrayDescriptor,
+                      shape: Tuple[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Resize an array to shape.
+
+        Parameters
+        ----------
+        descr:
+            the Array Descriptor
+        shape:
+            the new shape
+
+        Returns
+        -------
+        arr:
+            the resized array
+        capacity:
+            the array holding the memory of arr
+        """
+        name = descr.name
+        try:
+            old = np.asarray(getattr(self, '_%s' % name))
+        except AttributeError:
+            # memoryview not initialized
+            old = np.empty([0] * descr.ndim, dtype=descr.dtype)
+        capacity = self._array_capacity.get(name, old)
+        if all(n <= c for n, c in zip(shape, capacity.shape)):
+            # the data of old is at the same position in capacity
+            arr = capacity[tuple(slice(0, n) for n in shape)]
+        else:
+            arr = self._empty(descr, shape)
+            overlap = tuple(slice(0, min(o, n)) for o, n in zip(old.shape, shape))
+            arr[overlap] = old[overlap]
+            capacity = arr
+        if descr.default is not None:
+            # fill the new elements with the default value
+            for d in range(descr.ndim):
+                region = tuple(
+                    [slice(0, min(o, n)) for o, n in zip(old.shape[:d], shape[:d])]
+                    + [slice(old.shape[d], shape[d])])
+                arr[region] = descr.default
+        return arr, capacity
 
     def init_object_array(self, name: str, shape: Union[str, Tuple[str, int]]):
         """
@@ -170,40 +1333,708 @@ class _ArrayProperties:
             shape = shape.split(',')
         ndim = len(shape)
 
-        intern_name = '_%s' % name
-        self.dtypes[name] = descr = ArrayDescriptor(name, 'O', ndim)
-        prop = self._create_prop(descr)
-        setattr(self.__class__, descr.name, prop)
+        descr = ArrayDescriptor(name, 'O', ndim)
+        self.dtypes[name] = descr
+        self._install_properties({name: descr})
         self.init_array(name, shape=shape)
 
+    def init_sparse_array(self,
+                          name: str,
+                          shape: Union[str, Tuple[Union[str, int]]],
+                          default: Union[int, float]=0):
+        """
+        initialize an empty sparse matrix in CSR-format,
+        which is stored in the arrays `name_indptr`, `name_indices`
+        and `name_data` declared in the cython class
+
+        Parameters
+        ----------
+        name:
+            the name of the matrix
+        shape:
+            the shape of the matrix
+        default:
+            the value of the elements not stored in the matrix
+        """
+        data = self.dtypes.get(f'{name}_data')
+        if data is None:
+            raise ValueError(f'{name}_data is not defined in the cython class')
+        descr = SparseArrayDescriptor(name, data.dtype, shape, default)
+        missing = [c for c in descr.component_names if c not in self.dtypes]
+        if missing:
+            raise ValueError(f'{missing} not defined in the cython class')
+        self.check_ndims(descr)
+        self.sparse_dtypes[name] = descr
+        self._install_properties({name: descr})
+        self.set_sparse_array(name, None)
+
+    def set_sparse_array(self, name: str, value):
+        """
+        Sets the components of the sparse matrix name
+
+        Parameters
+        ----------
+        name:
+            the name of the matrix
+        value:
+            a scipy.sparse matrix or array,
+            a tuple (data, indices, indptr) like scipy.sparse.csr_array accepts,
+            a dense array, where the elements equal to the default are dropped,
+            or None for an empty matrix
+        """
+        descr = self.sparse_dtypes[name]
+        components = descr.to_csr(value, self)
+        arrays = dict(zip(descr.component_names, components))
+        shapes = {c: arr.shape for c, arr in arrays.items()}
+        self.set_arrays(arrays, shapes)
+
+    def _sparse_components(self, descr: SparseArrayDescriptor
+                           ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """the arrays indptr, indices and data of the sparse matrix"""
+        return tuple(getattr(self, c) for c in descr.component_names)
+
+    def get_sparse_array(self, name: str):
+        """
+        The sparse matrix name as scipy.sparse.csr_array,
+        which shares the memory with the arrays
+
+        Parameters
+        ----------
+        name:
+            the name of the matrix
+
+        Returns
+        -------
+        :
+            the scipy.sparse.csr_array
+        """
+        from scipy.sparse import csr_array
+        descr = self.sparse_dtypes[name]
+        indptr, indices, data = self._sparse_components(descr)
+        return csr_array((data, indices, indptr),
+                         shape=tuple(descr.get_shape(self)))
+
+    def get_dense_array(self, name: str) -> np.ndarray:
+        """
+        The sparse matrix name as dense array
+        filled with the default value
+
+        Parameters
+        ----------
+        name:
+            the name of the matrix
+
+        Returns
+        -------
+        :
+            the dense array
+        """
+        descr = self.sparse_dtypes[name]
+        return descr.to_dense(*self._sparse_components(descr),
+                              tuple(descr.get_shape(self)))
+
+    def to_arrow(self,
+                 names: Iterable[str],
+                 coordinates: bool=False):
+        """
+        Export arrays with the same dimensions as Arrow record batch
+        in long format with one row per element.
+        The columns of numeric arrays share the memory with the memoryviews,
+        boolean and object arrays and the coordinate columns are copied.
+        The dimensions, the shape and the coordinates of the dimensions
+        are stored in the metadata of the schema as json with the keys
+        `cythonarrays.dims`, `cythonarrays.shape` and `cythonarrays.coords`
+
+        Parameters
+        ----------
+        names:
+            the names of the arrays
+        coordinates:
+            if True, a column with the coordinate of each element
+            is added for each dimension, which needs as much memory
+            as an array of int64 or objects per dimension
+
+        Returns
+        -------
+        pyarrow.RecordBatch:
+            the record batch
+        """
+        import pyarrow as pa
+        names = list(names)
+        all_dims = self._ds_dims()
+        dims = [tuple(all_dims[name]) for name in names]
+        if not names or len(set(dims)) > 1:
+            raise ValueError(f'the arrays {names} need the same dimensions, '
+                             f'not {dims}')
+        dims = dims[0]
+        shape = getattr(self, names[0]).shape
+        columns = {}
+        if coordinates:
+            for axis, dim in enumerate(dims):
+                if dim in self._coordinates:
+                    values = np.asarray(self._ds_coordinates([dim])[dim])
+                else:
+                    values = np.arange(shape[axis])
+                values = np.repeat(values, int(np.prod(shape[axis + 1:])))
+                columns[dim] = np.tile(values, int(np.prod(shape[:axis])))
+        for name in names:
+            columns[name] = np.ravel(getattr(self, name))
+        coords = {dim: np.asarray(values).tolist() for dim, values
+                  in self._ds_coordinates(
+                      [dim for dim in dims if dim in self._coordinates]).items()}
+        metadata = {'cythonarrays.dims': json.dumps(dims),
+                    'cythonarrays.shape': json.dumps(shape),
+                    'cythonarrays.coords': json.dumps(coords)}
+        return pa.RecordBatch.from_arrays(
+            [pa.array(values) for values in columns.values()],
+            names=list(columns), metadata=metadata)
+
+    def to_arrow_tensor(self, name: str):
+        """
+        Export an array as Arrow tensor sharing the memory with the memoryview
+
+        Parameters
+        ----------
+        name:
+            the name of the array
+
+        Returns
+        -------
+        pyarrow.Tensor:
+            the tensor with the names of the dimensions
+        """
+        import pyarrow as pa
+        dims = [str(dim) for dim in self._ds_dims()[name]]
+        return pa.Tensor.from_numpy(getattr(self, name), dim_names=dims)
+
+    def write_arrow(self,
+                    sink,
+                    names: Iterable[str],
+                    coordinates: bool=False,
+                    format: str='stream'):
+        """
+        Write arrays with the same dimensions as Arrow record batch
+        (see to_arrow) without compression
+
+        Parameters
+        ----------
+        sink:
+            the filepath or a writable file-like object, e.g. a pipe
+        names:
+            the names of the arrays
+        coordinates:
+            if True, the coordinates are written as columns,
+            otherwise only in the metadata
+        format:
+            'stream' for the Arrow IPC stream format,
+            'feather' for the Arrow IPC file format (Feather V2),
+            which can be memory-mapped by the reader
+        """
+        import pyarrow as pa
+        if format not in ARROW_FORMATS:
+            raise ValueError(f'format {format} not in {ARROW_FORMATS}')
+        batch = self.to_arrow(names, coordinates)
+        new_writer = pa.ipc.new_stream if format == 'stream' else pa.ipc.new_file
+        with new_writer(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+
     def create_ds(self):
         """
-        Create xarray-Dataset that is linked to the arrays
+        Create xarray-Dataset that is linked to the arrays.
+        When arrays are set afterwards, only their variables are replaced
+        and the coordinates of the dimensions changed are rebuilt
+        """
+        dims = self._ds_dims()
+        # arrays not allocated yet are added, when they are set
+        pending = self._deferred_arrays
+        variables = {name: xr.Variable(dims[name], getattr(self, name))
+                     for name in self.dtypes if name not in pending}
+        coordinates = [dim for dim, name in self._coordinates.items()
+                       if name not in pending]
+        self.ds = xr.Dataset(variables).assign_coords(
+            **self._ds_coordinates(coordinates))
+
+    def _ds_dims(self) -> Dict[str, Tuple[str]]:
+        """
+        the dimensions of the variables in self.ds,
+        derived again only if the shape of an Array Descriptor has changed
+        """
+        key = (ArrayDescriptor.shape_changes,
+               len(self.dtypes), len(self.sparse_dtypes))
+        cached_key, dims = self._ds_dims_cache
+        if cached_key == key:
+            return dims
+        component_dims = {}
+        for descr in self.sparse_dtypes.values():
+            component_dims.update(descr.component_dims)
+        dims = {}
+        for name, descr in self.dtypes.items():
+            dims[name] = component_dims.get(name, descr._shape)
+            if dims[name] is None:
+                # the default dimensions of xarray
+                dims[name] = [f'dim_{i}' for i in range(descr.ndim)]
+        self._ds_dims_cache = (key, dims)
+        return dims
+
+    def _ds_coordinates(self, dims: Iterable[str]) -> Dict[str, np.ndarray]:
+        """the coordinates of the dimensions"""
+        return {dim: getattr(self, self._coordinates[dim]) for dim in dims}
+
+    def _update_ds(self, names: Iterable[str]):
+        """
+        Replace the variables of the arrays in self.ds, if it exists.
+        If the length of a dimension has changed, self.ds is recreated.
+        It is removed, as long as the shapes of the arrays do not fit together
+
+        Parameters
+        ----------
+        names:
+            the names of the arrays set
         """
-        self.ds = xr.Dataset()
-        for name, dtype in self.dtypes.items():
+        ds = self.__dict__.get('ds')
+        if ds is None:
+            return
+        dims = self._ds_dims()
+        sizes = ds.sizes
+        variables = {}
+        resized = False
+        for name in names:
             arr = getattr(self, name)
-            self.ds[name] = xr.DataArray(arr, dims=dtype._shape)
-        coord_dict = {}
-        for key, value in self._coordinates.items():
-            coord_dict[key] = getattr(self, value)
-        self.ds = self.ds.assign_coords(**coord_dict)
+            for dim, n in zip(dims[name], arr.shape):
+                resized |= sizes.get(dim, n) != n
+            variables[name] = xr.Variable(dims[name], arr)
+        if resized:
+            try:
+                self.create_ds()
+            except ValueError:
+                del self.ds
+            return
+        ds.update(variables)
+        coordinates = [dim for dim, name in self._coordinates.items()
+                       if name in variables]
+        if coordinates:
+            self.ds = ds.assign_coords(**self._ds_coordinates(coordinates))
 
-    def save_dataset_to_netcdf(self, filepath: str):
+    def netcdf_encoding(self,
+                        compression: str=None,
+                        compression_level: int=COMPRESSION_LEVEL,
+                        chunk_bytes: int=CHUNK_BYTES,
+                        chunk_dims: Dict[str, int]=None,
+                        encoding: Dict[str, Dict]=None,
+                        ) -> Dict[str, Dict]:
+        """
+        The encoding of the arrays in self.ds for a netcdf-file.
+        With compression, arrays of at least MIN_COMPRESSION_BYTES are chunked
+        and compressed, smaller arrays are stored contiguous,
+        so they can be memory-mapped.
+        The dtypes follow the precision policy
+
+        Parameters
+        ----------
+        compression:
+            'gzip' to compress the large arrays,
+            by default all arrays are stored uncompressed
+        compression_level:
+            the gzip compression level
+        chunk_bytes:
+            the target size of a chunk, by default the arrays are chunked
+            in blocks of rows with all columns (see array_io.default_chunks)
+        chunk_dims:
+            dict with the name of a dimension as key
+            and the chunk size along this dimension
+        encoding:
+            dict with the name of an array as key and its encoding
+            overriding the defaults, e.g. {'trips_ij': {'compression': None}}
+
+        Returns
+        -------
+        :
+            dict with the name of the array as key and the encoding
+        """
+        chunk_dims = chunk_dims or {}
+        result = self._netcdf_encoding()
+        for name, descr in self.dtypes.items():
+            if descr.dtype == 'O' or name not in self.ds:
+                continue
+            data_array = self.ds[name]
+            enc = result.setdefault(name, {})
+            storage = self.storage_dtype(name)
+            nbytes = data_array.size * storage.itemsize
+            if compression is not None and nbytes >= MIN_COMPRESSION_BYTES:
+                fixed = {axis: chunk_dims[dim]
+                         for axis, dim in enumerate(data_array.dims)
+                         if dim in chunk_dims}
+                enc['chunksizes'] = default_chunks(
+                    data_array.shape, storage.itemsize, chunk_bytes, fixed)
+                enc['compression'] = compression
+                enc['compression_opts'] = compression_level
+                enc['shuffle'] = True
+            enc.update((encoding or {}).get(name, {}))
+            if enc.get('compression') is None:
+                for key in ('compression', 'compression_opts', 'shuffle'):
+                    enc.pop(key, None)
+            result[name] = {k: v for k, v in enc.items() if v is not None}
+        return {name: enc for name, enc in result.items() if enc}
+
+    def save_dataset_to_netcdf(self,
+                               filepath: str,
+                               compression: str=None,
+                               compression_level: int=COMPRESSION_LEVEL,
+                               chunk_bytes: int=CHUNK_BYTES,
+                               chunk_dims: Dict[str, int]=None,
+                               encoding: Dict[str, Dict]=None,
+                               n_threads: int=1,
+                               incremental: bool=False):
         """
         Save Dataset to netcdf-file
+        with the dtypes of the precision policy.
+        By default the arrays are written uncompressed by xarray,
+        with compression='gzip' they are chunked and compressed
+        as defined by netcdf_encoding()
+
+        Parameters
+        ----------
+        filepath:
+            the filepath to store the data
+        compression, compression_level, chunk_bytes, chunk_dims, encoding:
+            see netcdf_encoding
+        n_threads:
+            the number of threads compressing the chunks of the gzip-compressed
+            arrays concurrently. By default xarray writes all arrays,
+            if None, the number of cpus is used
+        incremental:
+            if True and the Dataset has been saved to filepath before,
+            only the arrays marked dirty since then are written
+            into the existing file (see mark_dirty).
+            The file is rewritten completely, if the shape of a changed array,
+            a coordinate or an object array has changed
+        """
+        if not hasattr(self, 'ds'):
+            self.create_ds()
+        names = [name for name in self.dtypes if name in self.ds]
+        if (incremental and os.path.abspath(filepath) in self._saved_versions
+                and os.path.exists(filepath)):
+            changed = self._changed_since_save(filepath, names)
+            if self._update_netcdf(filepath, changed):
+                self._record_save(filepath, names)
+                return
+        encoding = self.netcdf_encoding(compression, compression_level,
+                                        chunk_bytes, chunk_dims, encoding)
+        self._write_netcdf(self.ds, filepath, encoding, n_threads,
+                           self.object_encoding)
+        self._record_save(filepath, names)
+
+    def save_async(self,
+                   filepath: str,
+                   compression: str=None,
+                   compression_level: int=COMPRESSION_LEVEL,
+                   chunk_bytes: int=CHUNK_BYTES,
+                   chunk_dims: Dict[str, int]=None,
+                   encoding: Dict[str, Dict]=None,
+                   n_threads: int=1) -> Future:
+        """
+        Save a snapshot of the Dataset to a netcdf-file in a background thread,
+        so that the model can go on calculating while the file is written.
+
+        The arrays are copied into snapshot buffers, which are reused
+        by later saves. If max_saves_in_flight saves are still pending,
+        the call blocks until one of them has finished,
+        which limits the memory of the snapshots.
+        The saves are written one after another in the order submitted
 
         Parameters
         ----------
         filepath:
             the filepath to store the data
+        compression, compression_level, chunk_bytes, chunk_dims, encoding,
+        n_threads:
+            see save_dataset_to_netcdf
+
+        Returns
+        -------
+        :
+            a future, whose result is the filepath,
+            when the file has been written
         """
         if not hasattr(self, 'ds'):
             self.create_ds()
-        self.ds.to_netcdf(filepath, engine='h5netcdf')
+        if self._save_executor is None:
+            self._save_executor = ThreadPoolExecutor(
+                1, thread_name_prefix='cythonarrays_save')
+            self._save_slots = threading.BoundedSemaphore(
+                self.max_saves_in_flight)
+            weakref.finalize(self, self._save_executor.shutdown)
+        self._save_slots.acquire()
+        try:
+            buffers = self._snapshot_buffers.pop() if self._snapshot_buffers else {}
+            snapshot = self._snapshot_ds(buffers)
+            encoding = self.netcdf_encoding(compression, compression_level,
+                                            chunk_bytes, chunk_dims, encoding)
+            names = [name for name in self.dtypes if name in self.ds]
+            versions = {name: self._array_versions.get(name, 0)
+                        for name in names}
+            object_encoding = self.object_encoding
+        except BaseException:
+            self._save_slots.release()
+            raise
+
+        def write() -> str:
+            try:
+                self._write_netcdf(snapshot, filepath, encoding, n_threads,
+                                   object_encoding)
+                self._record_save(filepath, names, versions)
+            finally:
+                # release the snapshot before the future is done
+                self._snapshot_buffers.append(buffers)
+                self._save_slots.release()
+            return filepath
+
+        future = self._save_executor.submit(write)
+        self._pending_saves = {f for f in self._pending_saves if not f.done()}
+        self._pending_saves.add(future)
+        return future
+
+    def _snapshot_ds(self, buffers: Dict[str, np.ndarray]) -> xr.Dataset:
+        """
+        Copy the data of self.ds into buffers
+
+        Parameters
+        ----------
+        buffers:
+            dict with the name of the array as key and a buffer,
+            which is reused if shape and dtype fit, otherwise replaced
+
+        Returns
+        -------
+        :
+            a Dataset with the copies of the data variables
+        """
+        data = {}
+        for name, variable in self.ds.data_vars.items():
+            values = variable.values
+            buffer = buffers.get(name)
+            if (buffer is None or buffer.shape != values.shape
+                    or buffer.dtype != values.dtype or values.dtype.hasobject):
+                buffer = np.array(values, copy=True)
+                buffers[name] = buffer
+            else:
+                np.copyto(buffer, values)
+            data[name] = buffer
+        return self.ds.copy(data=data)
+
+    def wait_for_saves(self, timeout: float=None) -> bool:
+        """
+        Wait until the saves started with save_async have finished
+
+        Parameters
+        ----------
+        timeout:
+            the maximum number of seconds to wait, if None, wait without limit
+
+        Returns
+        -------
+        :
+            True, if all saves have finished
+        """
+        done, not_done = wait(list(self._pending_saves), timeout=timeout)
+        self._pending_saves = not_done
+        for future in done:
+            # raise errors of the background writer
+            future.result()
+        return not not_done
+
+    @property
+    def pending_saves(self) -> int:
+        """the number of saves started with save_async not finished yet"""
+        return sum(not future.done() for future in self._pending_saves)
+
+    @staticmethod
+    def _write_netcdf(ds: xr.Dataset,
+                      filepath: str,
+                      encoding: Dict[str, Dict],
+                      n_threads: int=1,
+                      object_encoding: str='categorical') -> str:
+        """
+        Write a Dataset to a netcdf-file
+
+        Parameters
+        ----------
+        ds:
+            the Dataset
+        filepath:
+            the netcdf-file
+        encoding:
+            dict with the name of the array as key and the encoding
+        n_threads:
+            the number of threads compressing the chunks,
+            see save_dataset_to_netcdf
+        object_encoding:
+            the encoding of object arrays, see array_io.encode_objects
+
+        Returns
+        -------
+        :
+            the filepath
+        """
+        ds = encode_objects(ds, object_encoding)
+        if n_threads is None:
+            n_threads = os.cpu_count() or 1
+        parallel = {}
+        if n_threads > 1:
+            parallel = {name: enc for name, enc in encoding.items()
+                        if enc.get('compression') == 'gzip'
+                        and name in ds.data_vars}
+        ds.drop_vars(list(parallel)).to_netcdf(
+            filepath, engine='h5netcdf',
+            encoding={name: enc for name, enc in encoding.items()
+                      if name not in parallel})
+        if parallel:
+            _ArrayProperties._write_parallel(ds, filepath, parallel, n_threads)
+        return filepath
+
+    def _update_netcdf(self, filepath: str, names: List[str]) -> bool:
+        """
+        Write arrays into the variables of an existing netcdf-file
+
+        Parameters
+        ----------
+        filepath:
+            the netcdf-file
+        names:
+            the names of the arrays
+
+        Returns
+        -------
+        :
+            False, if the arrays cannot be written in place and
+            the file has to be rewritten
+        """
+        import h5py
+        coordinates = set(self._coordinates.values())
+        arrays = {name: getattr(self, name) for name in names}
+        with h5py.File(filepath, 'r+') as f:
+            for name, arr in arrays.items():
+                if (name in coordinates or self.dtypes[name].dtype == 'O'
+                        or name not in f or f[name].shape != arr.shape):
+                    return False
+            for name, arr in arrays.items():
+                f[name][...] = arr
+        return True
+
+    @staticmethod
+    def _write_parallel(ds: xr.Dataset,
+                        filepath: str,
+                        encoding: Dict[str, Dict],
+                        n_threads: int):
+        """
+        Add gzip-compressed arrays to a netcdf-file,
+        whose chunks are compressed in parallel threads
+
+        Parameters
+        ----------
+        ds:
+            the Dataset with the arrays
+        filepath:
+            the netcdf-file
+        encoding:
+            dict with the name of the array as key and the encoding
+        n_threads:
+            the number of threads
+        """
+        import h5netcdf
+        import h5py
+        fillvalues = {}
+        with h5netcdf.File(filepath, 'a') as f:
+            for name, enc in encoding.items():
+                data_array = ds[name]
+                for dim, size in data_array.sizes.items():
+                    if dim not in f.dimensions:
+                        f.dimensions[dim] = size
+                dtype = np.dtype(enc.get('dtype', data_array.dtype))
+                # xarray stores floats with NaN as fill value
+                fillvalue = np.nan if dtype.kind in 'fc' else None
+                fillvalues[name] = fillvalue
+                variable = f.create_variable(
+                    name, data_array.dims, dtype=dtype, fillvalue=fillvalue,
+                    chunks=enc['chunksizes'], compression='gzip',
+                    compression_opts=enc.get('compression_opts'),
+                    shuffle=enc.get('shuffle', False))
+                variable.attrs.update(data_array.attrs)
+        with h5py.File(filepath, 'a') as f, \
+                ThreadPoolExecutor(n_threads) as executor:
+            for name, enc in encoding.items():
+                write_chunks_parallel(
+                    f[name], ds[name].values, fillvalues[name],
+                    enc.get('compression_opts', COMPRESSION_LEVEL),
+                    enc.get('shuffle', False), executor)
 
     @classmethod
-    def from_netcdf(cls, filepath: str) -> '_ArrayProperties':
+    def _from_dimensions(cls, dimensions: Dict[str, int]) -> '_ArrayProperties':
+        """
+        Create a new instance with the dimensions,
+        which are arguments to the __init__-method
+
+        The arrays defined by init_array and init_arrays in the __init__-method
+        are not allocated, because the caller replaces most of them.
+        An array read through its property before, e.g. later in __init__,
+        is allocated then. The caller has to set the arrays and call
+        _allocate_deferred() to allocate the remaining ones
+        with their default values
+
+        Parameters
+        ----------
+        dimensions:
+            dict with the name of the dimension as key and its length
+
+        Returns
+        -------
+        :
+            the new instance
+        """
+        cls_init_args = cls.__init__.__code__.co_varnames
+        # only if these dimensions are arguments to the __init__-method
+        kwargs = {key: value for key, value in dimensions.items()
+                  if key in cls_init_args}
+        self = cls.__new__(cls)
+        self._defer_allocation = True
+        try:
+            self.__init__(**kwargs)
+        finally:
+            del self._defer_allocation
+        return self
+
+    def _allocate_deferred(self, names: Iterable[str]=None):
+        """
+        Allocate the arrays defined while the instance has been created
+        by _from_dimensions, which have not been set or registered
+        to be read lazily since then
+
+        Parameters
+        ----------
+        names:
+            the names of the arrays to allocate, by default all of them
+        """
+        names = self._deferred_arrays if names is None else set(names)
+        descriptors = {name: self.dtypes[name]
+                       for name in names & self._deferred_arrays
+                       if name not in self._lazy_arrays}
+        self._deferred_arrays = self._deferred_arrays - names
+        if not descriptors:
+            return
+        dimensions = self._resolve_dimensions(descriptors.values())
+        if self.memory_budget is not None:
+            self._check_budget({name: self._nbytes_of(descr, dimensions)
+                                for name, descr in descriptors.items()})
+        self._assign_arrays({name: self._allocate_array(descr, dimensions)
+                             for name, descr in descriptors.items()})
+
+    @classmethod
+    def from_netcdf(cls,
+                    filepath: str,
+                    variables: Iterable[str]=None,
+                    lazy: bool=False,
+                    select: Dict[str, Union[slice, Iterable[int]]]=None,
+                    ) -> '_ArrayProperties':
         """
         Read Data from a netcdf-file and create a new Cdef-Class-instance
 
@@ -215,20 +2046,333 @@ class _ArrayProperties:
         ----------
         filepath:
             the filepath to read the netcdf-data from
+        variables:
+            the names of the arrays and sparse matrices to read.
+            If None, all are read. The others keep the values of __init__()
+        lazy:
+            if True, the variables stored contiguous and uncompressed
+            with the dtype of the memoryview are mapped into memory
+            copy-on-write, so only the data used is read from the file.
+            The other variables are not allocated before they are read
+            on the first access of the property or with load().
+            Call load() before cython code uses the arrays
+            or decorate the methods with loads_lazy_arrays.
+            In lazy mode, self.ds is not linked to the arrays
+        select:
+            dict with the name of a dimension as key and a slice or the
+            positions along the dimension to read,
+            e.g. {'groups': [1], 'origins': slice(0, 100)}.
+            Only these parts of the variables are read from the file,
+            the instance is created with the lengths of the selection.
+            Dimensions which have to be equal (e.g. origins and destinations)
+            need the same selection
         """
-        ds = xr.open_dataset(filepath, engine='h5netcdf')
+        ds = decode_objects(xr.open_dataset(filepath, engine='h5netcdf'))
+        sizes = dict(ds.sizes)
+        if select:
+            unknown = [dim for dim in select if dim not in sizes]
+            if unknown:
+                raise KeyError(f'{unknown} are no dimensions in {filepath}')
+            # indexing the lazily opened Dataset reads only the selection
+            ds = ds.isel(select)
+        else:
+            select = {}
         # create a dictionary with the dimensions
-        dimensions = dict()
-        cls_init_args = cls.__init__.__code__.co_varnames
-        for key, value in cls._coordinates.items():
-            # only if these dimensions are arguments to the __init__-method
-            if key in cls_init_args:
-                dimensions[key] = len(ds[value])
+        dimensions = {key: ds.sizes[key] if key in select else len(ds[value])
+                      for key, value in cls._coordinates.items()}
         # create the class instance
-        self = cls(**dimensions)
+        self = cls._from_dimensions(dimensions)
+        if variables is None:
+            variables = list(self.sparse_dtypes) + [
+                name for name in self.dtypes
+                if name not in self._sparse_component_names()]
+        unknown = [name for name in variables
+                   if name not in self.dtypes
+                   and name not in self.sparse_dtypes]
+        if unknown:
+            raise KeyError(f'{unknown} are no arrays of {cls.__name__}')
+        if lazy:
+            self._map_netcdf(filepath, ds, variables, select, sizes)
+            # the arrays read on first access are not allocated before
+            self._allocate_deferred()
+            return self
         # link the Dataset and the Arrays
         self.ds = ds
-        for name, dtype in self.dtypes.items():
-            arr = ds[name]
-            setattr(self, name, arr.values)
+        for name in variables:
+            if name in self.sparse_dtypes:
+                self._read_sparse(name, ds, select, sizes)
+            else:
+                setattr(self, name, ds[name].values)
+        self._allocate_deferred()
         return self
+
+    def _read_sparse(self,
+                     name: str,
+                     ds: xr.Dataset,
+                     select: Dict[str, Union[slice, Iterable[int]]],
+                     sizes: Dict[str, int]):
+        """
+        Read a sparse matrix from a netcdf-file and select the rows and columns
+
+        Parameters
+        ----------
+        name:
+            the name of the sparse matrix
+        ds:
+            the Dataset opened from the file
+        select:
+            dict with the name of a dimension as key
+            and the slice or the positions to select
+        sizes:
+            the lengths of the dimensions in the file
+        """
+        descr = self.sparse_dtypes[name]
+        indptr, indices, data = (ds[c].values for c in descr.component_names)
+        dims = descr.shape
+        if not any(dim in select for dim in dims):
+            self.set_sparse_array(name, (data, indices, indptr))
+            return
+        from scipy.sparse import csr_array
+        shape = tuple(sizes.get(dim, dim) for dim in dims)
+        matrix = csr_array((data, indices, indptr), shape=shape)
+        for axis, dim in enumerate(dims):
+            if dim in select:
+                positions = np.arange(shape[axis])[select[dim]]
+                matrix = matrix[positions] if axis == 0 else matrix[:, positions]
+        self.set_sparse_array(name, matrix)
+
+    def _sparse_component_names(self) -> set:
+        """the names of the arrays holding the components of sparse matrices"""
+        return {component
+                for descr in self.sparse_dtypes.values()
+                for component in descr.component_names}
+
+    def _map_netcdf(self,
+                    filepath: str,
+                    ds: xr.Dataset,
+                    variables: List[str],
+                    select: Dict[str, Union[slice, Iterable[int]]]=None,
+                    sizes: Dict[str, int]=None):
+        """
+        map the variables of a netcdf-file into memory where possible
+        and register the others to be read on first access
+
+        Parameters
+        ----------
+        filepath:
+            the netcdf-file
+        ds:
+            the Dataset opened lazily
+        variables:
+            the names of the arrays and sparse matrices to read
+        select:
+            dict with the name of a dimension as key
+            and the slice or the positions to select.
+            Variables with a selection are read on first access
+        sizes:
+            the lengths of the dimensions in the file
+        """
+        select = select or {}
+        names = []
+        for name in variables:
+            if name in self.sparse_dtypes:
+                if any(dim in select for dim in self.sparse_dtypes[name].shape):
+                    self._read_sparse(name, ds, select, sizes)
+                else:
+                    names.extend(self.sparse_dtypes[name].component_names)
+            else:
+                names.append(name)
+        mappable = contiguous_variables(
+            filepath, [name for name in names
+                       if not any(dim in select for dim in ds[name].dims)])
+        components = self._sparse_component_names()
+        for name in names:
+            descr = self.dtypes[name]
+            if name in mappable and mappable[name][1] == np.dtype(descr.dtype):
+                offset, dtype, shape = mappable[name]
+                arr = np.memmap(filepath, dtype=dtype, mode='c',
+                                offset=offset, shape=shape)
+                self.set_array(name, arr,
+                               shape=shape if name in components else None)
+            else:
+                self._lazy_arrays[name] = ds[name]
+                self.invalidate_views(name)
+        # keep the file open for the variables read on first access
+        self._lazy_source = ds
+
+    def load(self, *names: str):
+        """
+        Read the variables of a netcdf-file opened lazily by from_netcdf,
+        which have not been read yet
+
+        Parameters
+        ----------
+        names:
+            the names of the arrays, if not given, all variables are read
+        """
+        components = self._sparse_component_names()
+        for name in names or list(self._lazy_arrays):
+            data_array = self._lazy_arrays.pop(name, None)
+            if data_array is None:
+                continue
+            values = data_array.values
+            self.set_array(name, values,
+                           shape=values.shape if name in components else None)
+
+    @property
+    def lazy_arrays(self) -> List[str]:
+        """the names of the arrays not yet read from the netcdf-file"""
+        return list(self._lazy_arrays)
+
+    def save_checkpoint(self, folder: str, incremental: bool=False):
+        """
+        Save the arrays as .npy-files with a manifest
+        of the Array Descriptors, the dimensions and the coordinates,
+        which load_checkpoint maps into memory without decoding.
+        Object arrays of strings are stored as integer codes
+        and a file `name_labels.npy` with the distinct strings,
+        so no file has to be unpickled
+
+        Parameters
+        ----------
+        folder:
+            the folder of the checkpoint, is created if it does not exist.
+            Existing files of the arrays are replaced
+        incremental:
+            if True and the arrays have been saved to or loaded from folder
+            before, only the arrays marked dirty since then are written
+            (see mark_dirty)
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.load()
+        changed = set(self.dtypes)
+        if incremental:
+            changed = set(self._changed_since_save(folder, self.dtypes))
+        arrays = {}
+        for name, descr in self.dtypes.items():
+            try:
+                arr = np.asarray(getattr(self, '_%s' % name))
+            except AttributeError:
+                # the array is not initialized
+                continue
+            filename = f'{name}.npy'
+            filepath = os.path.join(folder, filename)
+            arrays[name] = {'filename': filename,
+                            'dtype': descr.dtype,
+                            'ndim': descr.ndim,
+                            'shape': to_json(descr.shape),
+                            'default': to_json(descr.default),
+                            }
+            memmap = memmap_of(arr)
+            if descr.dtype == 'O':
+                labels_filename = f'{name}_labels.npy'
+                arrays[name]['labels'] = labels_filename
+                if name in changed:
+                    try:
+                        codes, labels = factorize_strings(arr)
+                    except AttributeError:
+                        raise TypeError(f'{name}: only object arrays of strings '
+                                        'can be saved in a checkpoint')
+                    save_npy(filepath, codes.reshape(arr.shape))
+                    save_npy(os.path.join(folder, labels_filename), labels)
+            elif (memmap is not None and memmap.mode == 'r+'
+                    and os.path.abspath(filepath) == memmap.filename):
+                # the array is mapped to the file and written in place
+                memmap.flush()
+            elif name in changed:
+                save_npy(filepath, arr)
+        sparse = {name: {'shape': to_json(descr.shape),
+                         'default': to_json(descr.default)}
+                  for name, descr in self.sparse_dtypes.items()}
+        manifest = {'class': type(self).__qualname__,
+                    'dimensions': to_json(self._dimension_values()),
+                    'coordinates': self._coordinates,
+                    'arrays': arrays,
+                    'sparse': sparse,
+                    }
+        # the manifest is written last, so it refers only to complete files
+        write_manifest(folder, manifest)
+        self._record_save(folder, arrays)
+
+    @classmethod
+    def load_checkpoint(cls,
+                        folder: str,
+                        mode: str='c') -> '_ArrayProperties':
+        """
+        Create a new instance with the arrays of a checkpoint
+        saved by save_checkpoint. The .npy-files are mapped into memory
+        and assigned to the memoryviews without copying,
+        object arrays are decoded into memory with None for missing values.
+        No file is unpickled
+
+        This works only, if the dimensions of the cythonarrays-class
+        are specified in the __init__() of the subclass
+        and the argument names match the names of the dimensions
+
+        Parameters
+        ----------
+        folder:
+            the folder of the checkpoint
+        mode:
+            'c' for copy-on-write without changing the files,
+            'r+' to write changes back to the files
+
+        Returns
+        -------
+        :
+            the new instance
+        """
+        if mode not in ('c', 'r+'):
+            raise ValueError(f"mode {mode} not in ('c', 'r+'), "
+                             "the memoryviews need writable arrays")
+        manifest = read_manifest(folder)
+        if manifest['class'] != cls.__qualname__:
+            raise ValueError(f"the checkpoint in {folder} holds "
+                             f"{manifest['class']}, not {cls.__qualname__}")
+        self = cls._from_dimensions(manifest['dimensions'])
+        for name, spec in manifest['sparse'].items():
+            descr = self.sparse_dtypes[name]
+            descr.shape = spec['shape']
+            descr.default = spec['default']
+        components = self._sparse_component_names()
+        arrays = manifest['arrays']
+        unknown = [name for name in arrays if name not in self.dtypes]
+        if unknown:
+            raise KeyError(f'{unknown} are no arrays of {cls.__name__}')
+        for name, spec in arrays.items():
+            descr = self.dtypes[name]
+            descr.shape = spec['shape']
+            descr.default = spec['default']
+            filename = os.path.join(folder, spec['filename'])
+            if spec['dtype'] == 'O':
+                codes = np.load(filename, allow_pickle=False)
+                labels = decode_strings(np.load(
+                    os.path.join(folder, spec['labels']), allow_pickle=False))
+                # the code -1 of missing values selects the appended None
+                arr = np.append(labels, None)[codes]
+            else:
+                arr = np.load(filename, mmap_mode=mode)
+            self.set_array(name, arr,
+                           shape=arr.shape if name in components else None)
+        self._allocate_deferred()
+        # the arrays match the files of the checkpoint
+        self._record_save(folder, arrays)
+        return self
+
+
+def loads_lazy_arrays(method: Callable) -> Callable:
+    """
+    Wrap a method of the cython class, so that the arrays of a netcdf-file
+    opened lazily are read before the cython code uses their memoryviews,
+    e.g. `calc_model = loads_lazy_arrays(_Model.calc_model)`
+    in the python subclass.
+
+    A cpdef-method wrapped is called through python
+    also from cython code, so wrap only the entry points of a model
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._lazy_arrays:
+            self.load()
+        return method(self, *args, **kwargs)
+    return wrapper
@@ -13,6 +13,15 @@ cdef class ArrayShapes(object):
     cdef public double INF_d
     cdef public double NINF_d
 
+    # per-thread ring buffers of the events logged without the gil
+    cdef void *event_rings
+    cdef int n_event_rings
+    cdef Py_ssize_t event_capacity
+    cdef list event_backlog
+    cdef long long n_dropped_events
+
     cdef char _isnan(self, np_floating x) nogil
 
+    cdef char _log_event(self, int event, long long index) noexcept nogil
+
     cpdef _search_memview(self, cls)
\ No newline at end of file
@@ -5,10 +5,13 @@
 #cython: embedsignature=True
 
 
+import importlib
+import os
+import weakref
 import numpy as np
 oldsettings = np.seterr(divide='ignore')
 
-from .numpy_types import typedict
+from .numpy_types import typedict, pxd_hash
 from .numpy_types cimport np_floating, np_numeric
 from .array_descriptors import ArrayDescriptor
 
@@ -20,6 +23,211 @@ cdef extern from "numpy/npy_math.h":
     double NPY_NAN
     float NPY_NANF
 
+cdef extern from *:
+    """
+    #include <stdlib.h>
+    #include <string.h>
+    #include <time.h>
+    #ifdef _OPENMP
+    #include <omp.h>
+    #endif
+
+    /* head and tail of a ring are loaded with acquire and stored with release,
+       so each ring is a lock-free single-producer/single-consumer queue */
+    #if defined(_MSC_VER) && !defined(__clang__)
+    #include <intrin.h>
+    #define CA_LOAD_ACQUIRE(p) ca_load_acquire(p)
+    #define CA_STORE_RELEASE(p, v) ca_store_release(p, v)
+    #define CA_INCREMENT(p) _InterlockedIncrement64((volatile __int64 *)(p))
+    static size_t ca_load_acquire(volatile size_t *p) {
+        size_t v = *p;
+        _ReadWriteBarrier();
+        return v;
+    }
+    static void ca_store_release(volatile size_t *p, size_t v) {
+        _ReadWriteBarrier();
+        *p = v;
+    }
+    #else
+    #define CA_LOAD_ACQUIRE(p) __atomic_load_n(p, __ATOMIC_ACQUIRE)
+    #define CA_STORE_RELEASE(p, v) __atomic_store_n(p, v, __ATOMIC_RELEASE)
+    #define CA_INCREMENT(p) __atomic_fetch_add(p, 1, __ATOMIC_RELAXED)
+    #endif
+
+    typedef struct {
+        int thread;
+        int event;
+        long long index;
+        double timestamp;
+    } ca_event;
+
+    /* the ring of each thread fills whole cache lines,
+       head (written by the thread) and tail (written by the flusher)
+       are on different cache lines */
+    typedef struct {
+        ca_event *events;
+        size_t capacity;
+        size_t dropped;
+        char pad0[64 - 3 * sizeof(size_t)];
+        volatile size_t head;
+        char pad1[64 - sizeof(size_t)];
+        volatile size_t tail;
+        char pad2[64 - sizeof(size_t)];
+    } ca_ring;
+
+    static int ca_thread_num(void) {
+    #ifdef _OPENMP
+        return omp_get_thread_num();
+    #else
+        return 0;
+    #endif
+    }
+
+    static int ca_max_threads(void) {
+    #ifdef _OPENMP
+        return omp_get_max_threads();
+    #else
+        return 1;
+    #endif
+    }
+
+    /* seconds since the epoch like time.time() */
+    static double ca_wall_time(void) {
+        struct timespec ts;
+        timespec_get(&ts, TIME_UTC);
+        return (double)ts.tv_sec + 1e-9 * (double)ts.tv_nsec;
+    }
+
+    static ca_ring *ca_rings_new(int n_rings, size_t capacity) {
+        int i;
+        ca_ring *rings = (ca_ring *)calloc(n_rings, sizeof(ca_ring));
+        if (rings == NULL) return NULL;
+        for (i = 0; i < n_rings; i++) {
+            rings[i].capacity = capacity;
+            rings[i].events = (ca_event *)malloc(capacity * sizeof(ca_event));
+            if (rings[i].events == NULL) {
+                while (i--) free(rings[i].events);
+                free(rings);
+                return NULL;
+            }
+        }
+        return rings;
+    }
+
+    static void ca_rings_free(ca_ring *rings, int n_rings) {
+        int i;
+        if (rings == NULL) return;
+        for (i = 0; i < n_rings; i++) free(rings[i].events);
+        free(rings);
+    }
+
+    /* called only by the thread owning the ring,
+       if the ring is full, the event is dropped and counted */
+    static int ca_ring_push(ca_ring *ring, int thread,
+                            int event, long long index) {
+        size_t head = ring->head;
+        ca_event *e;
+        if (head - CA_LOAD_ACQUIRE(&ring->tail) >= ring->capacity) {
+            ring->dropped++;
+            return 0;
+        }
+        e = &ring->events[head % ring->capacity];
+        e->thread = thread;
+        e->event = event;
+        e->index = index;
+        e->timestamp = ca_wall_time();
+        CA_STORE_RELEASE(&ring->head, head + 1);
+        return 1;
+    }
+
+    /* count an event of a thread without a ring buffer,
+       several threads may do this at the same time */
+    static void ca_count_drop(long long *counter) {
+        CA_INCREMENT(counter);
+    }
+
+    /* called only by the flusher, copies the pending events to out */
+    static size_t ca_ring_pop(ca_ring *ring, ca_event *out) {
+        size_t tail = ring->tail;
+        size_t n = CA_LOAD_ACQUIRE(&ring->head) - tail;
+        size_t i;
+        for (i = 0; i < n; i++) {
+            out[i] = ring->events[(tail + i) % ring->capacity];
+        }
+        CA_STORE_RELEASE(&ring->tail, tail + n);
+        return n;
+    }
+    """
+    ctypedef struct ca_event:
+        int thread
+        int event
+        long long index
+        double timestamp
+    ctypedef struct ca_ring:
+        size_t capacity
+        size_t dropped
+    int ca_thread_num() nogil
+    int ca_max_threads() nogil
+    ca_ring *ca_rings_new(int n_rings, size_t capacity) nogil
+    void ca_rings_free(ca_ring *rings, int n_rings) nogil
+    int ca_ring_push(ca_ring *ring, int thread,
+                     int event, long long index) nogil
+    size_t ca_ring_pop(ca_ring *ring, ca_event *out) nogil
+    void ca_count_drop(long long *counter) nogil
+
+
+# the memoryview schema discovered for each subclass of ArrayShapes
+# as a tuple of (name, dtype, ndim) for each memoryview
+_memview_schemas = weakref.WeakKeyDictionary()
+
+# suffix of the schema modules written by make_cython_extensions
+SCHEMA_SUFFIX = '_schema'
+
+# the number of events each thread can buffer until they are drained
+EVENT_CAPACITY = 4096
+# the events drained from the ring buffers
+EVENT_DTYPE = np.dtype([('thread', 'i4'),
+                        ('event', 'i4'),
+                        ('index', 'i8'),
+                        ('timestamp', 'f8')])
+
+
+def load_schema(cls):
+    """
+    load the array schema of the class from the schema module
+    written by make_cython_extensions.make_extensions at build time
+
+    Parameters
+    ----------
+    cls : the class to load the schema for
+
+    Returns
+    -------
+    schema : tuple
+        a tuple of (name, dtype, ndim) for each array of the class
+        or None, if no schema module exists for the class
+        or the .pxd-file has changed since the schema was written
+    """
+    modname = getattr(cls, '__module__', None)
+    if not isinstance(modname, str) or modname == 'builtins':
+        return None
+    try:
+        module = importlib.import_module(modname + SCHEMA_SUFFIX)
+    except ImportError:
+        return None
+    schema = getattr(module, 'array_schemas', {}).get(cls.__name__)
+    if schema is None:
+        return None
+    # a schema without hash or of a changed .pxd-file is out of date
+    stored_hash = getattr(module, 'pxd_hash', None)
+    if stored_hash is None:
+        return None
+    pxd_filename = os.path.join(os.path.dirname(module.__file__),
+                                getattr(module, 'pxd_filename', ''))
+    if os.path.isfile(pxd_filename) and pxd_hash(pxd_filename) != stored_hash:
+        return None
+    return schema
+
 
 cdef class ArrayShapes(object):
     """
@@ -28,12 +236,30 @@ cdef class ArrayShapes(object):
     """
     def __cinit__(self, *args, **kwargs):
         """init the file"""
+        self.event_backlog = []
         if not hasattr(self, '__module__'):
             msg = "don't instantiate cdef class directly, please subclass in python class"
             raise NotImplementedError(msg)
-        self.dtypes = {}
-        for cls in self.__class__.__mro__:
-            self._search_memview(cls)
+        schema = _memview_schemas.get(self.__class__)
+        if schema is None:
+            # search the memoryviews only for the first instance of a class
+            # use the schema written at build time, if available
+            self.dtypes = {}
+            for cls in self.__class__.__mro__:
+                static_schema = load_schema(cls)
+                if static_schema is None:
+                    self._search_memview(cls)
+                else:
+                    for name, dtype, ndim in static_schema:
+                        self.dtypes[name] = ArrayDescriptor(name, dtype, ndim)
+            schema = tuple((descr.name, descr.dtype, descr.ndim)
+                           for descr in self.dtypes.values())
+            _memview_schemas[self.__class__] = schema
+        else:
+            # each instance gets its own descriptors,
+            # because shape and default may be changed per instance
+            self.dtypes = {name: ArrayDescriptor(name, dtype, ndim)
+                           for name, dtype, ndim in schema}
 
     def __init__(self, *args, **kwargs):
         """
@@ -66,6 +292,112 @@ cdef class ArrayShapes(object):
             the value to test for is_nan"""
         return bool(self._isnan(float(x)))
 
+    def __dealloc__(self):
+        """free the ring buffers of the events"""
+        ca_rings_free(<ca_ring *>self.event_rings, self.n_event_rings)
+
+    def init_events(self, n_threads: int=None, capacity: int=EVENT_CAPACITY):
+        """
+        Allocate a ring buffer for the events of each thread.
+        Call it before the parallel block, events of threads
+        without a ring buffer are dropped and counted in dropped_events.
+        Pending events are kept, when the ring buffers are reallocated
+
+        Parameters
+        ----------
+        n_threads:
+            the number of threads, by default the maximum number of
+            openmp-threads
+        capacity:
+            the number of events each thread can buffer until they are drained,
+            further events are dropped and counted in dropped_events
+        """
+        if n_threads is None:
+            n_threads = ca_max_threads()
+        n_threads = max(int(n_threads), 1)
+        if capacity < 1:
+            raise ValueError(f'capacity of the events {capacity} < 1')
+        if (self.event_rings != NULL
+                and self.n_event_rings >= n_threads
+                and self.event_capacity == capacity):
+            return
+        cdef ca_ring *rings = ca_rings_new(n_threads, capacity)
+        if rings == NULL:
+            raise MemoryError('cannot allocate the ring buffers of the events')
+        pending = self.drain_events()
+        if len(pending):
+            self.event_backlog.append(pending)
+        self.n_dropped_events = self.dropped_events
+        ca_rings_free(<ca_ring *>self.event_rings, self.n_event_rings)
+        self.event_rings = rings
+        self.n_event_rings = n_threads
+        self.event_capacity = capacity
+
+    cdef char _log_event(self, int event, long long index) noexcept nogil:
+        """
+        Record the event with the index (e.g. the group)
+        in the ring buffer of the calling thread without the gil or a lock
+
+        Returns 1 if the event is recorded, 0 if it is dropped
+        """
+        cdef int thread = ca_thread_num()
+        cdef ca_ring *rings = <ca_ring *>self.event_rings
+        if thread >= self.n_event_rings:
+            ca_count_drop(&self.n_dropped_events)
+            return 0
+        return ca_ring_push(&rings[thread], thread, event, index)
+
+    def log_event(self, int event, long long index) -> bool:
+        """python wrapper around _log_event()
+
+        Parameters
+        ----------
+        event:
+            the code of the event
+        index:
+            the index the event refers to"""
+        return bool(self._log_event(event, index))
+
+    def drain_events(self) -> np.ndarray:
+        """
+        Remove the pending events from the ring buffers.
+        The threads may go on logging while the events are drained.
+        Only one thread may drain the events at a time,
+        which is ensured by the gil
+
+        Returns
+        -------
+        :
+            the events as structured array of EVENT_DTYPE
+            with the fields thread, event, index and timestamp
+            (seconds since the epoch), sorted by the timestamp
+        """
+        cdef ca_ring *rings = <ca_ring *>self.event_rings
+        cdef ca_event *out
+        cdef size_t n = 0
+        cdef int r
+        events = np.empty(self.n_event_rings * self.event_capacity,
+                          dtype=EVENT_DTYPE)
+        out = <ca_event *><size_t>events.ctypes.data
+        for r in range(self.n_event_rings):
+            n += ca_ring_pop(&rings[r], out + n)
+        events = np.concatenate(self.event_backlog + [events[:n]])
+        self.event_backlog = []
+        return np.sort(events, order='timestamp', kind='stable')
+
+    @property
+    def dropped_events(self) -> int:
+        """
+        the number of events dropped, because a ring buffer was full
+        or the thread had no ring buffer
+        """
+        cdef ca_ring *rings = <ca_ring *>self.event_rings
+        cdef long long dropped = self.n_dropped_events
+        cdef int r
+        for r in range(self.n_event_rings):
+            dropped += rings[r].dropped
+        return dropped
+
     @cython.initializedcheck(False)
     cpdef _search_memview(self, cls):
         """
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterable, Tuple
+import numpy as np
+
+# the alignment of the arrays in bytes, fits to the cache lines
+# and the widest SIMD registers
+ALIGNMENT = 64
+
+# the ways to allocate the memory of a single array
+BACKINGS = ('memory', 'memmap')
+
+# the names of the blocks of shared memory created by this process
+_created_blocks = set()
+
+
+class MemoryBudgetError(MemoryError):
+    """
+    Allocating an array would exceed the memory budget of the model
+    """
+
+
+def aligned_empty(shape: Tuple[int],
+                  dtype: str,
+                  alignment: int=ALIGNMENT) -> np.ndarray:
+    """
+    Create an empty array, whose data starts at a multiple of alignment
+
+    Parameters
+    ----------
+    shape:
+        the shape of the array
+    dtype:
+        the dtype of the array
+    alignment:
+        the alignment in bytes
+
+    Returns
+    -------
+    :
+        the aligned array
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape, dtype='i8')) * dtype.itemsize
+    buffer = np.empty(nbytes + alignment, dtype='u1')
+    offset = -buffer.ctypes.data % alignment
+    return buffer[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+def create_memmap(filename: str,
+                  shape: Tuple[int],
+                  dtype: str) -> np.memmap:
+    """
+    Create an array backed by a .npy-file, which is mapped into memory
+
+    Parameters
+    ----------
+    filename:
+        the .npy-file to create, an existing file is overwritten
+    shape:
+        the shape of the array
+    dtype:
+        the dtype of the array
+
+    Returns
+    -------
+    :
+        the memory-mapped array
+    """
+    return np.lib.format.open_memmap(filename, mode='w+',
+                                     dtype=dtype, shape=tuple(shape))
+
+
+def memmap_of(arr) -> np.memmap:
+    """
+    Find the memory-mapped array holding the data of arr
+
+    Parameters
+    ----------
+    arr:
+        a numpy array, a memoryview or any object with a base
+
+    Returns
+    -------
+    :
+        the np.memmap the data belongs to
+        or None, if the data is not memory-mapped from a file
+    """
+    base = arr
+    while base is not None:
+        if isinstance(base, np.memmap):
+            return base
+        if isinstance(base, memoryview):
+            base = base.obj
+        else:
+            base = getattr(base, 'base', None)
+    return None
+
+
+def contiguous_variables(filepath: str,
+                         names: Iterable[str],
+                         ) -> Dict[str, Tuple[int, np.dtype, Tuple[int]]]:
+    """
+    Find the variables of a netcdf4/HDF5-file, which are stored contiguous
+    and uncompressed and can be mapped into memory
+
+    Variables with a fill value other than NaN or with a scale factor
+    or an offset are not mapped, because they have to be decoded
+
+    Parameters
+    ----------
+    filepath:
+        the netcdf4/HDF5-file
+    names:
+        the names of the variables
+
+    Returns
+    -------
+    :
+        dict with the name of the variable as key
+        and a tuple of the offset in the file, the dtype and the shape
+    """
+    import h5py
+    variables = {}
+    with h5py.File(filepath, 'r') as f:
+        for name in names:
+            dataset = f.get(name)
+            if not isinstance(dataset, h5py.Dataset):
+                continue
+            if dataset.chunks is not None or dataset.compression is not None:
+                continue
+            if dataset.dtype.kind not in 'biufc':
+                continue
+            attrs = dataset.attrs
+            if 'scale_factor' in attrs or 'add_offset' in attrs:
+                continue
+            fill_value = attrs.get('_FillValue')
+            if fill_value is not None and not np.isnan(fill_value).all():
+                continue
+            offset = dataset.id.get_offset()
+            if offset is None:
+                continue
+            variables[name] = (offset, dataset.dtype, dataset.shape)
+    return variables
+
+
+def storage_of(arr) -> str:
+    """
+    Determine the storage of the data of an array
+
+    Parameters
+    ----------
+    arr:
+        a numpy array, a memoryview or any object with a base
+
+    Returns
+    -------
+    :
+        'memmap' if the data is memory-mapped, otherwise 'memory'
+    """
+    if memmap_of(arr) is not None:
+        return 'memmap'
+    return 'memory'
+
+
+class Arena:
+    """
+    One aligned contiguous block of memory holding several arrays
+
+    Parameters
+    ----------
+    specs:
+        dict with the name of the array as key
+        and a tuple of the shape and the dtype of the array
+    alignment:
+        the alignment of each array in bytes
+    buffer:
+        a writable buffer of at least `Arena.layout(specs)[1]` bytes
+        to carve the arrays from. If not given, an aligned block is allocated
+    """
+    def __init__(self,
+                 specs: Dict[str, Tuple[Tuple[int], str]],
+                 alignment: int=ALIGNMENT,
+                 buffer=None):
+        self.specs = specs
+        self.alignment = alignment
+        self.offsets, self.nbytes = self.layout(specs, alignment)
+        if buffer is None:
+            buffer = aligned_empty((self.nbytes, ), 'u1', alignment)
+        self.buffer = np.frombuffer(buffer, dtype='u1', count=self.nbytes)
+        self.arrays = {}
+        for name, (shape, dtype) in specs.items():
+            start, nbytes = self.offsets[name]
+            data = self.buffer[start:start + nbytes]
+            self.arrays[name] = data.view(dtype).reshape(shape)
+
+    def __repr__(self):
+        return f'Arena of {self.nbytes} bytes with {len(self.arrays)} arrays'
+
+    @staticmethod
+    def layout(specs: Dict[str, Tuple[Tuple[int], str]],
+               alignment: int=ALIGNMENT,
+               ) -> Tuple[Dict[str, Tuple[int, int]], int]:
+        """
+        Calculate the position of the arrays in the block
+
+        Parameters
+        ----------
+        specs:
+            dict with the name of the array as key
+            and a tuple of the shape and the dtype of the array
+        alignment:
+            the alignment of each array in bytes
+
+        Returns
+        -------
+        offsets:
+            dict with the name of the array as key
+            and a tuple of the offset and the number of bytes
+        nbytes:
+            the total size of the block
+        """
+        offsets = {}
+        position = 0
+        for name, (shape, dtype) in specs.items():
+            nbytes = int(np.prod(shape, dtype='i8')) * np.dtype(dtype).itemsize
+            offsets[name] = (position, nbytes)
+            position += -(-nbytes // alignment) * alignment
+        return offsets, position
+
+
+class SharedArena(Arena):
+    """
+    An Arena in a block of shared memory,
+    which other processes can attach to with the handle
+
+    The process creating the block owns it and unlinks it,
+    when the SharedArena is garbage collected or unlink() is called.
+    The block is freed by the OS, when all processes have closed it.
+
+    Parameters
+    ----------
+    specs:
+        dict with the name of the array as key
+        and a tuple of the shape and the dtype of the array
+    alignment:
+        the alignment of each array in bytes
+    name:
+        the name of an existing block of shared memory to attach to.
+        If None, a new block is created
+    """
+    def __init__(self,
+                 specs: Dict[str, Tuple[Tuple[int], str]],
+                 alignment: int=ALIGNMENT,
+                 name: str=None):
+        offsets, nbytes = self.layout(specs, alignment)
+        self.owner = name is None
+        if self.owner:
+            self.shm = SharedMemory(create=True, size=max(nbytes, 1))
+            _created_blocks.add(self.shm.name)
+            self._finalizer = weakref.finalize(self, _unlink, self.shm)
+        else:
+            self.shm = _attach_shared_memory(name)
+            self._finalizer = None
+        super().__init__(specs, alignment, buffer=self.shm.buf)
+
+    def __repr__(self):
+        return (f'SharedArena {self.name} of {self.nbytes} bytes '
+                f'with {len(self.arrays)} arrays')
+
+    @property
+    def name(self) -> str:
+        """the name of the block of shared memory"""
+        return self.shm.name
+
+    @property
+    def handle(self) -> 'SharedHandle':
+        """a picklable handle to attach to the arena in another process"""
+        return SharedHandle(self.name, self.specs, self.alignment)
+
+    def close(self) -> bool:
+        """
+        Release the arrays and close the block of shared memory
+        in this process
+
+        Returns
+        -------
+        :
+            False, if the block could not be closed,
+            because views on the arrays are still alive
+        """
+        self.arrays = {}
+        self.buffer = None
+        try:
+            self.shm.close()
+        except BufferError:
+            return False
+        return True
+
+    def unlink(self):
+        """
+        Remove the name of the block of shared memory,
+        processes already attached keep their memory
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+        else:
+            _unlink(self.shm)
+
+
+def _attach_shared_memory(name: str) -> SharedMemory:
+    """attach to the shared memory without registering it for cleanup"""
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name, track=False)
+    if os.name != 'posix':
+        return SharedMemory(name)
+    # before python 3.13 the block is registered with the resource tracker,
+    # which would unlink it when the process exits.
+    # A tracker inherited from the owner (fork, spawn or forkserver)
+    # tracks the block already, registering it again does not change that
+    # and unregistering it would remove the registration of the owner
+    own_tracker = not _inherits_resource_tracker()
+    shm = SharedMemory(name)
+    if own_tracker and shm.name not in _created_blocks:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _inherits_resource_tracker() -> bool:
+    """
+    True, if the resource tracker of this process has been started
+    by a parent process and not by this process
+    """
+    tracker = resource_tracker._resource_tracker
+    if tracker._fd is None:
+        # a tracker would be started for this process
+        return False
+    if tracker._pid is None:
+        # the fd of the tracker has been passed by spawn or forkserver
+        return True
+    try:
+        os.waitpid(tracker._pid, os.WNOHANG)
+    except ChildProcessError:
+        # the tracker of the parent this process has been forked from
+        return True
+    return False
+
+
+def _unlink(shm: SharedMemory):
+    """unlink the shared memory, if not already done"""
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedHandle:
+    """
+    A picklable reference to arrays in shared memory
+
+    Parameters
+    ----------
+    name:
+        the name of the block of shared memory
+    specs:
+        dict with the name of the array as key
+        and a tuple of the shape and the dtype of the array
+    alignment:
+        the alignment of each array in bytes
+    dimensions:
+        the dimensions to create the model instance with
+    objects:
+        the arrays which cannot be shared (e.g. object arrays),
+        which are pickled with the handle
+    """
+    def __init__(self,
+                 name: str,
+                 specs: Dict[str, Tuple[Tuple[int], str]],
+                 alignment: int=ALIGNMENT,
+                 dimensions: Dict[str, int]=None,
+                 objects: Dict[str, np.ndarray]=None):
+        self.name = name
+        self.specs = specs
+        self.alignment = alignment
+        self.dimensions = dimensions or {}
+        self.objects = objects or {}
+
+    def __repr__(self):
+        return f'SharedHandle {self.name} with {len(self.specs)} arrays'
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+from typing import Callable, Dict, Tuple
+import numpy as np
+
+
+class CallbackSink:
+    """
+    A sink calling a function with the group and the array
+
+    Parameters
+    ----------
+    func:
+        the function called with func(group, arr)
+    """
+    def __init__(self, func: Callable[[int, np.ndarray], None]):
+        self.func = func
+
+    def write(self, group: int, arr: np.ndarray):
+        """hand the array of the group to the function"""
+        self.func(group, arr)
+
+    def close(self):
+        """nothing to close"""
+
+
+class AppendFileSink:
+    """
+    A sink appending the arrays of the groups to a binary file
+    in the order they are finished.
+    Each record holds the group as int64 followed by the data of the array,
+    read the file with read_group_records
+
+    Parameters
+    ----------
+    filename:
+        the file to append to
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = open(filename, 'ab')
+
+    def write(self, group: int, arr: np.ndarray):
+        """append the group and the data of the array"""
+        self.file.write(np.int64(group).tobytes())
+        self.file.write(np.ascontiguousarray(arr).tobytes())
+
+    def close(self):
+        """close the file"""
+        self.file.close()
+
+
+def read_group_records(filename: str,
+                       shape: Tuple[int],
+                       dtype: str='f8') -> np.ndarray:
+    """
+    Map the records of a file written by an AppendFileSink into memory
+
+    Parameters
+    ----------
+    filename:
+        the file
+    shape:
+        the shape of the array of each group
+    dtype:
+        the dtype of the arrays
+
+    Returns
+    -------
+    :
+        a structured array with the fields `group` and `data`
+    """
+    record = np.dtype([('group', 'i8'), ('data', dtype, tuple(shape))])
+    return np.memmap(filename, dtype=record, mode='r')
+
+
+class NetCDFSink:
+    """
+    A sink writing the arrays of the groups into a netcdf-variable
+    with the group as first dimension
+
+    Parameters
+    ----------
+    filepath:
+        the netcdf-file
+    name:
+        the name of the variable
+    n_groups:
+        the number of groups
+    dims:
+        the dimensions of the array of each group
+    shape:
+        the shape of the array of each group
+    dtype:
+        the dtype of the variable
+    group_dim:
+        the name of the dimension of the groups
+    coords:
+        dict with the name of a dimension as key
+        and the coordinates written as variables
+    mode:
+        'w' to create the file, 'a' to add the variable to an existing file
+    """
+    def __init__(self,
+                 filepath: str,
+                 name: str,
+                 n_groups: int,
+                 dims: Tuple[str],
+                 shape: Tuple[int],
+                 dtype: str='f8',
+                 group_dim: str='groups',
+                 coords: Dict[str, np.ndarray]=None,
+                 mode: str='w'):
+        import h5netcdf
+        self.file = h5netcdf.File(filepath, mode)
+        sizes = dict(zip(dims, shape))
+        sizes[group_dim] = n_groups
+        for dim, size in sizes.items():
+            if dim not in self.file.dimensions:
+                self.file.dimensions[dim] = size
+        for dim, values in (coords or {}).items():
+            if dim not in self.file.variables:
+                self.file.create_variable(dim, (dim, ), data=np.asarray(values))
+        self.variable = self.file.create_variable(
+            name, (group_dim, ) + tuple(dims), dtype=dtype,
+            chunks=(1, ) + tuple(shape))
+
+    def write(self, group: int, arr: np.ndarray):
+        """write the array of the group"""
+        self.variable[group] = arr
+
+    def close(self):
+        """close the file"""
+        self.file.close()
+
+
+class GroupStream:
+    """
+    Hands arrays of finished groups from the workers to a sink,
+    which is written by a background thread.
+
+    put() blocks while maxsize arrays are waiting to be written,
+    so at most maxsize arrays plus one per worker are kept in memory.
+    Use it as context manager, which waits for the writer and closes the sink.
+    Errors of the sink are raised when the stream is closed
+
+    Parameters
+    ----------
+    sink:
+        an object with the methods write(group, arr) and close()
+        or a function called with (group, arr)
+    maxsize:
+        the maximum number of arrays waiting to be written
+    """
+    def __init__(self, sink, maxsize: int=2):
+        if callable(sink) and not hasattr(sink, 'write'):
+            sink = CallbackSink(sink)
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.n_written = 0
+        self.thread = threading.Thread(target=self._write,
+                                       name='cythonarrays_stream',
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, group: int, arr: np.ndarray):
+        """
+        hand the array of a finished group to the writer.
+        The array must not be changed afterwards
+        """
+        self.queue.put((group, arr))
+
+    def _write(self):
+        """write the arrays until close() puts None"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # go on taking the arrays, so that the workers do not block
+                continue
+            try:
+                self.sink.write(*item)
+                self.n_written += 1
+            except BaseException as err:
+                self.error = err
+
+    def close(self):
+        """wait until all arrays are written, close the sink and raise errors"""
+        self.queue.put(None)
+        self.thread.join()
+        self.sink.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self) -> 'GroupStream':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except BaseException:
+            # do not hide the error raised in the with-block
+            if exc_type is None:
+                raise
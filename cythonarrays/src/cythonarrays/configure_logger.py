@@ -2,6 +2,11 @@ import logging
 import datetime
 import os
 import inspect
+import threading
+from typing import Dict
+
+# the message of events without an entry in the messages
+EVENT_MESSAGE = 'event {event} at index {index}'
 
 
 class SimLogger:
@@ -231,3 +236,112 @@ def get_logger(instance) -> logging.Logger:
     if hasattr(instance, '__module__'):
         sim_logger.add_package(instance.__module__.split('.')[0])
     return sim_logger.get(instance)
+
+
+def flush_events(model,
+                 logger: logging.Logger,
+                 messages: Dict[int, str]=None,
+                 level: int=logging.INFO) -> int:
+    """
+    Drain the events logged without the gil by the threads of the model
+    and hand them as log records with the time of the event
+    to the handlers of the logger
+
+    Parameters
+    ----------
+    model:
+        an instance of a subclass of ArrayShapes
+    logger:
+        the logger, e.g. the logger of the model returned by get_logger
+    messages:
+        dict with the code of the event as key and the message,
+        formatted with event, index and thread
+    level:
+        the log level of the events
+
+    Returns
+    -------
+    :
+        the number of events drained
+    """
+    events = model.drain_events()
+    if not logger.isEnabledFor(level):
+        return len(events)
+    messages = messages or {}
+    for thread, event, index, timestamp in events.tolist():
+        msg = messages.get(event, EVENT_MESSAGE).format(
+            event=event, index=index, thread=thread)
+        record = logger.makeRecord(logger.name, level, '(nogil)', 0, msg,
+                                   None, None, extra={'omp_thread': thread})
+        # the time, when the event has been logged, not when it is flushed
+        record.relativeCreated += (timestamp - record.created) * 1000
+        record.created = timestamp
+        record.msecs = (timestamp - int(timestamp)) * 1000
+        logger.handle(record)
+    return len(events)
+
+
+class EventFlusher:
+    """
+    Flush the events of a model periodically in a background thread,
+    e.g. to report the progress of a long parallel block.
+    Use it as context manager, the remaining events are flushed on exit
+
+    Parameters
+    ----------
+    model:
+        an instance of a subclass of ArrayShapes
+    logger:
+        the logger to hand the events to
+    messages:
+        dict with the code of the event as key and the message
+    level:
+        the log level of the events
+    interval:
+        the seconds between two flushes
+    """
+    def __init__(self,
+                 model,
+                 logger: logging.Logger,
+                 messages: Dict[int, str]=None,
+                 level: int=logging.INFO,
+                 interval: float=1.):
+        self.model = model
+        self.logger = logger
+        self.messages = messages
+        self.level = level
+        self.interval = interval
+        self.n_flushed = 0
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       name='cythonarrays_events',
+                                       daemon=True)
+
+    def flush(self) -> int:
+        """flush the pending events and return their number"""
+        n = flush_events(self.model, self.logger, self.messages, self.level)
+        self.n_flushed += n
+        return n
+
+    def _run(self):
+        """flush the events every interval until stop() is called"""
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self) -> 'EventFlusher':
+        """start the background thread"""
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """stop the background thread and flush the remaining events"""
+        self._stop.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.flush()
+
+    def __enter__(self) -> 'EventFlusher':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -1,12 +1,193 @@
 # -*- coding: utf-8 -*-
 
 import os
-from typing import List, Dict
+import re
+from typing import List, Dict, Tuple
 from setuptools import Extension
 import numpy as np
 from Cython.Build import cythonize
 
 from .build_config import make_ext
+from .numpy_types import cython_typedict, pxd_hash
+
+# suffix of the schema module written for each extension module
+SCHEMA_SUFFIX = '_schema'
+
+_re_cdef_class = re.compile(r'^cdef\s+class\s+(?P<cls>\w+)')
+_re_attribute = re.compile(
+    r'^\s+cdef\s+(?:public\s+|readonly\s+)?'
+    r'(?P<type>[\w\.]+(?:\s*\[[\s:,1]*\])?)\s+'
+    r'(?P<names>\w+(?:\s*,\s*\w+)*)\s*(?:#.*)?$')
+_re_memview = re.compile(r'^(?:cython\.)?(?P<base>\w+)\s*\[(?P<dims>[\s:,1]*)\]$')
+# attributes of these types hold python objects, not arrays
+_python_types = {'object', 'list', 'dict', 'tuple', 'set', 'str'}
+_re_ctypedef = re.compile(
+    r'^ctypedef\s+(?P<type>[\w\.]+(?:\s*\[[\s:,1]*\])?)\s+(?P<name>\w+)\s*$')
+
+
+def read_ctypedefs(pxd_filename: str,
+                   typedefs: Dict[str, Tuple[str, int]]=None,
+                   ) -> Dict[str, Tuple[str, int]]:
+    """
+    read the memoryview-typedefs like
+    `ctypedef cython.double[:, :] ARRAY_2D_d` from a .pxd-file
+
+    Parameters
+    ----------
+    pxd_filename:
+        the .pxd-file to read
+    typedefs:
+        already known typedefs, e.g. from numpy_types.pxd
+
+    Returns
+    -------
+    :
+        dict with the typedef name as key and a tuple of
+        the numpy dtype and the number of dimensions (0 for scalar types)
+    """
+    typedefs = dict(typedefs or {})
+    with open(pxd_filename) as f:
+        for line in f:
+            match = _re_ctypedef.match(line.strip())
+            if match:
+                resolved = _resolve_type(match['type'], typedefs)
+                if resolved is not None:
+                    typedefs[match['name']] = resolved
+    return typedefs
+
+
+def _resolve_type(ctype: str,
+                  typedefs: Dict[str, Tuple[str, int]]) -> Tuple[str, int]:
+    """
+    resolve a scalar or memoryview type to numpy dtype and ndim
+
+    Returns
+    -------
+    :
+        tuple of numpy dtype and ndim or None, if the type is unknown
+    """
+    ctype = ctype.strip()
+    if ctype in typedefs:
+        return typedefs[ctype]
+    match = _re_memview.match(ctype)
+    if match:
+        base = _resolve_type(match['base'], typedefs)
+        if base is None or base[1]:
+            return None
+        ndim = len(match['dims'].split(','))
+        return base[0], ndim
+    base = ctype.split('.')[-1]
+    if base in cython_typedict:
+        return cython_typedict[base], 0
+    return None
+
+
+def read_array_schema(pxd_filename: str,
+                      typedefs: Dict[str, Tuple[str, int]]=None,
+                      ) -> Dict[str, Tuple[Tuple[str, str, int]]]:
+    """
+    read the arrays declared as `cdef public ARRAY_xD_yy _name`
+    in the cdef classes of a .pxd-file
+
+    Classes with arrays of types that cannot be resolved are skipped,
+    their memoryviews are searched at runtime
+
+    Parameters
+    ----------
+    pxd_filename:
+        the .pxd-file to read
+    typedefs:
+        the known typedefs, by default the ones of numpy_types.pxd
+
+    Returns
+    -------
+    :
+        dict with the class name as key
+        and a tuple of (name, dtype, ndim) for each array
+    """
+    if typedefs is None:
+        typedefs = read_ctypedefs(
+            os.path.join(os.path.dirname(__file__), 'numpy_types.pxd'))
+    typedefs = read_ctypedefs(pxd_filename, typedefs)
+    schemas = {}
+    unresolved = set()
+    cls = None
+    with open(pxd_filename) as f:
+        for line in f:
+            match = _re_cdef_class.match(line)
+            if match:
+                cls = match['cls']
+                schemas[cls] = []
+                continue
+            if cls is None:
+                continue
+            match = _re_attribute.match(line.rstrip())
+            if not match:
+                continue
+            names = [name.strip() for name in match['names'].split(',')]
+            # only attributes with a leading underscore are arrays
+            names = [name for name in names if name.startswith('_')
+                     and not name.startswith('__')]
+            if not names or match['type'] in _python_types:
+                continue
+            resolved = _resolve_type(match['type'], typedefs)
+            if resolved is None:
+                unresolved.add(cls)
+                continue
+            dtype, ndim = resolved
+            if not ndim:
+                continue
+            for name in names:
+                schemas[cls].append((name[1:], dtype, ndim))
+    return {cls: tuple(schema) for cls, schema in schemas.items()
+            if schema and cls not in unresolved}
+
+
+def write_schema_module(pxd_filename: str,
+                        schema_filename: str=None) -> str:
+    """
+    write a python module with the array schema of the cdef classes
+    declared in the .pxd-file
+
+    Parameters
+    ----------
+    pxd_filename:
+        the .pxd-file to read
+    schema_filename:
+        the module to write, by default next to the .pxd-file
+        with the suffix `_schema.py`
+
+    Returns
+    -------
+    :
+        the filename of the schema module or None,
+        if the .pxd-file declares no arrays
+    """
+    if schema_filename is None:
+        schema_filename = os.path.splitext(pxd_filename)[0] + SCHEMA_SUFFIX + '.py'
+    schemas = read_array_schema(pxd_filename)
+    if not schemas:
+        # remove a schema module which is out of date
+        if os.path.exists(schema_filename):
+            os.remove(schema_filename)
+        return None
+    lines = ['# -*- coding: utf-8 -*-',
+             f'# generated by cythonarrays from {os.path.basename(pxd_filename)}',
+             '# do not edit',
+             '',
+             f'pxd_filename = {os.path.basename(pxd_filename)!r}',
+             f'pxd_hash = {pxd_hash(pxd_filename)!r}',
+             '',
+             'array_schemas = {']
+    for cls, schema in schemas.items():
+        lines.append(f'    {cls!r}: (')
+        for array in schema:
+            lines.append(f'        {array!r},')
+        lines.append('    ),')
+    lines.append('}')
+    with open(schema_filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return schema_filename
 
 
 def make_extensions(ext_modnames: List[str],
@@ -14,7 +195,8 @@ def make_extensions(ext_modnames: List[str],
                     source_dir: str='src',
                     annotate: bool=True,
                     linetrace: bool=True,
-                    language_level: str='3') -> List[Extension]:
+                    language_level: str='3',
+                    write_schemas: bool=True) -> List[Extension]:
     """
     add sources to the ext_modules specified in the input list
 
@@ -31,6 +213,9 @@ def make_extensions(ext_modnames: List[str],
         if true, the compiler-directive linetrace is enabled
     language_level:
         the compiler-directive for the language_level (2 or 3)
+    write_schemas:
+        if true, a schema module with the arrays declared
+        in the .pxd-file is written for each extension module
 
     Returns
     -------
@@ -57,6 +242,10 @@ def make_extensions(ext_modnames: List[str],
         extension = make_ext(modname, sources, **further_arg)
         extensions.append(extension)
 
+        pxdfilename = os.path.join(source_dir, *mn) + '.pxd'
+        if write_schemas and os.path.exists(pxdfilename):
+            write_schema_module(pxdfilename)
+
     cython_extensions = cythonize(extensions,
                                   annotate=annotate,
                                   compiler_directives={
@@ -64,4 +253,4 @@ def make_extensions(ext_modnames: List[str],
                                       'language_level': language_level,
                                       },
                                   )
-    return cython_extensions
\ No newline at end of file
+    return cython_extensions
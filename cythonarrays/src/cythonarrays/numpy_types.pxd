@@ -24,6 +24,12 @@ Arrays/Memoryviews
     ...
     ARRAY_1D_u8 ... ARRAY_3D_u8
 
+Sparse matrices in CSR-format, declared as the three memoryviews
+`_name_indptr`, `_name_indices` and `_name_data`
+
+    CSR_INDEX_i4, CSR_INDEX_i8 for indptr and indices
+    CSR_DATA_d, CSR_DATA_f, CSR_DATA_i4 for the data
+
 """
 
 cimport cython
@@ -106,6 +112,14 @@ ctypedef cython.ushort[:, :, :] ARRAY_3D_u2
 ctypedef cython.uint[:, :, :] ARRAY_3D_u4
 ctypedef cython.ulonglong[:, :, :] ARRAY_3D_u8
 
+# the indptr and indices of CSR-matrices must have the same dtype
+# to be used by scipy.sparse without a copy
+ctypedef cython.int[:] CSR_INDEX_i4
+ctypedef cython.longlong[:] CSR_INDEX_i8
+ctypedef cython.double[:] CSR_DATA_d
+ctypedef cython.float[:] CSR_DATA_f
+ctypedef cython.int[:] CSR_DATA_i4
+
 ctypedef fused np_signed_int:
     cython.char
     cython.short
@@ -1,7 +1,11 @@
 """
 Defines typedict to translate c types to numpy types
+and cython_typedict to translate the cython types used
+in numpy_types.pxd to numpy types
 
 """
+import hashlib
+import os
 
 
 typedict = {
@@ -30,3 +34,32 @@ typedict = {
     'int': 'i4',
     'unsigned int': 'u4',
 }
+
+
+cython_typedict = {
+    'float': 'f4',
+    'double': 'f8',
+    'char': 'i1',
+    'short': 'i2',
+    'int': 'i4',
+    'longlong': 'i8',
+    'uchar': 'u1',
+    'ushort': 'u2',
+    'uint': 'u4',
+    'ulonglong': 'u8',
+    'ssize_t': 'i8',
+    'Py_ssize_t': 'i8',
+}
+
+
+def pxd_hash(pxd_filename: str) -> str:
+    """
+    hash of the .pxd-file and the ctypedefs in numpy_types.pxd,
+    to detect a schema module which is out of date
+    """
+    sha = hashlib.sha1()
+    for filename in (os.path.join(os.path.dirname(__file__), 'numpy_types.pxd'),
+                     pxd_filename):
+        with open(filename, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from cythonarrays.numpy_types cimport *
+from openmp cimport omp_lock_t
 
 from cythonarrays.array_shapes cimport ArrayShapes
 from cythonarrays.array_shapes import ArrayShapes
@@ -29,6 +30,11 @@ cdef class _Example(ArrayShapes):
     # jobs per zone
     cdef public ARRAY_1D_d _jobs_j
 
+    # sparse distance matrix with the reachable destinations only
+    cdef public CSR_INDEX_i4 _km_csr_ij_indptr
+    cdef public CSR_INDEX_i4 _km_csr_ij_indices
+    cdef public CSR_DATA_d _km_csr_ij_data
+
     # resulting trip matrix
     cdef public ARRAY_2D_d _trips_ij
 
@@ -39,9 +45,20 @@ cdef class _Example(ArrayShapes):
     cdef public ARRAY_1D_i1 _valid_g
     cdef public ARRAY_1D_u1 _invalid_g
 
+    # the stream of calc_model_groups, not public, because ArrayShapes
+    # searches the public attributes before they are initialized
+    cdef object _group_stream
+
     cpdef char calc_model(self) except -1
     cdef double _calc_weight_destination(self, double param,
                                          double minutes, double jobs) nogil
     cdef ARRAY_1D_d _calc_p_destination(self, long32 g) nogil
+    cdef ARRAY_1D_d _calc_trips_group(self, long32 g, ARRAY_2D_d trips_ij) nogil
+    cpdef char calc_model_groups(self, stream) except -1
+    cdef char _stream_trips_group(self, long32 g,
+                                  omp_lock_t *row_locks,
+                                  long32 n_blocks) except -1 nogil
+    cpdef char calc_model_sparse(self) except -1
+    cdef char _calc_p_destination_sparse(self, long32 g) except -1 nogil
 
 
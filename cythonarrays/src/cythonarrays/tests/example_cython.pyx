@@ -10,7 +10,21 @@ import numpy as np
 from cython.parallel import prange, threadid, parallel
 from cythonarrays.numpy_types cimport *
 from cythonarrays.array_shapes cimport ArrayShapes
+from cythonarrays.configure_logger import flush_events
 from libc.math cimport exp
+from libc.stdlib cimport malloc, free
+from openmp cimport (omp_lock_t, omp_init_lock, omp_destroy_lock,
+                     omp_set_lock, omp_unset_lock)
+
+# the events logged in the parallel blocks
+cdef enum:
+    EVENT_CALC_GROUP = 1
+
+EVENT_MESSAGES = {EVENT_CALC_GROUP: 'calculate group {index}'}
+
+# the rows of trips_ij summed up by one thread at a time
+cdef enum:
+    ROWS_PER_LOCK = 64
 
 
 class DestinationChoiceError(ValueError):
@@ -32,14 +46,18 @@ cdef class _Example(ArrayShapes):
         cdef char t
         cdef long32 g
         self.reset_array('trips_ij')
-        with nogil, parallel(num_threads=self.n_threads):
-            t = threadid()
-            # loop over groups
-            for g in prange(self.groups, schedule='guided'):
-                with gil:
-                    self.logger.info('calculate group {}'.format(g))
-                # calc destination choice model for group g
-                self._calc_p_destination(g)
+        self.init_events(self.n_threads)
+        try:
+            with nogil, parallel(num_threads=self.n_threads):
+                t = threadid()
+                # loop over groups
+                for g in prange(self.groups, schedule='guided'):
+                    # log the progress without the gil
+                    self._log_event(EVENT_CALC_GROUP, g)
+                    # calc destination choice model for group g
+                    self._calc_p_destination(g)
+        finally:
+            flush_events(self, self.logger, EVENT_MESSAGES)
 
     @cython.initializedcheck(False)
     cdef double _calc_weight_destination(self, double param,
@@ -51,6 +69,14 @@ cdef class _Example(ArrayShapes):
     @cython.initializedcheck(False)
     cdef ARRAY_1D_d _calc_p_destination(self, long32 g) nogil:
         """Calc the destination choice probability for group g"""
+        return self._calc_trips_group(g, self._trips_ij)
+
+    @cython.initializedcheck(False)
+    cdef ARRAY_1D_d _calc_trips_group(self, long32 g, ARRAY_2D_d trips_ij) nogil:
+        """
+        Calc the destination choice for group g
+        and add the trips of the group to trips_ij
+        """
         cdef double param, minutes, persons, jobs, weight, total_weight
         cdef long32 i, j
         cdef ARRAY_1D_d weights_j
@@ -71,9 +97,114 @@ cdef class _Example(ArrayShapes):
                     raise DestinationChoiceError(g)
             factor = persons / total_weight
             for j in range(self.destinations):
-                self._trips_ij[i, j] += factor * weights_j[j]
+                trips_ij[i, j] += factor * weights_j[j]
         return weights_j
 
+    @cython.initializedcheck(False)
+    cpdef char calc_model_groups(self, stream) except -1:
+        """
+        Calc the daily trips for all groups and zones
+        and hand the trips of each group to stream.put(g, trips_ij),
+        as soon as the group is finished.
+        The trips of all groups are summed up in trips_ij, too
+
+        Parameters
+        ----------
+        stream : cythonarrays.array_streams.GroupStream
+            the stream with bounded buffering to the sink
+        """
+        cdef long32 g, b
+        cdef long32 n_blocks = (self.origins + ROWS_PER_LOCK - 1) // ROWS_PER_LOCK
+        cdef omp_lock_t *row_locks
+        self.reset_array('trips_ij')
+        # the groups are summed up in blocks of rows, each locked separately
+        row_locks = <omp_lock_t *> malloc(max(n_blocks, 1) * sizeof(omp_lock_t))
+        if row_locks == NULL:
+            raise MemoryError()
+        for b in range(n_blocks):
+            omp_init_lock(&row_locks[b])
+        self._group_stream = stream
+        try:
+            with nogil, parallel(num_threads=self.n_threads):
+                # loop over groups
+                for g in prange(self.groups, schedule='guided'):
+                    self._stream_trips_group(g, row_locks, n_blocks)
+        finally:
+            self._group_stream = None
+            for b in range(n_blocks):
+                omp_destroy_lock(&row_locks[b])
+            free(row_locks)
+
+    @cython.initializedcheck(False)
+    cdef char _stream_trips_group(self, long32 g,
+                                  omp_lock_t *row_locks,
+                                  long32 n_blocks) except -1 nogil:
+        """
+        Calc the trips of group g, add them to trips_ij block by block
+        and hand them to the stream
+        """
+        cdef long32 i, j, k, b, first_row, last_row
+        cdef ARRAY_2D_d trips_ij
+        with gil:
+            trips_ij = np.zeros((self.origins, self.destinations), 'd')
+        self._calc_trips_group(g, trips_ij)
+        # the groups start at different blocks to wait less for the locks
+        for k in range(n_blocks):
+            b = (g + k) % n_blocks
+            first_row = b * ROWS_PER_LOCK
+            last_row = min(first_row + ROWS_PER_LOCK, self.origins)
+            omp_set_lock(&row_locks[b])
+            for i in range(first_row, last_row):
+                for j in range(self.destinations):
+                    self._trips_ij[i, j] += trips_ij[i, j]
+            omp_unset_lock(&row_locks[b])
+        with gil:
+            # put blocks while the buffer of the stream is full
+            self._group_stream.put(g, np.asarray(trips_ij))
+        return 0
+
+    @cython.initializedcheck(False)
+    cpdef char calc_model_sparse(self) except -1:
+        """
+        Calc the daily trips for all groups and zones
+        with the sparse distance matrix km_csr_ij,
+        where only the destinations stored are reachable
+        """
+        cdef long32 g
+        self.reset_array('trips_ij')
+        with nogil, parallel(num_threads=self.n_threads):
+            # loop over groups
+            for g in prange(self.groups, schedule='guided'):
+                self._calc_p_destination_sparse(g)
+
+    @cython.initializedcheck(False)
+    cdef char _calc_p_destination_sparse(self, long32 g) except -1 nogil:
+        """
+        Calc the destination choice for group g
+        looping only over the reachable destinations
+        """
+        cdef double param, persons, total_weight, factor
+        cdef long32 i, j, k
+        param = self._param_g[g]
+        for i in range(self.origins):
+            persons = self._persons_gi[g, i]
+            total_weight = 0
+            for k in range(self._km_csr_ij_indptr[i],
+                           self._km_csr_ij_indptr[i + 1]):
+                j = self._km_csr_ij_indices[k]
+                total_weight += self._calc_weight_destination(
+                    param, self._km_csr_ij_data[k], self._jobs_j[j])
+            if not total_weight:
+                with gil:
+                    raise DestinationChoiceError(g)
+            factor = persons / total_weight
+            for k in range(self._km_csr_ij_indptr[i],
+                           self._km_csr_ij_indptr[i + 1]):
+                j = self._km_csr_ij_indices[k]
+                self._trips_ij[i, j] += factor * self._calc_weight_destination(
+                    param, self._km_csr_ij_data[k], self._jobs_j[j])
+        return 0
+
     def calc_p_destination(self, g):
         """
         Calc the destination choice probability for group g
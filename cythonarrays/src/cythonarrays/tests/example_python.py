@@ -64,6 +64,7 @@ class Example(_Example, _ArrayProperties):
         """Define the arrays"""
         self.init_array('param_g', 'groups', -0.1)
         self.init_array('km_ij', 'origins, destinations')
+        self.init_sparse_array('km_csr_ij', 'origins, destinations', np.inf)
 
         self.init_array('persons_gi', 'groups, origins')
         self.init_array('jobs_j', 'destinations')
@@ -4,16 +4,39 @@ Created on Fri Jun 10 21:00:21 2016
 
 @author: MaxBohnet
 """
+import json
+import logging
+import multiprocessing
+import os
+import pickle
 import sys
 import tempfile
+from multiprocessing.shared_memory import SharedMemory
 import numpy as np
 import pytest
 import xarray as xr
 
 from cythonarrays.tests.example_python import Example, DestinationChoiceError
 from cythonarrays.tests.simple_python import Simple
+from cythonarrays.array_descriptors import (CopyError,
+                                            rounding_error,
+                                            set_copy_policy,
+                                            storage_rounding_error)
+from cythonarrays.array_properties import loads_lazy_arrays
+from cythonarrays.array_io import (OBJECT_ENCODINGS,
+                                   default_chunks,
+                                   decode_objects,
+                                   encode_objects)
+from cythonarrays import array_storage
+from cythonarrays.array_storage import MemoryBudgetError
+from cythonarrays.configure_logger import EventFlusher, flush_events
+from cythonarrays.array_streams import (AppendFileSink,
+                                        GroupStream,
+                                        NetCDFSink,
+                                        read_group_records)
 import pyximport; pyximport.install()
 from .example_cython import (_Example)
+from cythonarrays.array_shapes import _memview_schemas, EVENT_DTYPE
 
 
 @pytest.fixture(scope='class')
@@ -72,6 +95,43 @@ def example(km_ij: np.ndarray,
     return example
 
 
+class PresetExample(Example):
+    """an Example, whose __init__ writes into an array"""
+    def __init__(self, groups, origins, threading=True, init_arrays=True):
+        super().__init__(groups, origins, threading, init_arrays)
+        self.jobs_j[:] = 7
+
+
+class LazyExample(Example):
+    """an Example, which reads the lazy arrays before calc_model"""
+    calc_model = loads_lazy_arrays(Example.calc_model)
+
+
+def calc_model_attached(handle) -> float:
+    """attach to a model in shared memory and run it in a worker process"""
+    example = Example.attach(handle)
+    example.calc_model()
+    total = example.trips_ij.sum()
+    assert example.close_shared()
+    return total
+
+
+def attach_unregistered(name: str) -> list:
+    """
+    attach to shared memory in a worker process and return the names
+    unregistered from the resource tracker
+    """
+    unregistered = []
+    unregister = array_storage.resource_tracker.unregister
+    array_storage.resource_tracker.unregister = (
+        lambda name, rtype: unregistered.append(name))
+    try:
+        array_storage._attach_shared_memory(name).close()
+    finally:
+        array_storage.resource_tracker.unregister = unregister
+    return unregistered
+
+
 @pytest.fixture()
 def tempfile_h5() -> str:
     return tempfile.mktemp(suffix='h5')
@@ -285,6 +345,582 @@ jobs_j: shape target: \[3\], actual: \(2,\)
         # the data in not_initialized_ij changes
         assert example.not_initialized_ij[1, 2] == -1
 
+    def test_05_properties_per_class(self):
+        """Test that the properties are created only once per class"""
+        example1 = Example(groups=2, origins=3)
+        prop = Example.__dict__['jobs_j']
+        example2 = Example(groups=2, origins=3)
+        assert Example.__dict__['jobs_j'] is prop
+        assert 'groupnames_g' in Example._array_property_names
+
+        # the property uses the Array Descriptor of the instance
+        example2.dtypes['valid_g']._dtype_numpy = 'bool'
+        assert example1.valid_g.dtype == np.dtype('i1')
+        assert example2.valid_g.dtype == np.dtype('bool')
+
+    def test_06_cached_views(self):
+        """Test that the numpy views are cached until the array is set"""
+        example = Example(groups=2, origins=3)
+        jobs_j = example.jobs_j
+        assert example.jobs_j is jobs_j
+        # the view shares the memory with the memoryview
+        example._jobs_j[1] = 7
+        assert jobs_j[1] == 7
+
+        # setting the array creates a new view
+        example.jobs_j = np.array([1., 2., 3.])
+        assert example.jobs_j is not jobs_j
+        np.testing.assert_array_equal(example.jobs_j, [1., 2., 3.])
+
+        # init_array creates a new view
+        jobs_j = example.jobs_j
+        example.init_array('jobs_j', default=0)
+        assert example.jobs_j is not jobs_j
+        np.testing.assert_array_equal(example.jobs_j, 0)
+
+        # del creates a new view
+        example.not_initialized_ij = np.ones((2, 2), dtype='i4')
+        assert example.not_initialized_ij.shape == (2, 2)
+        del example.not_initialized_ij
+        assert example.not_initialized_ij.shape == (0, 0)
+
+        # assigning the memoryview directly requires to invalidate the view
+        example._jobs_j = np.array([4., 5., 6.])
+        np.testing.assert_array_equal(example.jobs_j, 0)
+        example.invalidate_views('jobs_j')
+        np.testing.assert_array_equal(example.jobs_j, [4., 5., 6.])
+
+    def test_07_copy_policy(self, caplog):
+        """Test the copy policy and the copy accounting"""
+        example = Example(groups=2, origins=3)
+        assert not example.copied_bytes()
+
+        # same dtype, no copy
+        example.jobs_j = np.array([1., 2., 3.])
+        # a buffer is not copied
+        example.persons_gi = example._persons_gi
+        assert not example.copied_bytes()
+
+        # another dtype, the array is copied
+        example.jobs_j = np.array([1, 2, 3], dtype='i4')
+        # a list is converted
+        example.param_g = [0.1, 0.2]
+        # another byteorder, the array is copied
+        example.jobs_j = np.array([1., 2., 3.], dtype='>f8')
+        assert example.copied_bytes() == {'jobs_j': 48, 'param_g': 16}
+        assert example.dtypes['jobs_j'].n_copies == 2
+
+        # log the copies
+        example.copy_policy = 'log'
+        with caplog.at_level(logging.WARNING):
+            example.jobs_j = np.array([1, 2, 3], dtype='i4')
+        assert 'jobs_j: copy 24 bytes to convert <i4 to <f8' in caplog.text
+        assert example.copied_bytes()['jobs_j'] == 72
+
+        # raise instead of copying
+        example.copy_policy = 'raise'
+        arr = np.array([4, 5, 6], dtype='i4')
+        with pytest.raises(CopyError, match='jobs_j: copy 24 bytes'):
+            example.jobs_j = arr
+        with pytest.raises(CopyError, match='param_g: copy an unknown number'):
+            example.param_g = [0.1, 0.2]
+        np.testing.assert_array_equal(example.jobs_j, [1., 2., 3.])
+        assert example.copied_bytes()['jobs_j'] == 72
+        # arrays of the right dtype still work
+        example.jobs_j = arr.astype('f8')
+        # a read-only buffer has to be copied
+        readonly = np.array([7., 8., 9.])
+        readonly.flags.writeable = False
+        with pytest.raises(CopyError, match='jobs_j: copy 24 bytes to convert read-only'):
+            example.jobs_j = memoryview(readonly)
+        example.copy_policy = 'allow'
+        example.jobs_j = memoryview(readonly)
+        example.jobs_j = readonly
+        np.testing.assert_array_equal(example.jobs_j, [7., 8., 9.])
+        assert example.copied_bytes()['jobs_j'] == 120
+        # bytes are not read as uint8
+        with pytest.raises(TypeError, match='jobs_j: dtype target'):
+            example.jobs_j = bytes(24)
+        with pytest.raises(TypeError, match='jobs_j: dtype target'):
+            example.jobs_j = bytearray(24)
+        example.copy_policy = 'raise'
+
+        # the global copy policy applies, if the model has no copy policy
+        example.copy_policy = None
+        try:
+            set_copy_policy('raise')
+            with pytest.raises(CopyError):
+                example.jobs_j = arr
+        finally:
+            set_copy_policy('allow')
+        with pytest.raises(ValueError, match='copy policy'):
+            set_copy_policy('sometimes')
+
+    def test_08_set_arrays(self):
+        """Test setting several arrays at once"""
+        example = Example(groups=2, origins=3)
+        example.set_arrays({'jobs_j': [1, 2, 3],
+                            'param_g': np.array([-0.2, -0.3]),
+                            'km_ij': np.ones((3, 3)),
+                            })
+        np.testing.assert_array_equal(example.jobs_j, [1., 2., 3.])
+        np.testing.assert_array_equal(example.param_g, [-0.2, -0.3])
+        np.testing.assert_array_equal(example.km_ij, 1)
+
+        # if one array does not fit, no array is assigned
+        pattern = r"persons_gi: shape target: \[2, 3\], actual: \(3, 3\)"
+        with pytest.raises(AssertionError, match=pattern):
+            example.set_arrays({'jobs_j': [4, 5, 6],
+                                'persons_gi': np.ones((3, 3)),
+                                })
+        np.testing.assert_array_equal(example.jobs_j, [1., 2., 3.])
+
+        # validate with other shapes
+        example.set_arrays({'jobs_j': [4, 5],
+                            'persons_gi': np.ones((2, 2)),
+                            },
+                           shapes={'jobs_j': 'groups',
+                                   'persons_gi': 'groups, groups'})
+        np.testing.assert_array_equal(example.jobs_j, [4., 5.])
+        assert example.dtypes['jobs_j'].shape == ['groups']
+
+        # if the validation fails, the shapes are not changed
+        with pytest.raises(AssertionError):
+            example.set_arrays({'jobs_j': [4, 5, 6],
+                                'param_g': [-0.2, -0.3]},
+                               shapes={'jobs_j': 'destinations',
+                                       'param_g': 'destinations'})
+        assert example.dtypes['jobs_j'].shape == ['groups']
+        assert example.dtypes['param_g'].shape == ['groups']
+
+    def test_09_init_arrays(self):
+        """Test initializing all arrays at once"""
+        example = Example(groups=2, origins=3)
+        example.init_arrays(shapes={'jobs_j': 'groups',
+                                    'not_initialized_ij': 'groups, origins'},
+                            defaults={'jobs_j': 7,
+                                      'not_initialized_ij': 2})
+        np.testing.assert_array_equal(example.jobs_j, [7., 7.])
+        np.testing.assert_array_equal(example.not_initialized_ij,
+                                      np.full((2, 3), 2, dtype='i4'))
+        np.testing.assert_array_equal(example.param_g, [-0.1, -0.1])
+        np.testing.assert_array_equal(example.trips_ij, np.zeros((3, 3)))
+        assert example.groupnames_g.shape == (2, )
+
+        # with a wrong number of dimensions nothing is changed
+        with pytest.raises(ValueError, match='1 Dimensions required'):
+            example.init_arrays(shapes={'jobs_j': 'destinations',
+                                        'param_g': 'groups, origins'},
+                                defaults={'jobs_j': 0})
+        assert example.dtypes['jobs_j'].shape == ['groups']
+        assert example.dtypes['jobs_j'].default == 7
+        np.testing.assert_array_equal(example.jobs_j, [7., 7.])
+
+    def test_09a_resize_dimension(self):
+        """Test resizing a dimension and the arrays depending on it"""
+        example = Example(groups=2, origins=3)
+        registry = example.dimension_registry
+        assert registry['groups'] == ['param_g', 'persons_gi', 'valid_g',
+                                      'invalid_g', 'groupnames_g']
+        assert 'km_ij' in registry['origins']
+        assert 'km_ij' in registry['destinations']
+
+        example.km_ij = np.arange(9).reshape(3, 3)
+        example.zonenumbers_i = [10, 20, 30]
+        example.zonenames_i = ['a', 'b', 'c']
+        jobs_j = example.jobs_j
+        # grow the origins
+        example.resize_dimension('origins', 5)
+        assert example.origins == 5
+        km_ij = example.km_ij
+        np.testing.assert_array_equal(km_ij[:3], np.arange(9).reshape(3, 3))
+        assert km_ij.shape == (5, 3)
+        np.testing.assert_array_equal(example.zonenumbers_i[:3], [10, 20, 30])
+        np.testing.assert_array_equal(example.zonenames_i[:3], ['a', 'b', 'c'])
+        # new elements are filled with the default value
+        np.testing.assert_array_equal(example.trips_ij, np.zeros((5, 3)))
+        np.testing.assert_array_equal(example._persons_gi.shape, (2, 5))
+        # arrays not depending on the dimension are not touched
+        assert example.jobs_j is jobs_j
+
+        # the model can be calculated with the new dimensions
+        example.resize_dimension('destinations', 5)
+        example.km_ij[:] = 1
+        example.persons_gi[:] = 10
+        example.jobs_j[:] = 1
+        example.calc_model()
+        np.testing.assert_allclose(example.trips_ij.sum(), 100)
+
+        # shrinking keeps the memory
+        example.trips_ij[:] = np.arange(25).reshape(5, 5)
+        example.resize_dimension('origins', 2)
+        trips_ij = example.trips_ij
+        np.testing.assert_array_equal(trips_ij, np.arange(10).reshape(2, 5))
+        # and reuses it when growing again
+        example.resize_dimension('origins', 4)
+        assert np.shares_memory(example.trips_ij, trips_ij)
+        np.testing.assert_array_equal(example.trips_ij[:2],
+                                      np.arange(10).reshape(2, 5))
+        np.testing.assert_array_equal(example.trips_ij[2:], 0)
+        # growing beyond the capacity allocates new memory
+        example.resize_dimension('origins', 6)
+        assert not np.shares_memory(example.trips_ij, trips_ij)
+        np.testing.assert_array_equal(example.trips_ij[:2],
+                                      np.arange(10).reshape(2, 5))
+        np.testing.assert_array_equal(example.trips_ij[2:], 0)
+
+    def test_09b_arena(self, example: Example):
+        """Test allocating all arrays in one aligned block"""
+        arena_example = Example(groups=2, origins=3)
+        assert arena_example.arena is None
+        arena_example.init_arrays(arena=True)
+        arena = arena_example.arena
+        assert arena.nbytes % 64 == 0
+        for name, descr in arena_example.dtypes.items():
+            arr = getattr(arena_example, name)
+            if descr.dtype == 'O':
+                assert descr.storage == 'memory'
+                continue
+            assert descr.storage == 'arena'
+            assert np.shares_memory(arr, arena.buffer) or not arr.size
+            assert arr.ctypes.data % 64 == 0
+        np.testing.assert_array_equal(arena_example.param_g, [-0.1, -0.1])
+        np.testing.assert_array_equal(arena_example.trips_ij, 0)
+
+        # the model works with the arrays in the arena
+        for name in ['km_ij', 'jobs_j', 'param_g', 'persons_gi']:
+            getattr(arena_example, name)[:] = getattr(example, name)
+        arena_example.calc_model()
+        example.calc_model()
+        np.testing.assert_allclose(arena_example.trips_ij, example.trips_ij)
+        assert np.shares_memory(arena_example.trips_ij, arena.buffer)
+
+        # without the arena, the arrays are allocated separately
+        arena_example.init_arrays()
+        assert arena_example.arena is None
+        assert arena_example.dtypes['km_ij'].storage == 'memory'
+
+    def test_09c_memmap(self, example: Example, tmp_path):
+        """Test arrays backed by memory-mapped files"""
+        mm_example = Example(groups=2, origins=3)
+        mm_example.memmap_folder = str(tmp_path)
+        mm_example.init_array('trips_ij', 'origins, destinations', 0,
+                              backing='memmap')
+        descr = mm_example.dtypes['trips_ij']
+        assert descr.storage == 'memmap'
+        assert os.path.exists(descr.filename)
+        assert mm_example.dtypes['km_ij'].storage == 'memory'
+
+        # copy an array into a memory-mapped file
+        mm_example.set_array('km_ij', example.km_ij, backing='memmap')
+        assert mm_example.dtypes['km_ij'].storage == 'memmap'
+        for name in ['jobs_j', 'param_g', 'persons_gi']:
+            mm_example.set_array(name, getattr(example, name))
+
+        # the model writes into the memory-mapped file
+        mm_example.calc_model()
+        example.calc_model()
+        np.testing.assert_allclose(mm_example.trips_ij, example.trips_ij)
+        np.testing.assert_allclose(np.load(descr.filename), example.trips_ij)
+
+        # reload the array from the file
+        mm_example.load_memmap('trips_ij', descr.filename, mode='c')
+        with pytest.raises(ValueError, match='writable'):
+            mm_example.load_memmap('trips_ij', descr.filename, mode='r')
+        with pytest.raises(ValueError, match='memmap_folder'):
+            Example(groups=2, origins=3).load_memmap('trips_ij')
+        np.testing.assert_allclose(mm_example.trips_ij, example.trips_ij)
+
+        # resized arrays stay memory-mapped
+        mm_example.resize_dimension('origins', 5)
+        assert mm_example.dtypes['km_ij'].storage == 'memmap'
+        assert mm_example.km_ij.shape[0] == 5
+        np.testing.assert_array_equal(mm_example.km_ij[:3], example.km_ij)
+
+        # and can be copied back into memory
+        mm_example.set_array('km_ij', mm_example.km_ij, backing='memory')
+        assert mm_example.dtypes['km_ij'].storage == 'memory'
+        assert mm_example.dtypes['km_ij'].filename is None
+
+        with pytest.raises(ValueError):
+            mm_example.init_array('trips_ij', backing='disk')
+
+    def test_09d_shared_memory(self, example: Example, monkeypatch):
+        """Test arrays in shared memory attached by worker processes"""
+        # a worker does not register the shared memory of another process
+        # with its resource tracker, which would unlink it on exit
+        unregistered = []
+        monkeypatch.setattr(array_storage.resource_tracker, 'unregister',
+                            lambda name, rtype: unregistered.append(name))
+        shm = SharedMemory(create=True, size=8)
+        try:
+            array_storage._attach_shared_memory(shm.name).close()
+            if sys.version_info < (3, 13) and os.name == 'posix':
+                assert unregistered == [f'/{shm.name}']
+            else:
+                assert not unregistered
+        finally:
+            shm.close()
+            shm.unlink()
+        monkeypatch.undo()
+
+        shared_example = Example(groups=2, origins=3)
+        shared_example.init_arrays(shared=True)
+        assert shared_example.dtypes['km_ij'].storage == 'shared'
+        assert shared_example.dtypes['groupnames_g'].storage == 'memory'
+        assert shared_example.close_shared()
+        assert shared_example.dtypes['km_ij'].storage == 'memory'
+        with pytest.raises(ValueError):
+            shared_example.shared_handle()
+
+        # move the arrays of a model into shared memory
+        for name in ['km_ij', 'jobs_j', 'param_g', 'persons_gi']:
+            shared_example.set_array(name, getattr(example, name))
+        shared_example.groupnames_g[:] = ['A', 'B']
+        handle = shared_example.share()
+        assert np.shares_memory(shared_example.km_ij,
+                                shared_example.arena.buffer)
+        np.testing.assert_array_equal(shared_example.km_ij, example.km_ij)
+        assert list(handle.objects['groupnames_g']) == ['A', 'B']
+
+        # attach in the same process without copying
+        attached = Example.attach(pickle.loads(pickle.dumps(handle)))
+        assert attached.groups == 2
+        attached.jobs_j[0] = 99
+        assert shared_example.jobs_j[0] == 99
+        attached.jobs_j[0] = example.jobs_j[0]
+        assert list(attached.groupnames_g) == ['A', 'B']
+        assert not attached.arena.owner
+        # the arrays replaced by the shared ones are not allocated before
+        report = attached.memory_report()
+        assert attached.peak_nbytes == attached._owned_nbytes()
+        assert attached.peak_nbytes < report['total']['shared']
+        assert report['arrays']['km_ij']['storage'] == 'shared'
+        assert attached.close_shared()
+
+        # the worker writes the results into the shared memory
+        example.calc_model()
+        with multiprocessing.get_context('fork').Pool(1) as pool:
+            total = pool.apply(calc_model_attached, (handle, ))
+        np.testing.assert_allclose(total, example.trips_ij.sum())
+        np.testing.assert_allclose(shared_example.trips_ij, example.trips_ij)
+
+        # a spawned worker shares the resource tracker of the owner
+        # and leaves the registration of the owner alone
+        shared_example.trips_ij[:] = 0
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            assert pool.apply(attach_unregistered, (handle.name, )) == []
+            total = pool.apply(calc_model_attached, (handle, ))
+        np.testing.assert_allclose(total, example.trips_ij.sum())
+        np.testing.assert_allclose(shared_example.trips_ij, example.trips_ij)
+
+        # the owner unlinks the shared memory
+        assert shared_example.close_shared()
+        with pytest.raises(FileNotFoundError):
+            Example.attach(handle)
+
+    def test_09e_fork(self, example: Example):
+        """Test copy-on-write forks of a model"""
+        example.calc_model()
+        trips_ij = example.trips_ij.copy()
+        scenario = example.fork(materialize=['trips_ij'])
+        assert scenario.materialized_arrays() == {'trips_ij': trips_ij.nbytes}
+        assert 'km_ij' in scenario.shared_arrays
+        assert np.shares_memory(scenario.km_ij, example.km_ij)
+        # only the materialized arrays have been allocated by the fork
+        assert scenario.peak_nbytes == trips_ij.nbytes
+        report = scenario.memory_report()
+        assert report['arrays']['km_ij']['storage'] == 'shared'
+
+        # the shared arrays are read-only
+        with pytest.raises(ValueError):
+            scenario.jobs_j[0] = 0
+        # and copied when written to
+        scenario.writable('jobs_j')[:] = example.jobs_j * 2
+        scenario.param_g = example.param_g * 2
+        scenario.reset_array('valid_g')
+        assert set(scenario.materialized_arrays()) == {
+            'trips_ij', 'jobs_j', 'param_g', 'valid_g'}
+        assert not np.shares_memory(scenario.jobs_j, example.jobs_j)
+        assert scenario.jobs_j.flags.writeable
+
+        # the scenario does not change the parent
+        scenario.calc_model()
+        np.testing.assert_array_equal(example.trips_ij, trips_ij)
+        np.testing.assert_array_equal(scenario.jobs_j, example.jobs_j * 2)
+        assert not np.allclose(scenario.trips_ij, trips_ij)
+
+        # resizing copies the arrays
+        scenario.resize_dimension('origins', 2)
+        assert 'km_ij' not in scenario.shared_arrays
+        assert example.km_ij.shape == trips_ij.shape
+
+    def test_09f_sparse(self, example: Example, tempfile_h5: str):
+        """Test sparse matrices in CSR-format"""
+        scipy_sparse = pytest.importorskip('scipy.sparse')
+        sparse_example = Example(groups=2, origins=3)
+        for name in ['jobs_j', 'param_g', 'persons_gi']:
+            sparse_example.set_array(name, getattr(example, name))
+        assert sparse_example.km_csr_ij.nnz == 0
+        assert sparse_example.km_csr_ij.shape == (3, 3)
+
+        # destinations beyond 5 km are not reachable
+        km_ij = example.km_ij.copy()
+        km_ij[km_ij > 5] = np.inf
+        sparse_example.km_csr_ij = km_ij
+        assert sparse_example.km_csr_ij.nnz == 7
+        assert sparse_example.km_csr_ij_indices.dtype == np.int32
+        np.testing.assert_array_equal(
+            sparse_example.get_dense_array('km_csr_ij'), km_ij)
+
+        # the sparse model loops only over the reachable destinations
+        sparse_example.km_ij = km_ij
+        sparse_example.calc_model()
+        trips_ij = sparse_example.trips_ij.copy()
+        sparse_example.calc_model_sparse()
+        np.testing.assert_allclose(sparse_example.trips_ij, trips_ij)
+
+        # conversion to and from scipy.sparse without copies
+        matrix = sparse_example.km_csr_ij
+        assert np.shares_memory(matrix.data, sparse_example.km_csr_ij_data)
+        sparse_example.km_csr_ij = scipy_sparse.csr_array(matrix * 2)
+        np.testing.assert_array_equal(sparse_example.km_csr_ij.toarray(),
+                                      matrix.toarray() * 2)
+        with pytest.raises(ValueError):
+            sparse_example.km_csr_ij = scipy_sparse.csr_array((2, 3))
+
+        # save and read from netcdf
+        sparse_example.save_dataset_to_netcdf(tempfile_h5)
+        new_example = Example.from_netcdf(tempfile_h5)
+        np.testing.assert_array_equal(
+            new_example.get_dense_array('km_csr_ij'),
+            sparse_example.get_dense_array('km_csr_ij'))
+
+        # resize the matrix with the dimension
+        sparse_example.resize_dimension('destinations', 2)
+        assert sparse_example.km_csr_ij.shape == (3, 2)
+        np.testing.assert_array_equal(
+            sparse_example.get_dense_array('km_csr_ij'), km_ij[:, :2] * 2)
+
+    def test_09g_precision(self, example: Example, tempfile_h5: str):
+        """Test the precision policy"""
+        precision_example = Example(groups=2, origins=3)
+        for name in ['km_ij', 'jobs_j', 'param_g', 'persons_gi']:
+            precision_example.set_array(name, getattr(example, name))
+        precision_example.calc_model()
+        assert precision_example.precision_report() == {}
+
+        # rounding in set_array is recorded
+        precision_example.zonenumbers_i = [1.5, 2, 3]
+        report = precision_example.precision_report()
+        assert report['zonenumbers_i']['max_rounding_error'] == 0.5
+        assert report['zonenumbers_i']['saved_bytes'] == 0
+
+        # store double arrays as float except the trips
+        precision_example.set_precision({'f8': 'f4'},
+                                        overrides={'trips_ij': 'f8'})
+        assert precision_example.storage_dtype('km_ij') == np.dtype('f4')
+        assert precision_example.storage_dtype('trips_ij') == np.dtype('f8')
+        precision_example.save_dataset_to_netcdf(tempfile_h5)
+        with xr.open_dataset(tempfile_h5, engine='h5netcdf') as ds:
+            assert ds['km_ij'].dtype == np.dtype('f4')
+            assert ds['trips_ij'].dtype == np.dtype('f8')
+        # the rounding error is computed by the report, not when saving
+        assert precision_example.dtypes['param_g'].max_rounding_error == 0
+        report = precision_example.precision_report()
+        assert 'trips_ij' not in report
+        assert report['km_ij']['saved_bytes'] == 9 * 4
+        assert report['param_g']['max_rounding_error'] > 0
+        assert report['param_g']['max_rounding_error'] < 1e-7
+        # computed block by block
+        arr = np.random.default_rng(1).random((7, 5))
+        assert storage_rounding_error(arr, np.dtype('f4'), chunk_size=10) == \
+            rounding_error(arr, arr.astype('f4'))
+
+        # the arrays are read with the dtype of the memoryviews
+        new_example = Example.from_netcdf(tempfile_h5)
+        assert new_example.param_g.dtype == np.dtype('f8')
+        np.testing.assert_allclose(new_example.param_g, example.param_g,
+                                   rtol=1e-7)
+        with pytest.raises(KeyError):
+            precision_example.set_precision(overrides={'unknown': 'f4'})
+
+    def test_09h_memory_report(self, example: Example, tmp_path):
+        """Test the memory accounting"""
+        memory_example = Example(groups=2, origins=3)
+        memory_example.memmap_folder = str(tmp_path)
+        memory_example.init_array('trips_ij', backing='memmap')
+        memory_example.groupnames_g[:] = ['Female', 'Male']
+        report = memory_example.memory_report()
+        arrays = report['arrays']
+        assert arrays['km_ij'] == dict(nbytes=72, storage='owned',
+                                       dims=('origins', 'destinations'))
+        assert arrays['trips_ij']['storage'] == 'mmapped'
+        # object arrays include the size of the objects
+        assert arrays['groupnames_g']['nbytes'] > 16
+        # the components of sparse matrices are grouped by its dimensions
+        indptr = arrays['km_csr_ij_indptr']
+        assert indptr['dims'] == ('origins', 'destinations')
+        dims = report['dimensions'][('origins', 'destinations')]
+        assert dims == dict(owned=72 + indptr['nbytes'], shared=0, mmapped=72)
+        assert sum(report['total'].values()) == sum(
+            a['nbytes'] for a in arrays.values())
+        assert report['peak'] >= arrays['km_ij']['nbytes']
+        assert report['budget'] is None
+
+        # the arrays of a fork are shared
+        fork = memory_example.fork()
+        assert fork.memory_report()['arrays']['km_ij']['storage'] == 'shared'
+
+        # the budget raises before an allocation would exceed it
+        owned = memory_example.memory_report()['total']['owned']
+        memory_example.memory_budget = owned + 100
+        memory_example.set_array('km_ij', np.ones((3, 3)))
+        memory_example.resize_dimension('destinations', 4)
+        with pytest.raises(MemoryBudgetError):
+            memory_example.resize_dimension('origins', 10)
+        assert memory_example.origins == 3
+        with pytest.raises(MemoryBudgetError):
+            memory_example.init_array('km_ij', (100, 100))
+        with pytest.raises(MemoryBudgetError):
+            memory_example.set_array('persons_gi', np.ones((2, 300)), (2, 300))
+        assert memory_example.persons_gi.shape == (2, 3)
+        # memory-mapped arrays do not count
+        memory_example.init_array('km_ij', (100, 100), backing='memmap')
+        assert memory_example.peak_nbytes <= memory_example.memory_budget
+
+        # the running sum of the owned bytes matches the arrays
+        fork.materialize('km_ij')
+        for model in (memory_example, fork):
+            arrays = model.memory_report()['arrays']
+            assert model._owned_nbytes() == sum(
+                getattr(model, f'_{name}').nbytes
+                for name, a in arrays.items() if a['storage'] == 'owned')
+
+    def test_09i_init_writes_arrays(self, km_ij: np.ndarray, jobs: np.ndarray,
+                                    persons_gi: np.ndarray, tmp_path):
+        """Test the constructors of instances with arrays set in __init__"""
+        example = PresetExample(2, 3, threading=False)
+        np.testing.assert_array_equal(example.jobs_j, 7)
+        example.km_ij = km_ij
+        example.persons_gi = persons_gi
+        child = example.fork()
+        np.testing.assert_array_equal(child.jobs_j, 7)
+        np.testing.assert_array_equal(child.km_ij, km_ij)
+
+        example.jobs_j = jobs
+        filepath = str(tmp_path / 'preset.h5')
+        folder = str(tmp_path / 'preset')
+        example.save_dataset_to_netcdf(filepath)
+        example.save_checkpoint(folder)
+        # the arrays read replace the ones written in __init__
+        for new_example in (PresetExample.from_netcdf(filepath),
+                            PresetExample.from_netcdf(filepath, lazy=True),
+                            PresetExample.load_checkpoint(folder)):
+            np.testing.assert_array_equal(new_example.jobs_j, jobs)
+            np.testing.assert_array_equal(new_example.persons_gi, persons_gi)
+            assert not new_example._deferred_arrays
+
     def test_10_test_model(self, example: Example):
         """Test the Example CDefClass model"""
         # backup the jobs
@@ -322,6 +958,533 @@ jobs_j: shape target: \[3\], actual: \(2,\)
             assert np.dtype(dtype.dtype) == data_array.dtype,  'dtype not correct'
         print(example.ds)
 
+    def test_11a_linked_dataset(self, persons_gi: np.ndarray):
+        """Test that the Dataset is updated, when arrays are set"""
+        example = Example(2, 3, threading=False)
+        example.zonenumbers_i = np.array([100, 200, 300])
+        example.groupnames_g = np.array(['Female', 'Male'], dtype='O')
+        example.create_ds()
+        origins = example.ds.indexes['origins']
+
+        # the dimensions of the variables are derived only once
+        dims = example._ds_dims()
+        example.km_ij = np.ones((3, 3))
+        assert example._ds_dims() is dims
+
+        # setting an array replaces only its variable
+        example.persons_gi = persons_gi * 2
+        assert np.shares_memory(example.ds.persons_gi.values, example.persons_gi)
+        np.testing.assert_array_equal(example.ds.persons_gi, persons_gi * 2)
+        assert example.ds.indexes['origins'] is origins
+
+        # the coordinates are rebuilt, when their array is set
+        example.zonenumbers_i = np.array([10, 20, 30])
+        np.testing.assert_array_equal(example.ds.origins, [10, 20, 30])
+        np.testing.assert_array_equal(example.ds.destinations, [10, 20, 30])
+
+        # and when the length of the dimension changes
+        example.resize_dimension('groups', 3)
+        assert example.ds.sizes['groups'] == 3
+        assert np.shares_memory(example.ds.param_g.values, example.param_g)
+        assert example.ds.groupnames_g.shape == (3, )
+
+        # a new dimension of an array invalidates them
+        example.dtypes['jobs_j'].shape = 'origins'
+        assert list(example._ds_dims()['jobs_j']) == ['origins']
+
+    def test_21_lazy_netcdf(self, example: Example, tempfile_h5: str):
+        """Test reading a netcdf-file lazily and selectively"""
+        example.groupnames_g = np.array(['Female', 'Male'], dtype='O')
+        example.calc_model()
+        example.save_dataset_to_netcdf(tempfile_h5)
+
+        # read only the selected variables
+        selected = Example.from_netcdf(tempfile_h5, variables=['trips_ij'])
+        np.testing.assert_array_equal(selected.trips_ij, example.trips_ij)
+        # the other arrays keep the default values
+        np.testing.assert_array_equal(selected.param_g, [-0.1, -0.1])
+        with pytest.raises(KeyError):
+            Example.from_netcdf(tempfile_h5, variables=['unknown'])
+
+        # map the contiguous variables into memory
+        lazy = Example.from_netcdf(tempfile_h5, lazy=True)
+        descr = lazy.dtypes['trips_ij']
+        assert descr.storage == 'memmap'
+        assert descr.filename == tempfile_h5
+        np.testing.assert_array_equal(lazy.trips_ij, example.trips_ij)
+        # object arrays are read on first access
+        assert 'groupnames_g' in lazy.lazy_arrays
+        np.testing.assert_array_equal(lazy.groupnames_g, ['Female', 'Male'])
+        assert 'groupnames_g' not in lazy.lazy_arrays
+        lazy.load()
+        assert not lazy.lazy_arrays
+
+        # the mapped arrays are copy-on-write and can be used by the model
+        lazy.persons_gi[:] *= 2
+        lazy.calc_model()
+        np.testing.assert_allclose(lazy.trips_ij, example.trips_ij * 2)
+        with xr.open_dataset(tempfile_h5, engine='h5netcdf') as ds:
+            np.testing.assert_array_equal(ds.trips_ij, example.trips_ij)
+
+    def test_21a_compressed_netcdf(self, tmp_path):
+        """Test writing chunked and compressed netcdf-files"""
+        import h5py
+        assert default_chunks((100, 100), 8, chunk_bytes=8000) == (10, 100)
+        assert default_chunks((3, 100, 100), 8, chunk_bytes=8000) == (1, 10, 100)
+        assert default_chunks((100, 100), 8, 8000, fixed={0: 5}) == (5, 100)
+
+        example = Example(groups=2, origins=100, threading=False)
+        example.km_ij = np.arange(100 * 100).reshape(100, 100) / 7
+        example.jobs_j = np.arange(100)
+        example.persons_gi = np.full((2, 100), 10)
+        example.calc_model()
+        uncompressed = str(tmp_path / 'uncompressed.h5')
+        serial = str(tmp_path / 'serial.h5')
+        parallel = str(tmp_path / 'parallel.h5')
+        # by default the arrays are not compressed
+        example.save_dataset_to_netcdf(uncompressed)
+        example.save_dataset_to_netcdf(serial, compression='gzip',
+                                       chunk_bytes=8000)
+        example.save_dataset_to_netcdf(
+            parallel, compression='gzip', chunk_bytes=8000, n_threads=2,
+            chunk_dims={'destinations': 50},
+            encoding={'trips_ij': {'compression': None}})
+
+        with h5py.File(uncompressed, 'r') as f:
+            assert f['km_ij'].compression is None
+            assert f['km_ij'].chunks is None
+        with h5py.File(serial, 'r') as f:
+            assert f['km_ij'].chunks == (10, 100)
+            assert f['km_ij'].compression == 'gzip'
+            assert f['km_ij'].shuffle
+            # small arrays stay contiguous
+            assert f['param_g'].chunks is None
+        with h5py.File(parallel, 'r') as f:
+            assert f['km_ij'].chunks == (20, 50)
+            assert f['km_ij'].compression == 'gzip'
+            assert f['trips_ij'].compression is None
+
+        for filepath in (uncompressed, serial, parallel):
+            with xr.open_dataset(filepath, engine='h5netcdf') as ds:
+                np.testing.assert_array_equal(ds.km_ij, example.km_ij)
+                np.testing.assert_array_equal(ds.trips_ij, example.trips_ij)
+            new_example = Example.from_netcdf(filepath)
+            np.testing.assert_array_equal(new_example.km_ij, example.km_ij)
+
+    def test_21b_checkpoint(self, example: Example, tmp_path):
+        """Test saving and loading a checkpoint of .npy-files"""
+        example.groupnames_g = np.array(['Female', 'Male'], dtype='O')
+        example.km_csr_ij = np.array([[1., np.inf, 3.],
+                                      [np.inf, 2., np.inf],
+                                      [4., np.inf, 5.]])
+        example.calc_model()
+        folder = str(tmp_path / 'checkpoint')
+        example.save_checkpoint(folder)
+
+        restored = Example.load_checkpoint(folder)
+        for name in example.dtypes:
+            np.testing.assert_array_equal(getattr(restored, name),
+                                          getattr(example, name))
+        # the numeric arrays are mapped into memory without a copy
+        descr = restored.dtypes['trips_ij']
+        assert descr.storage == 'memmap'
+        assert descr.filename == os.path.join(folder, 'trips_ij.npy')
+        assert restored.dtypes['km_ij'].n_copies == 0
+        assert restored.km_csr_ij.nnz == 5
+
+        # copy-on-write leaves the checkpoint unchanged
+        restored.persons_gi[:] *= 2
+        restored.calc_model()
+        np.testing.assert_allclose(restored.trips_ij, example.trips_ij * 2)
+        again = Example.load_checkpoint(folder)
+        np.testing.assert_array_equal(again.trips_ij, example.trips_ij)
+
+        # saving into the checkpoint loaded from replaces the files
+        restored.save_checkpoint(folder)
+        again = Example.load_checkpoint(folder)
+        np.testing.assert_allclose(again.trips_ij, example.trips_ij * 2)
+
+        with pytest.raises(ValueError):
+            Example.load_checkpoint(folder, mode='r')
+
+        # object arrays are stored as codes and labels, not pickled
+        restored.zonenames_i = np.array(['Köln', None, 'Köln'], dtype='O')
+        restored.save_checkpoint(folder)
+        codes = np.load(os.path.join(folder, 'zonenames_i.npy'),
+                        allow_pickle=False)
+        np.testing.assert_array_equal(codes, [0, -1, 0])
+        again = Example.load_checkpoint(folder)
+        assert list(again.zonenames_i) == ['Köln', None, 'Köln']
+        np.testing.assert_array_equal(again.groupnames_g, ['Female', 'Male'])
+        restored.zonenames_i = np.array(['Köln', 1, 'Bonn'], dtype='O')
+        with pytest.raises(TypeError, match='zonenames_i: only object arrays'):
+            restored.save_checkpoint(folder)
+
+    def test_21c_dirty_arrays(self, km_ij: np.ndarray, jobs: np.ndarray,
+                              persons_gi: np.ndarray, tmp_path):
+        """Test the tracking of changed arrays for incremental saves"""
+        example = Example(2, 3, threading=False)
+        example.km_ij = km_ij
+        example.jobs_j = jobs
+        example.persons_gi = persons_gi
+        example.groupnames_g = np.array(['Female', 'Male'], dtype='O')
+        assert {'trips_ij', 'param_g'} <= example.dirty_arrays
+        filepath = str(tmp_path / 'incremental.h5')
+        folder = str(tmp_path / 'checkpoint')
+        example.save_dataset_to_netcdf(filepath, incremental=True)
+        example.save_checkpoint(folder)
+        assert not example.dirty_arrays
+
+        # resetting an array marks it
+        example.reset_array('trips_ij')
+        assert example.dirty_arrays == {'trips_ij'}
+        example.save_checkpoint(folder, incremental=True)
+        assert not example.dirty_arrays
+
+        # calc_model resets the results it writes from the cython code
+        example.calc_model()
+        assert example.dirty_arrays == {'trips_ij'}
+        example.save_checkpoint(folder, incremental=True)
+        # other arrays written in place have to be marked
+        example.mark_dirty('trips_ij')
+        example.param_g = [-0.2, -0.3]
+        assert example.dirty_arrays == {'trips_ij', 'param_g'}
+        with pytest.raises(KeyError):
+            example.mark_dirty('unknown')
+
+        # only the dirty arrays are written
+        mtime = os.stat(os.path.join(folder, 'km_ij.npy')).st_mtime_ns
+        example.save_checkpoint(folder, incremental=True)
+        assert os.stat(os.path.join(folder, 'km_ij.npy')).st_mtime_ns == mtime
+        restored = Example.load_checkpoint(folder)
+        np.testing.assert_array_equal(restored.trips_ij, example.trips_ij)
+        np.testing.assert_array_equal(restored.param_g, [-0.2, -0.3])
+
+        example.save_dataset_to_netcdf(filepath, incremental=True)
+        assert not example.dirty_arrays
+        with xr.open_dataset(filepath, engine='h5netcdf') as ds:
+            np.testing.assert_array_equal(ds.trips_ij, example.trips_ij)
+            np.testing.assert_array_equal(ds.param_g, [-0.2, -0.3])
+            np.testing.assert_array_equal(decode_objects(ds).groups,
+                                          ['Female', 'Male'])
+
+        # a changed shape rewrites the file
+        example.resize_dimension('groups', 3)
+        example.groupnames_g = np.array(['Female', 'Male', 'Child'], dtype='O')
+        example.save_dataset_to_netcdf(filepath, incremental=True)
+        with xr.open_dataset(filepath, engine='h5netcdf') as ds:
+            assert ds.sizes['groups'] == 3
+
+    def test_21d_save_async(self, km_ij: np.ndarray, jobs: np.ndarray,
+                            persons_gi: np.ndarray, tmp_path):
+        """Test saving snapshots in the background"""
+        example = Example(2, 3, threading=False)
+        example.km_ij = km_ij
+        example.jobs_j = jobs
+        example.max_saves_in_flight = 1
+        futures = {}
+        expected = {}
+        for i in range(3):
+            example.persons_gi = persons_gi * (i + 1)
+            example.calc_model()
+            example.mark_dirty('trips_ij')
+            filepath = str(tmp_path / f'iteration_{i}.h5')
+            futures[filepath] = example.save_async(filepath)
+            expected[filepath] = example.trips_ij.copy()
+            # the next iteration changes the arrays while the file is written
+            example.trips_ij[:] = -1
+        assert example.wait_for_saves()
+        assert example.pending_saves == 0
+        # the snapshot buffers are reused
+        assert len(example._snapshot_buffers) == 1
+        for filepath, future in futures.items():
+            assert future.result() == filepath
+            with xr.open_dataset(filepath, engine='h5netcdf') as ds:
+                np.testing.assert_array_equal(ds.trips_ij, expected[filepath])
+        # arrays marked after the snapshot stay dirty
+        example.mark_dirty('trips_ij')
+        example.save_async(str(tmp_path / 'last.h5'))
+        example.mark_dirty('param_g')
+        example.wait_for_saves()
+        assert example.dirty_arrays == {'param_g'}
+
+    def test_21e_object_encoding(self, tmp_path):
+        """Test the encodings of object arrays in netcdf-files"""
+        example = Example(2, 4, threading=False)
+        example.groupnames_g = np.array(['Female', 'Male'], dtype='O')
+        zonenames = np.array(['Köln', 'Bonn', None, 'Köln'], dtype='O')
+        example.zonenames_i = zonenames
+        for method in OBJECT_ENCODINGS:
+            example.object_encoding = method
+            filepath = str(tmp_path / f'{method}.h5')
+            example.save_dataset_to_netcdf(filepath)
+            with xr.open_dataset(filepath, engine='h5netcdf') as ds:
+                if method == 'categorical':
+                    np.testing.assert_array_equal(ds.zonenames_i, [0, 1, -1, 0])
+                    np.testing.assert_array_equal(
+                        ds.zonenames_i_labels, ['Köln'.encode(), b'Bonn'])
+                elif method == 'fixed':
+                    assert ds.zonenames_i.dtype == 'S5'
+                else:
+                    # variable-length strings
+                    assert ds.zonenames_i.dtype.kind == 'U'
+            new_example = Example.from_netcdf(filepath)
+            zonenames_i = new_example.zonenames_i
+            np.testing.assert_array_equal(zonenames_i[[0, 1, 3]],
+                                          ['Köln', 'Bonn', 'Köln'])
+            # missing values are kept only by the categorical encoding,
+            # otherwise they are read as empty strings
+            if method == 'categorical':
+                assert np.isnan(zonenames_i[2])
+            else:
+                assert zonenames_i[2] == ''
+            np.testing.assert_array_equal(new_example.groupnames_g,
+                                          ['Female', 'Male'])
+            assert 'zonenames_i_labels' not in new_example.ds
+
+        # object coordinates are encoded as well
+        ds = xr.Dataset({'a': ('x', [1., 2., 3.])},
+                        coords={'x': np.array(['Köln', 'Bonn', 'Kiel'], dtype='O'),
+                                'y': ('x', np.array(['a', None, 'a'], dtype='O'))})
+        for method in ('categorical', 'fixed'):
+            filepath = str(tmp_path / f'coords_{method}.h5')
+            encoded = encode_objects(ds, method)
+            assert encoded.x.dtype != 'O' and encoded.y.dtype != 'O'
+            assert set(encoded.coords) == {'x', 'y'}
+            encoded.to_netcdf(filepath, engine='h5netcdf')
+            with xr.open_dataset(filepath, engine='h5netcdf') as stored:
+                decoded = decode_objects(stored.load())
+            assert set(decoded.coords) == {'x', 'y'}
+            np.testing.assert_array_equal(decoded.x, ['Köln', 'Bonn', 'Kiel'])
+            np.testing.assert_array_equal(decoded.y[[0, 2]], ['a', 'a'])
+            assert set(decoded.data_vars) == {'a'}
+
+        # object arrays with other objects than strings are not encoded
+        ds = xr.Dataset({'a': ('x', np.array([1, 'a'], dtype='O'))})
+        assert encode_objects(ds).a.dtype == 'O'
+        with pytest.raises(ValueError):
+            encode_objects(ds, 'pickle')
+
+    def test_21f_select_netcdf(self, km_ij: np.ndarray, jobs: np.ndarray,
+                               persons_gi: np.ndarray, tmp_path):
+        """Test reading a part of the zones and groups from a netcdf-file"""
+        example = Example(2, 3, threading=False)
+        example.km_ij = km_ij
+        example.km_csr_ij = km_ij * (km_ij < 5)
+        example.jobs_j = jobs
+        example.persons_gi = persons_gi
+        example.zonenumbers_i = np.array([100, 200, 300])
+        example.groupnames_g = np.array(['Female', 'Male'], dtype='O')
+        example.calc_model()
+        filepath = str(tmp_path / 'national.h5')
+        example.save_dataset_to_netcdf(filepath)
+
+        zones = [0, 2]
+        select = {'groups': [1], 'origins': zones, 'destinations': zones}
+        for lazy in (False, True):
+            regional = Example.from_netcdf(filepath, select=select, lazy=lazy)
+            if lazy:
+                # the arrays read on first access are not allocated before
+                assert 'persons_gi' in regional.lazy_arrays
+                report = regional.memory_report()['arrays']
+                assert not report.get('persons_gi', {}).get('nbytes')
+            regional.load()
+            assert (regional.groups, regional.origins) == (1, 2)
+            np.testing.assert_array_equal(regional.zonenumbers_i, [100, 300])
+            np.testing.assert_array_equal(regional.groupnames_g, ['Male'])
+            np.testing.assert_array_equal(regional.persons_gi,
+                                          persons_gi[[1]][:, zones])
+            np.testing.assert_array_equal(regional.km_ij,
+                                          km_ij[zones][:, zones])
+            np.testing.assert_array_equal(
+                regional.km_csr_ij.toarray(),
+                example.km_csr_ij.toarray()[zones][:, zones])
+            np.testing.assert_array_equal(regional.param_g, [-0.1])
+        # only the methods decorated read the lazy arrays before they run,
+        # the others keep the dispatch of cython
+        assert Example.calc_model is _Example.calc_model
+        regional = LazyExample.from_netcdf(filepath, select=select, lazy=True)
+        regional.calc_model()
+        assert not regional.lazy_arrays
+        np.testing.assert_allclose(regional.trips_ij.sum(1),
+                                   persons_gi[1, zones])
+        # the regional model can be calculated
+        regional = Example.from_netcdf(filepath, select=select)
+        np.testing.assert_array_equal(regional.ds.origins, [100, 300])
+        regional.calc_model()
+        np.testing.assert_allclose(regional.trips_ij.sum(1),
+                                   persons_gi[1, zones])
+        np.testing.assert_array_equal(regional.ds.trips_ij, regional.trips_ij)
+
+        with pytest.raises(KeyError):
+            Example.from_netcdf(filepath, select={'zones': [0]})
+
+    def test_21g_arrow(self, example: Example, tmp_path):
+        """Test the export of arrays to Arrow"""
+        pa = pytest.importorskip('pyarrow')
+        import pyarrow.feather
+        example.zonenumbers_i = np.array([100, 200, 300])
+        example.groupnames_g = np.array(['Female', 'Male'], dtype='O')
+        example.calc_model()
+        # by default the coordinates are stored only in the metadata
+        batch = example.to_arrow(['km_ij', 'trips_ij'])
+        assert batch.schema.names == ['km_ij', 'trips_ij']
+        coords = json.loads(batch.schema.metadata[b'cythonarrays.coords'])
+        assert coords == {'origins': [100, 200, 300],
+                          'destinations': [100, 200, 300]}
+        batch = example.to_arrow(['km_ij', 'trips_ij'], coordinates=True)
+        assert batch.schema.names == ['origins', 'destinations',
+                                      'km_ij', 'trips_ij']
+        assert batch.num_rows == 9
+        np.testing.assert_array_equal(batch.column('origins'),
+                                      np.repeat([100, 200, 300], 3))
+        np.testing.assert_array_equal(batch.column('destinations'),
+                                      np.tile([100, 200, 300], 3))
+        # the columns share the memory with the arrays
+        trips = batch.column('trips_ij').to_numpy(zero_copy_only=True)
+        assert np.shares_memory(trips, example.trips_ij)
+        assert batch.schema.metadata[b'cythonarrays.shape'] == b'[3, 3]'
+        batch = example.to_arrow(['param_g'], coordinates=True)
+        assert batch.column('groups').to_pylist() == ['Female', 'Male']
+        with pytest.raises(ValueError):
+            example.to_arrow(['km_ij', 'param_g'])
+
+        tensor = example.to_arrow_tensor('persons_gi')
+        assert tensor.dim_names == ['groups', 'origins']
+        assert np.shares_memory(tensor.to_numpy(), example.persons_gi)
+
+        # write an IPC stream to a file-like object and a feather-file
+        sink = pa.BufferOutputStream()
+        example.write_arrow(sink, ['trips_ij'])
+        table = pa.ipc.open_stream(sink.getvalue()).read_all()
+        np.testing.assert_array_equal(table.column('trips_ij'),
+                                      example.trips_ij.ravel())
+        filepath = str(tmp_path / 'trips.feather')
+        example.write_arrow(filepath, ['trips_ij'], format='feather')
+        table = pyarrow.feather.read_table(filepath)
+        assert table.column_names == ['trips_ij']
+        np.testing.assert_array_equal(table.column('trips_ij'),
+                                      example.trips_ij.ravel())
+        with pytest.raises(ValueError):
+            example.write_arrow(filepath, ['trips_ij'], format='parquet')
+
+    def test_21h_stream_groups(self, km_ij: np.ndarray, jobs: np.ndarray,
+                               tmp_path):
+        """Test streaming the trips of each group to sinks"""
+        groups = 5
+        example = Example(groups, 3)
+        example.km_ij = km_ij
+        example.jobs_j = jobs
+        example.persons_gi = np.arange(groups * 3).reshape(groups, 3)
+        example.zonenumbers_i = np.array([100, 200, 300])
+        example.calc_model()
+        expected = example.trips_ij.copy()
+
+        # a callback with a buffer of one array
+        trips_gij = {}
+        stream = GroupStream(lambda g, arr: trips_gij.update({g: arr}),
+                             maxsize=1)
+        with stream:
+            example.calc_model_groups(stream)
+        assert stream.n_written == groups
+        np.testing.assert_allclose(sum(trips_gij.values()), expected)
+        np.testing.assert_allclose(example.trips_ij, expected)
+        np.testing.assert_allclose(trips_gij[4].sum(1),
+                                   example.persons_gi[4])
+
+        # an append-only file
+        filename = str(tmp_path / 'trips.bin')
+        with GroupStream(AppendFileSink(filename)) as stream:
+            example.calc_model_groups(stream)
+        records = read_group_records(filename, (3, 3))
+        assert sorted(records['group']) == list(range(groups))
+        np.testing.assert_allclose(records['data'].sum(0), expected)
+
+        # the trips are summed up in several blocks of rows
+        zones = 150
+        large = Example(groups, zones)
+        large.km_ij = np.arange(zones * zones).reshape(zones, zones) % 17
+        large.jobs_j = np.arange(zones)
+        large.persons_gi = np.ones((groups, zones))
+        large.calc_model()
+        large_expected = large.trips_ij.copy()
+        with GroupStream(lambda g, arr: None) as stream:
+            large.calc_model_groups(stream)
+        np.testing.assert_allclose(large.trips_ij, large_expected)
+
+        # a netcdf-variable along the groups
+        filepath = str(tmp_path / 'trips.h5')
+        sink = NetCDFSink(filepath, 'trips_gij', groups,
+                          ('origins', 'destinations'), (3, 3),
+                          coords={'origins': example.zonenumbers_i})
+        with GroupStream(sink) as stream:
+            example.calc_model_groups(stream)
+        with xr.open_dataset(filepath, engine='h5netcdf') as ds:
+            assert ds.trips_gij.dims == ('groups', 'origins', 'destinations')
+            np.testing.assert_allclose(ds.trips_gij.sum('groups'), expected)
+            np.testing.assert_array_equal(ds.origins, [100, 200, 300])
+
+        # errors of the sink are raised, when the stream is closed
+        def fail(g, arr):
+            raise IOError('disk full')
+
+        with pytest.raises(IOError):
+            with GroupStream(fail, maxsize=1) as stream:
+                example.calc_model_groups(stream)
+
+    def test_21i_nogil_events(self, km_ij: np.ndarray, jobs: np.ndarray,
+                              caplog):
+        """Test logging events without the gil in the parallel block"""
+        groups = 5
+        example = Example(groups, 3)
+        example.km_ij = km_ij
+        example.jobs_j = jobs
+        example.persons_gi = np.ones((groups, 3))
+        logger = example.logger
+        with caplog.at_level(logging.INFO, logger=logger.name):
+            example.calc_model()
+        messages = [record.getMessage() for record in caplog.records]
+        assert sorted(messages) == [f'calculate group {g}'
+                                    for g in range(groups)]
+        # the events have been drained
+        assert not len(example.drain_events())
+
+        # the relative time of the records refers to the start of logging
+        def start_time(record: logging.LogRecord) -> float:
+            return record.created - record.relativeCreated / 1000
+        assert start_time(caplog.records[0]) == pytest.approx(
+            start_time(logging.makeLogRecord({})), abs=0.01)
+
+        # the events of threads without a ring buffer are counted
+        example = Example(groups, 3)
+        assert not example.log_event(7, 0)
+        assert example.dropped_events == 1
+        example.init_events(1, capacity=3)
+        for index in range(5):
+            example.log_event(7, index)
+        assert example.dropped_events == 3
+        events = example.drain_events()
+        assert events.dtype == EVENT_DTYPE
+        np.testing.assert_array_equal(events['index'], [0, 1, 2])
+        assert (np.diff(events['timestamp']) >= 0).all()
+        # the ring buffer accepts events again
+        assert example.log_event(7, 5)
+
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger=logger.name):
+            # pending events are kept, when the buffers are reallocated
+            example.init_events(2)
+            with EventFlusher(example, logger, {7: 'step {index}'},
+                              interval=0.01) as flusher:
+                example.log_event(8, 6)
+        assert flusher.n_flushed == 2
+        assert example.dropped_events == 3
+        messages = [record.getMessage() for record in caplog.records]
+        assert messages == ['step 5', 'event 8 at index 6']
+        assert caplog.records[0].created == pytest.approx(
+            events['timestamp'][-1], abs=1)
+        assert flush_events(example, logger) == 0
+
     @pytest.mark.xfail(
         sys.version_info < (3, 7),
         reason='Somehow in the test configuration the netcdf-backend is not found')
@@ -444,6 +1607,26 @@ class Test04_Test_Instantiation:
             example = _Example()
         print(e.value)
 
+    def test043_test_schema_cache(self, persons_gi: np.ndarray):
+        """the memoryview schema is searched only for the first instance"""
+        groups, zones = persons_gi.shape
+        _memview_schemas.pop(Example, None)
+        example1 = Example(groups, zones)
+        assert Example in _memview_schemas
+        example2 = Example(groups, zones)
+        for name, descr1 in example1.dtypes.items():
+            descr2 = example2.dtypes[name]
+            # each instance has its own descriptors
+            assert descr1 is not descr2
+            assert descr1.dtype == descr2.dtype
+            assert descr1.ndim == descr2.ndim
+
+        # changing the shape of one instance does not affect the other
+        example2.init_array('jobs_j', shape='groups')
+        assert example1.dtypes['jobs_j'].shape == ['destinations']
+        assert example1.jobs_j.shape == (zones, )
+        assert example2.jobs_j.shape == (groups, )
+
     def test042_test_nan(self, persons_gi: np.ndarray):
         """Test nan"""
         groups, zones = persons_gi.shape
@@ -7,9 +7,16 @@ Created on Fri Jun 10 21:00:21 2016
 from setuptools.dist import Distribution
 from setuptools.command.build_ext import build_ext
 import importlib.util
+import shutil
+import sys
 import numpy as np
 import os
-from cythonarrays.make_cython_extensions import make_extensions
+from cythonarrays.make_cython_extensions import (make_extensions,
+                                                 read_array_schema,
+                                                 write_schema_module)
+from cythonarrays.tests.example_python import Example
+from cythonarrays.tests.simple_python import Simple
+from cythonarrays.array_shapes import _memview_schemas, load_schema
 
 
 class TestMakeExtensions:
@@ -60,3 +67,60 @@ class TestMakeExtensions:
         np.testing.assert_almost_equal(ex.rowsums, [51.6, 251.4])
         assert ret == 151.5
         print('Calculation successful')
+
+    def test_02_read_array_schema(self):
+        """Test that the schema read from the .pxd-file
+        matches the memoryviews searched at runtime"""
+        pxd_filename = os.path.join(os.path.dirname(__file__),
+                                    'example_cython.pxd')
+        schemas = read_array_schema(pxd_filename)
+        assert list(schemas) == ['_Example']
+
+        example = Example(2, 3)
+        runtime_schema = tuple((descr.name, descr.dtype, descr.ndim)
+                               for descr in example.dtypes.values()
+                               if descr.dtype != 'O')
+        assert schemas['_Example'] == runtime_schema
+
+        # a pxd-file without arrays of ArrayShapes results in no schema
+        pxd_filename = os.path.join(os.path.dirname(__file__),
+                                    'examplepackage', 'example2_cython.pxd')
+        assert not read_array_schema(pxd_filename)
+
+    def test_03_load_schema(self, tmpdir, monkeypatch):
+        """Test that ArrayShapes uses the schema module"""
+        pxd_filename = os.path.join(tmpdir.strpath, 'simple_cython.pxd')
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'simple_cython.pxd'),
+                    pxd_filename)
+        schema_filename = write_schema_module(
+            pxd_filename, os.path.join(tmpdir.strpath, 'simple_cython_schema.py'))
+        modname = 'cythonarrays.tests.simple_cython_schema'
+        spec = importlib.util.spec_from_file_location(modname, schema_filename)
+        schema_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(schema_module)
+        monkeypatch.setitem(sys.modules, modname, schema_module)
+
+        _Simple = Simple.__mro__[1]
+        assert load_schema(_Simple) == schema_module.array_schemas['_Simple']
+        assert load_schema(Simple) is None
+
+        _memview_schemas.pop(Simple, None)
+        simple = Simple(2, 3)
+        for name, dtype, ndim in schema_module.array_schemas['_Simple']:
+            descr = simple.dtypes[name]
+            assert (descr.dtype, descr.ndim) == (dtype, ndim)
+        np.testing.assert_array_equal(simple.param_g, [-0.1, -0.1])
+        _memview_schemas.pop(Simple, None)
+
+        # a schema of a changed .pxd-file is rejected
+        with open(pxd_filename, 'a') as f:
+            f.write('\n# changed\n')
+        assert load_schema(_Simple) is None
+        simple = Simple(2, 3)
+        for name, dtype, ndim in schema_module.array_schemas['_Simple']:
+            assert simple.dtypes[name].ndim == ndim
+        _memview_schemas.pop(Simple, None)
+
+        # as well as a schema without hash
+        del schema_module.pxd_hash
+        assert load_schema(_Simple) is None